@@ -1,11 +1,16 @@
 from __future__ import annotations
 from pydantic import BaseModel, Field, HttpUrl
-from typing import List, Optional
+from typing import Annotated, List, Optional
 from datetime import datetime
 
 class AskRequest(BaseModel):
     message: str = Field(..., min_length=1, max_length=2000)
 
+class AskBatchRequest(BaseModel):
+    messages: List[Annotated[str, Field(min_length=1, max_length=2000)]] = Field(..., min_length=1)
+    # Replays of already-logged traffic should not be logged again
+    log: bool = False
+
 class AskResponse(BaseModel):
     reply: str
     suggestions: Optional[List[str]] = None
@@ -1,69 +1,113 @@
 from __future__ import annotations
+import asyncio
 from fastapi import APIRouter, Depends, UploadFile, File, Form, Query
-from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse
-from pathlib import Path
-import csv
-import io
-from typing import List, Dict
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from datetime import datetime, timezone
+from urllib.parse import urlencode
+from typing import Dict, List, Optional
+from app.services.assets import static_assets, templates
 from app.services.auth import get_admin
-from app.services.data import DataService
-from app.routers.public import set_data
+from app.services.data import DEFAULT_KB, DataService, kb_paths
+from app.services.logging import LogService
+from app.services.snapshot import KBDiff
+from app.routers.public import reload_data, reload_status, stats as public_stats
 import html as _html
 
 router = APIRouter()
 
+# One upload per KB at a time, so each one's diff is exactly its change to the stored KB
+_upload_locks: Dict[str, asyncio.Lock] = {}
+
 
 @router.get("/admin", response_class=HTMLResponse)
 async def admin_ui(_: str = Depends(get_admin)):
-        html = Path("app/templates/admin.html").read_text(encoding="utf-8")
-        return HTMLResponse(content=html)
+        return HTMLResponse(content=templates.get("admin.html"))
+
+
+@router.get("/admin/stats")
+async def admin_stats(_: str = Depends(get_admin)):
+        return JSONResponse(public_stats())
 
 
 @router.post("/admin/upload")
 async def admin_upload(
         file: UploadFile = File(...),
         mode: str = Form("replace"),
+        kb: str = Form(DEFAULT_KB),
         _: str = Depends(get_admin),
 ):
-        name = file.filename or ""
-        content = await file.read()
-        rows: List[Dict[str, str]] = []
-
-        if name.lower().endswith(".csv"):
-                txt = content.decode("utf-8", errors="ignore")
-                reader = csv.DictReader(io.StringIO(txt))
-                rows = list(reader)
-        elif name.lower().endswith(".xlsx"):
+        try:
+                paths = kb_paths(kb)
+        except ValueError as e:
+                return JSONResponse({"error": str(e)}, status_code=400)
+        name = (file.filename or "").lower()
+        if name.endswith(".csv"):
+                rows = DataService.iter_csv_rows(file.file)
+        elif name.endswith(".xlsx"):
                 try:
-                        from openpyxl import load_workbook
+                        import openpyxl  # noqa: F401
                 except Exception:
                         return JSONResponse({"error": "XLSX support not available. Please install openpyxl."}, status_code=400)
-                wb = load_workbook(io.BytesIO(content), read_only=True, data_only=True)
-                ws = wb.active
-                data_iter = ws.iter_rows(values_only=True)
-                try:
-                        header = next(data_iter)
-                except StopIteration:
-                        header = []
-                header = [str(h or '').strip().lower() for h in header]
-                for r in data_iter:
-                        row = {header[i]: ('' if v is None else str(v)) for i, v in enumerate(r) if i < len(header)}
-                        rows.append(row)
+                rows = DataService.iter_xlsx_rows(file.file)
         else:
                 return JSONResponse({"error": "Unsupported file type. Please upload .csv or .xlsx."}, status_code=400)
 
-        items, stats, errors = DataService.upsert_from_rows(rows, mode=mode)
-        if errors:
-                return JSONResponse({"errors": errors}, status_code=400)
+        async with _upload_locks.setdefault(kb, asyncio.Lock()):
+                # Parse, validate and dedupe in one streaming pass over the spooled upload, off the event loop
+                items, stats, errors, puts = await run_in_threadpool(DataService.upsert_changes, rows, mode, paths.data)
+                if errors:
+                        return JSONResponse({"errors": errors}, status_code=400)
+
+                storage = await run_in_threadpool(DataService.save_kb, items, paths.data)
+                diff = None
+                if puts is not None:  # append: the rebuild only applies the uploaded rows
+                        diff = KBDiff(puts, storage, await run_in_threadpool(DataService.kb_fingerprint, paths.data))
+                reload = reload_data(kb, diff)  # rebuilt in the background; poll /admin/upload/status
+        return JSONResponse({"status": "ok", "stats": stats, "mode": mode, "kb": kb, "storage": storage,
+                             "reload": reload})
+
+
+@router.get("/admin/upload/status")
+async def admin_upload_status(kb: str = Query(DEFAULT_KB, max_length=64), _: str = Depends(get_admin)):
+        return JSONResponse(reload_status(kb))
+
+
+@router.get("/admin/export")
+async def admin_export(kb: str = Query(DEFAULT_KB, max_length=64), _: str = Depends(get_admin)):
+        """The stored KB as data.json (journaled changes applied), for backups or moving between servers."""
+        try:
+                paths = kb_paths(kb)
+        except ValueError as e:
+                return JSONResponse({"error": str(e)}, status_code=400)
+        if not paths.data.exists():
+                return JSONResponse({"error": f"Unknown knowledge base: {kb}"}, status_code=404)
+        body = await run_in_threadpool(DataService.export_json, paths.data)
+        return Response(body, media_type="application/json",
+                        headers={"Content-Disposition": f'attachment; filename="{kb}.json"'})
+
 
-        DataService.save_kb(items)
-        set_data()  # hot-reload
-        return JSONResponse({"status": "ok", "stats": stats, "mode": mode})
+def _utc_key(value: Optional[str]) -> Optional[str]:
+        """ISO-8601 date/time -> naive UTC string comparable with logged timestamps (ValueError if invalid)."""
+        if not value:
+                return None
+        dt = datetime.fromisoformat(value.strip())
+        if dt.tzinfo is not None:
+                dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+        return dt.isoformat()
 
 
 @router.get("/admin/unmatched", response_class=HTMLResponse)
-async def admin_unmatched(raw: bool = Query(False), _: str = Depends(get_admin)):
-        p = Path("data/unmatched.csv")
+async def admin_unmatched(
+        raw: bool = Query(False),
+        cursor: Optional[int] = Query(None, ge=0),
+        limit: int = Query(500, ge=1, le=2000),
+        since: Optional[str] = Query(None),
+        until: Optional[str] = Query(None),
+        _: str = Depends(get_admin),
+):
+        log = LogService.unmatched_log()
+        p = log.path
         if not p.exists():
                 # Render page with navbar even if empty
                 empty_html = """
@@ -95,29 +139,45 @@ async def admin_unmatched(raw: bool = Query(False), _: str = Depends(get_admin))
                     <script src='/static/js/bootstrap.bundle.min.js'></script>
                 </body></html>
                 """
-                return HTMLResponse(empty_html)
+                return HTMLResponse(static_assets.versioned(empty_html))
 
         if raw:
-                body = p.read_text(encoding="utf-8")
-                return PlainTextResponse(content=body, media_type="text/csv; charset=utf-8")
-
-        # Parse and render table (latest first)
-        rows: List[Dict[str, str]] = []
-        with p.open("r", encoding="utf-8") as f:
-                reader = csv.DictReader(f)
-                for r in reader:
-                        rows.append(r)
-        rows = list(reversed(rows))
+                # Streamed in chunks; never held in memory whole
+                return StreamingResponse(log.iter_bytes(), media_type="text/csv; charset=utf-8",
+                                         headers={"Content-Disposition": "attachment; filename=unmatched.csv"})
+
+        try:
+                since_key, until_key = _utc_key(since), _utc_key(until)
+        except ValueError:
+                return JSONResponse({"errors": ["since/until must be ISO-8601 dates or times"]}, status_code=400)
+
+        # One page, latest first, read via the sidecar row index
+        page = await run_in_threadpool(log.page, cursor, limit, since_key, until_key)
+        rows = page["rows"]
         headers = ["timestamp", "query", "top_suggestions"]
 
         def td(val: str) -> str:
                 return _html.escape(str(val or ""))
 
+        def cell(r: List[str], i: int) -> str:
+                return td(r[i] if i < len(r) else "")
+
         body_rows = "\n".join(
-                f"<tr><td class='text-nowrap'>{td(r.get('timestamp'))}</td><td>{td(r.get('query'))}</td><td>{td(r.get('top_suggestions'))}</td></tr>"
-                for r in rows[:500]
+                f"<tr><td class='text-nowrap'>{cell(r, 0)}</td><td>{cell(r, 1)}</td><td>{cell(r, 2)}</td></tr>"
+                for r in rows
         )
 
+        def page_url(cur: Optional[int]) -> str:
+                params = {"limit": limit, "since": since or None, "until": until or None, "cursor": cur}
+                return "/admin/unmatched?" + urlencode({k: v for k, v in params.items() if v is not None})
+
+        newer_link = (f"<a class='btn btn-outline-secondary btn-sm' href='{_html.escape(page_url(page['newer_cursor']))}'>&larr; Newer</a>"
+                      if page["has_newer"] else "")
+        older_link = (f"<a class='btn btn-outline-secondary btn-sm' href='{_html.escape(page_url(page['next_cursor']))}'>Older &rarr;</a>"
+                      if page["next_cursor"] is not None else "")
+        first_shown = page["skipped"] + 1 if rows else 0
+        last_shown = page["skipped"] + len(rows)
+
         html = f"""
         <!doctype html><html lang='en'>
         <head>
@@ -146,6 +206,19 @@ async def admin_unmatched(raw: bool = Query(False), _: str = Depends(get_admin))
                     <h1 class='h4 mb-0'>Unmatched Queries</h1>
                     <a class='btn btn-outline-secondary btn-sm' href='/admin/unmatched?raw=1'>Download CSV</a>
                 </div>
+                <form class='row g-2 align-items-end mb-3' method='get' action='/admin/unmatched'>
+                    <div class='col-auto'>
+                        <label class='form-label small mb-0' for='since'>From (UTC)</label>
+                        <input class='form-control form-control-sm' type='datetime-local' step='1' id='since' name='since' value='{td(since)}'>
+                    </div>
+                    <div class='col-auto'>
+                        <label class='form-label small mb-0' for='until'>To (UTC)</label>
+                        <input class='form-control form-control-sm' type='datetime-local' step='1' id='until' name='until' value='{td(until)}'>
+                    </div>
+                    <input type='hidden' name='limit' value='{limit}'>
+                    <div class='col-auto'><button class='btn btn-primary btn-sm' type='submit'>Filter</button></div>
+                    <div class='col-auto'><a class='btn btn-link btn-sm' href='/admin/unmatched'>Clear</a></div>
+                </form>
                 <div class='table-responsive'>
                     <table class='table table-sm table-striped align-middle'>
                         <thead>
@@ -156,9 +229,12 @@ async def admin_unmatched(raw: bool = Query(False), _: str = Depends(get_admin))
                         </tbody>
                     </table>
                 </div>
-                <div class='small text-muted'>Showing {min(len(rows),500)} of {len(rows)} rows (latest first).</div>
+                <div class='d-flex align-items-center justify-content-between'>
+                    <div class='small text-muted'>Showing {first_shown}–{last_shown} of {page['matching']} rows (latest first{'' if page['matching'] == page['total'] else f", {page['total']} in total"}).</div>
+                    <div class='d-flex gap-2'>{newer_link}{older_link}</div>
+                </div>
             </main>
             <script src='/static/js/bootstrap.bundle.min.js'></script>
         </body></html>
         """
-        return HTMLResponse(html)
+        return HTMLResponse(static_assets.versioned(html))
@@ -1,94 +1,401 @@
 from __future__ import annotations
-from fastapi import APIRouter, Request
-from fastapi.responses import HTMLResponse, JSONResponse
-from pathlib import Path
-from app.models.schemas import AskRequest
-from app.services.data import DataService
-from app.services.matcher import Matcher
+import asyncio
+import json
+from typing import Optional
+from time import perf_counter
+from fastapi import APIRouter, Depends, Query, Request
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from app.models.schemas import AskBatchRequest, AskRequest
+from app.services import metrics
+from app.services.assets import templates
+from app.services.auth import get_admin
+from app.services.data import DEFAULT_KB, DataService
 from app.services.logging import LogService
 from app.services.embeddings import EmbeddingsService
+from app.services.executor import ScoringExecutor, QueueFull
+from app.services.ranking import top_k
+from app.services.kb_registry import KBRegistry, KBRuntime
+from app.services.snapshot import KBDiff, KBSnapshot
+from app.services.suggest import HEAD_K
+import os
 
 router = APIRouter()
 
-# Load data and matcher on module import; simple hot-swap via set_data
-_kb_items = DataService.load_kb()
-_questions = [it.question for it in _kb_items]
-_keywords = [it.keywords for it in _kb_items]
-_matcher = Matcher(_questions, _keywords) if _kb_items else None
+# Scoring runs on a bounded pool; when it is saturated /ask answers 503 + Retry-After
+_executor = ScoringExecutor()
+RETRY_AFTER_SECONDS = int(os.getenv("ASK_RETRY_AFTER", "1"))
+# /ask/batch: max messages per request, and messages scored per pool job (one encode each)
+ASK_BATCH_MAX = int(os.getenv("ASK_BATCH_MAX", "5000"))
+ASK_BATCH_CHUNK = max(1, int(os.getenv("ASK_BATCH_CHUNK", "64")))
+# Seconds a later /ask/batch chunk waits for a scoring slot before it and the rest of the
+# batch are answered as busy (status 503 per item)
+ASK_BATCH_BUSY_WAIT = float(os.getenv("ASK_BATCH_BUSY_WAIT", "10"))
+BUSY_REPLY = "The assistant is busy right now. Please try again in a moment."
+# /suggest: default completions per request, and how long clients may cache a response
+SUGGEST_LIMIT = int(os.getenv("SUGGEST_LIMIT", "8"))
+SUGGEST_MAX_AGE = int(os.getenv("SUGGEST_MAX_AGE", "300"))
+
+# Knowledge bases by id (?kb=, default "default"): each one immutable snapshot replaced
+# wholesale by set_data / reload_data, loaded on first use and evicted LRU under KB_MEMORY_MB.
+# The embedding model is shared by every KB and loaded later by warm_up(); until then
+# snapshots are lexical-only. Ranked answers are cached on (kb, snapshot version, message).
 _embed = EmbeddingsService()
-if _embed.enabled:
-    _embed.set_questions(_questions)
+_registry = KBRegistry(_embed)
+_registry.get(DEFAULT_KB)
+
+# ?kb= on the public endpoints
+KB_QUERY = Query(DEFAULT_KB, max_length=64)
+
+
+async def _runtime(kb: str) -> Optional[KBRuntime]:
+    """The KB to serve, loaded off the event loop on first use; None if there is no such KB."""
+    rt = _registry.peek(kb)
+    if rt is None:
+        try:
+            rt = await run_in_threadpool(_registry.get, kb)
+        except KeyError:
+            return None
+    return rt
+
+
+def _unknown_kb(kb: str) -> JSONResponse:
+    return JSONResponse({"error": f"Unknown knowledge base: {kb}"}, status_code=404)
+
+
+def set_data(kb: str = DEFAULT_KB):
+    """Rebuild a KB snapshot synchronously and publish it."""
+    _registry.get(kb).set_data()
+
+
+def reload_data(kb: str = DEFAULT_KB, diff: Optional[KBDiff] = None) -> dict:
+    """Rebuild a KB snapshot in the background; returns the reload status to poll.
+    `diff` describes an append upload, which is then applied to the live snapshot."""
+    return _registry.reload(kb, diff)
+
+
+def reload_status(kb: str = DEFAULT_KB) -> dict:
+    return _registry.status(kb)
+
 
+def warm_up() -> None:
+    """Load the embedding model (blocking; run off the event loop at startup), then
+    rebuild the loaded KBs in the background so /ask switches to blended ranking."""
+    if _embed.warm_up():
+        for rt in _registry.loaded():
+            rt.reload()
 
-def set_data():
-    global _kb_items, _questions, _keywords, _matcher
-    _kb_items = DataService.load_kb()
-    _questions = [it.question for it in _kb_items]
-    _keywords = [it.keywords for it in _kb_items]
-    _matcher = Matcher(_questions, _keywords) if _kb_items else None
-    if _embed.enabled:
-        _embed.set_questions(_questions)
+
+def _loaded() -> dict:
+    """Loaded KBs by id, without marking them used."""
+    return {rt.kb: rt for rt in _registry.loaded()}
+
+
+def _semantic_live() -> bool:
+    return _embed.enabled and all(rt.snap.semantic is not None for rt in _registry.loaded())
+
+
+def readiness() -> dict:
+    """Whether semantic scoring is live. `semantic` is disabled / pending / loading / ready / failed;
+    `ready` is true once nothing is left to load (lexical answers are served throughout)."""
+    state = _embed.state
+    semantic_live = _semantic_live()
+    ready = semantic_live or state in ("disabled", "failed")
+    loaded = _loaded()
+    default = loaded.get(DEFAULT_KB)
+    return {"ready": ready, "semantic": state, "semantic_live": semantic_live,
+            "kb_version": default.snap.version if default else None,
+            "kbs": {kb: rt.snap.version for kb, rt in loaded.items()},
+            "warmup_ms": _embed.warmup_ms, "error": _embed.error}
 
 
 @router.get("/", response_class=HTMLResponse)
 async def widget_demo():
     """Serve the widget demo page (shows how to embed the chatbot)."""
-    html = Path("app/templates/widget-demo.html").read_text(encoding="utf-8")
-    return HTMLResponse(content=html)
+    return HTMLResponse(content=templates.get("widget-demo.html"))
+
+
+def _build_seconds() -> dict:
+    out = {}
+    for kb, rt in _loaded().items():
+        st = rt.snap.stats
+        out.update({(kb, part): st[f"{part}_ms"] / 1000.0 for part in ("lexical", "semantic", "total")
+                    if f"{part}_ms" in st})
+    return out
+
+
+def _embed_rows() -> dict:
+    return {(kb, k): rt.embed.last_sync.get(k) for kb, rt in _loaded().items()
+            for k in ("reused", "encoded", "pruned")}
+
+
+# Scrape-time gauges over state the services already track (see /metrics)
+metrics.register(metrics.Gauge("hal_kb_items", "Items in each loaded KB snapshot",
+                               lambda: {kb: len(rt.snap.items) for kb, rt in _loaded().items()}, label="kb"))
+metrics.register(metrics.Gauge("hal_kb_version", "Version of each loaded KB snapshot",
+                               lambda: {kb: rt.snap.version for kb, rt in _loaded().items()}, label="kb"))
+metrics.register(metrics.Gauge("hal_kb_build_seconds", "Build time of each loaded KB snapshot",
+                               _build_seconds, label=("kb", "part")))
+metrics.register(metrics.Gauge("hal_kb_lexical_source", "Where each loaded lexical index came from (artifact/incremental/built)",
+                               lambda: {(kb, rt.snap.stats.get("lexical_source", "unknown")): 1
+                                        for kb, rt in _loaded().items()}, label=("kb", "source")))
+metrics.register(metrics.Gauge("hal_kb_loaded", "Knowledge bases currently loaded", lambda: len(_registry.loaded())))
+metrics.register(metrics.Gauge("hal_kb_memory_bytes", "Estimated memory held by each loaded KB",
+                               lambda: {kb: rt.nbytes for kb, rt in _loaded().items()}, label="kb"))
+metrics.register(metrics.Gauge("hal_kb_memory_budget_bytes", "KB_MEMORY_MB in bytes (0 = unlimited)",
+                               lambda: _registry.budget))
+metrics.register(metrics.Gauge("hal_kb_registry_events_total", "KB loads and LRU evictions",
+                               lambda: {"load": _registry.loads, "eviction": _registry.evictions},
+                               label="event", kind="counter"))
+metrics.register(metrics.Gauge("hal_embeddings_ready", "1 once semantic scoring is live for every loaded KB",
+                               lambda: int(_semantic_live())))
+metrics.register(metrics.Gauge("hal_embeddings_cache_rows", "Question vectors reused from cache vs encoded by the last build of each KB",
+                               _embed_rows, label=("kb", "result")))
+metrics.register(metrics.Gauge("hal_scoring_jobs", "Scoring pool jobs waiting or running",
+                               lambda: {k: _executor.stats()[k] for k in ("queue_depth", "running")}, label="state"))
+metrics.register(metrics.Gauge("hal_scoring_rejected_total", "Scoring jobs shed because the queue was full",
+                               lambda: _executor.stats()["rejected"], kind="counter"))
+metrics.register(metrics.Gauge("hal_answer_cache_lookups_total", "Answer cache lookups",
+                               lambda: {"hit": _registry.cache.stats()["hits"], "miss": _registry.cache.stats()["misses"]},
+                               label="result", kind="counter"))
+metrics.register(metrics.Gauge("hal_log_entries_total", "Query log entries by fate",
+                               lambda: {k: LogService.stats()[k] for k in ("written", "dropped", "failed")},
+                               label="result", kind="counter"))
+
+
+def stats() -> dict:
+    """Runtime counters for tuning (served by /admin/stats); kb_version / kb_build are the default KB's."""
+    default = _loaded().get(DEFAULT_KB)
+    last_sync = default.embed.last_sync if default else {}
+    return {"executor": _executor.stats(), "answer_cache": _registry.cache.stats(),
+            "kb_version": default.snap.version if default else None, "kb_build": default.snap.stats if default else None,
+            "kbs": _registry.stats(), "logs": LogService.stats(),
+            "embeddings": dict(last_sync, enabled=_embed.enabled, state=_embed.state)}
 
 
 @router.post("/ask")
-async def ask(payload: AskRequest):
-    if not _matcher:
-        return JSONResponse({"reply": "Knowledge base is empty. Please try later.", "suggestions": []})
-
-    ranked = _matcher.score_all(payload.message)
-    # Optional semantic blend
-    if _embed.enabled:
-        sem = _embed.score_all(payload.message)
-        sem_map = {i: s for i, s in sem}
-        # Blend lexical and semantic (tunable)
-        blended = []
-        for i, s in ranked:
-            ss = sem_map.get(i, 0.0)
-            blended.append((i, 0.6 * s + 0.4 * ss))
-        ranked = sorted(blended, key=lambda x: -x[1])
+async def ask(payload: AskRequest, kb: str = KB_QUERY):
+    t0 = perf_counter() if metrics.ENABLED else 0.0
+    rt = await _runtime(kb)
+    if rt is None:
+        return _unknown_kb(kb)
+    snap = rt.snap
+    key = (kb, snap.version, DataService._norm_question(payload.message))
+    result = _registry.cache.get(key)
+    if result is not None:
+        # Cached ranking; the log entries still belong to this request (queued, not written here)
+        _log(payload.message, result)
+    else:
+        try:
+            result = await _executor.run(_answer, payload.message, rt, snap, key)
+        except QueueFull:
+            if metrics.ENABLED:
+                metrics.ASK_REQUESTS.inc("busy")
+            return JSONResponse(
+                {"reply": BUSY_REPLY, "suggestions": []},
+                status_code=503,
+                headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
+            )
+    if metrics.ENABLED:
+        metrics.ASK_REQUESTS.inc(result["outcome"])
+        metrics.lap("request", t0)
+    return JSONResponse({"reply": result["reply"], "suggestions": result["suggestions"]})
+
+
+@router.post("/ask/batch")
+async def ask_batch(payload: AskBatchRequest, stream: bool = Query(False), kb: str = KB_QUERY,
+                    _: str = Depends(get_admin)):
+    """Rank many messages against one KB snapshot, e.g. to replay logged queries after a
+    threshold or KB change. Same ranking and thresholds as /ask; answers are not cached and
+    nothing is logged unless `log` is set. `stream=true` returns NDJSON, one line per
+    message, flushed chunk by chunk.
+    """
+    messages = payload.messages
+    if len(messages) > ASK_BATCH_MAX:
+        return JSONResponse({"error": f"At most {ASK_BATCH_MAX} messages per batch."}, status_code=413)
+    rt = await _runtime(kb)
+    if rt is None:
+        return _unknown_kb(kb)
+    snap = rt.snap
+    starts = range(0, len(messages), ASK_BATCH_CHUNK)
+    try:
+        # The first chunk decides admission; a busy server sheds the whole batch up front
+        first = await _executor.run(_rank_batch, messages[:ASK_BATCH_CHUNK], snap, payload.log)
+    except QueueFull:
+        return JSONResponse({"error": BUSY_REPLY},
+                            status_code=503, headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+
+    async def chunks():
+        yield 0, first
+        shed = False
+        for start in starts[1:]:
+            chunk = messages[start:start + ASK_BATCH_CHUNK]
+            # One chunk in flight per batch, so interactive /ask traffic keeps its share of the pool;
+            # a pool that stays full past ASK_BATCH_BUSY_WAIT sheds the rest of the batch
+            deadline = perf_counter() + ASK_BATCH_BUSY_WAIT
+            results = None
+            while not shed:
+                try:
+                    results = await _executor.run(_rank_batch, chunk, snap, payload.log)
+                    break
+                except QueueFull:
+                    if perf_counter() >= deadline:
+                        shed = True
+                    else:
+                        await asyncio.sleep(0.05)
+            yield start, results if results is not None else [_BUSY] * len(chunk)
+
+    if stream:
+        async def lines():
+            async for start, results in chunks():
+                yield "".join(json.dumps(_batch_item(start + j, messages[start + j], r), ensure_ascii=False) + "\n"
+                              for j, r in enumerate(results))
+        return StreamingResponse(lines(), media_type="application/x-ndjson",
+                                 headers={"X-KB-Version": str(snap.version)})
+    out = []
+    async for start, results in chunks():
+        out.extend(_batch_item(start + j, messages[start + j], r) for j, r in enumerate(results))
+    return JSONResponse({"kb_version": snap.version, "results": out})
+
+
+def _rank_batch(messages: list, snap: KBSnapshot, log: bool) -> list:
+    """Rank a chunk of messages with one encode + one matrix product (runs on the scoring pool)."""
+    sems = _embed.score_arrays(messages, snap.semantic) if snap.semantic is not None and snap.matcher else None
+    results = []
+    for j, message in enumerate(messages):
+        result = _rank(message, snap, None if sems is None else sems[j])
+        if log:
+            _log(message, result)
+        results.append(result)
+    return results
+
+
+# Batch result for a message shed because the scoring pool stayed full
+_BUSY = {"reply": BUSY_REPLY, "suggestions": [], "top_questions": None, "unmatched": False, "outcome": "busy"}
+
+
+def _batch_item(index: int, message: str, result: dict) -> dict:
+    return {"index": index, "message": message, "status": 503 if result is _BUSY else 200,
+            "reply": result["reply"], "suggestions": result["suggestions"], "unmatched": result["unmatched"],
+            "scores": [{"question": q, "score": round(float(s), 4)} for q, s in (result["top_questions"] or [])]}
+
+
+def _answer(message: str, rt: KBRuntime, snap: KBSnapshot, key: tuple) -> dict:
+    """Rank, cache and log one message (runs on the scoring pool)."""
+    result = _rank(message, snap)
+    if snap is rt.snap:
+        _registry.cache.put(key, result)
+    _log(message, result)
+    return result
+
+
+def _log(message: str, result: dict) -> None:
+    top_questions = result["top_questions"]
+    if top_questions is None:
+        return
+    t = perf_counter() if metrics.ENABLED else 0.0
+    if result["unmatched"]:
+        LogService.log_unmatched(message, [q for q, _ in top_questions])
+    LogService.log_matched(message, top_questions)
+    if metrics.ENABLED:
+        metrics.lap("log", t)
+
+
+def _rank(message: str, snap: KBSnapshot, sem=None) -> dict:
+    """Rank one snapshot for a message and build the reply; `top_questions` is None when nothing should be logged.
+    `sem` is the message's precomputed semantic row (batch path); otherwise it is computed here.
+    `outcome` is answered / suggested / unmatched / empty, for the request counters."""
+    timed = metrics.ENABLED
+    t0 = perf_counter() if timed else 0.0
+    result = _rank_message(message, snap, sem)
+    if timed:
+        metrics.lap("rank", t0)
+    return result
+
+
+def _rank_message(message: str, snap: KBSnapshot, sem=None) -> dict:
+    matcher, kb_items = snap.matcher, snap.items
+    if not matcher:
+        return {"reply": "Knowledge base is empty. Please try later.", "suggestions": [],
+                "top_questions": None, "unmatched": False, "outcome": "empty"}
+
+    # Optional semantic blend on index-aligned vectors; only the top 5 are ever used
+    if sem is None and snap.semantic is not None:
+        sem = _embed.score_array(message, snap.semantic)
+    if sem is not None and len(sem) == matcher.N:
+        # Blend lexical and semantic (tunable); lexical is 0 outside its candidates
+        lexical = matcher.score_array(message)
+        t = perf_counter() if metrics.ENABLED else 0.0
+        ranked = top_k(0.6 * lexical + 0.4 * sem, 5)
+        if metrics.ENABLED:
+            metrics.lap("blend", t)
+    else:
+        ranked = matcher.score_topk(message, 5)
+    if not ranked:
+        return {"reply": "Sorry, I couldn't find a good match. Please rephrase your question.", "suggestions": [],
+                "top_questions": [], "unmatched": True, "outcome": "unmatched"}
 
     top_idx, top_score = ranked[0]
-    top_pairs = [(i, score) for i, score in ranked[:5]]
-    top_questions = [(_kb_items[i].question, score) for i, score in top_pairs]
+    top_pairs = ranked[:5]
+    top_questions = [(kb_items[i].question, score) for i, score in top_pairs]
     MIN_SUGGESTION_SCORE = 0.4
+    unmatched = False
+    outcome = "answered"
 
     # thresholds with graceful fallbacks
     if top_score >= 0.78:
-        reply = _kb_items[top_idx].answer
+        reply = kb_items[top_idx].answer
         # Exclude the top question and filter by relevance, limit to 5
-        suggestions = [q for (q, s) in top_questions if q != _kb_items[top_idx].question and s >= MIN_SUGGESTION_SCORE][:5]
+        suggestions = [q for (q, s) in top_questions if q != kb_items[top_idx].question and s >= MIN_SUGGESTION_SCORE][:5]
     elif top_score >= 0.6:
         # Prefer suggestions when available; otherwise provide the best answer
         rel = [q for (q, s) in top_questions if s >= MIN_SUGGESTION_SCORE][:5]
         if rel:
             reply = "I found similar questions. Please choose one."
             suggestions = rel
+            outcome = "suggested"
         else:
-            reply = _kb_items[top_idx].answer
+            reply = kb_items[top_idx].answer
             suggestions = []
     else:
         rel = [q for (q, s) in top_questions if s >= MIN_SUGGESTION_SCORE][:5]
         if rel:
             reply = "I found similar questions. Please choose one."
             suggestions = rel
+            outcome = "suggested"
         else:
             reply = "Sorry, I couldn't find a good match. Please rephrase your question."
             suggestions = []
-        LogService.log_unmatched(payload.message, [q for q, _ in top_questions])
+            outcome = "unmatched"
+        unmatched = True
 
-    LogService.log_matched(payload.message, [(q, s) for (q, s) in top_questions])
-    return JSONResponse({"reply": reply, "suggestions": suggestions or []})
+    return {"reply": reply, "suggestions": suggestions or [], "top_questions": top_questions, "unmatched": unmatched,
+            "outcome": outcome}
 
 
 @router.get("/samples")
-async def samples():
+async def samples(kb: str = KB_QUERY):
     # Provide first N KB questions as samples (stable and always available)
-    top = [q for q in _questions[:8]]
+    rt = await _runtime(kb)
+    if rt is None:
+        return _unknown_kb(kb)
+    top = [q for q in rt.snap.questions[:8]]
     return JSONResponse({"samples": top})
+
+
+@router.get("/suggest")
+async def suggest(request: Request, q: str = Query("", max_length=200),
+                  limit: int = Query(SUGGEST_LIMIT, ge=1, le=HEAD_K), kb: str = KB_QUERY):
+    """As-you-type question completions from the prefix index. No fuzzy or semantic scoring,
+    so it answers inline instead of on the scoring pool. The ETag follows the KB content,
+    so clients and proxies can revalidate cached responses across reloads and restarts."""
+    rt = await _runtime(kb)
+    if rt is None:
+        return _unknown_kb(kb)
+    snap = rt.snap
+    etag = f'"kb-{snap.fingerprint[:16]}"' if snap.fingerprint else f'"{kb}-v{snap.version}"'
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={SUGGEST_MAX_AGE}"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    suggestions = snap.suggest.complete(q, limit) if snap.suggest is not None else []
+    return JSONResponse({"q": q, "suggestions": suggestions}, headers=headers)
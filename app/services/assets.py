@@ -0,0 +1,231 @@
+from __future__ import annotations
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse, Response
+
+try:
+    import brotli
+    HAS_BROTLI = True
+except Exception:
+    HAS_BROTLI = False
+    brotli = None  # type: ignore
+
+STATIC_DIR = Path("app/static")
+TEMPLATES_DIR = Path("app/templates")
+
+# Cache-Control for unversioned URLs (e.g. widget.js on third-party pages): 0 = revalidate
+# every time (cheap: a 304 with no body); URLs carrying the current ?v= are immutable.
+STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE", "0"))
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+# Only text-like assets are worth compressing, and only above this size
+COMPRESSIBLE = ("text/", "application/javascript", "application/json", "application/manifest+json",
+                "image/svg+xml")
+MIN_COMPRESS_BYTES = 1024
+
+mimetypes.add_type("application/manifest+json", ".webmanifest")
+mimetypes.add_type("text/javascript", ".js")
+
+# "/static/<path>" inside a quoted attribute; absolute URLs (e.g. embed snippets) are left alone
+_STATIC_REF = re.compile(r"""(?<=["'])/static/([^"'?#]+)(?=["'])""")
+
+
+@dataclass
+class _Asset:
+    stamp: Tuple[int, int]  # (mtime_ns, size) the variants were built from
+    media_type: str
+    version: str
+    # encoding ("identity" / "gzip" / "br") -> (body, etag)
+    variants: Dict[str, Tuple[bytes, str]] = field(default_factory=dict)
+
+
+def _stamp(path: Path) -> Optional[Tuple[int, int]]:
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size) if path.is_file() else None
+
+
+def _etag_matches(header: str, etags: set) -> bool:
+    if header.strip() == "*":
+        return True
+    return any(t.strip().removeprefix("W/") in etags for t in header.split(","))
+
+
+class StaticAssets:
+    """In-memory static files with content-hash ETags, 304s and precompressed variants.
+    Every file is read, hashed and compressed (gzip, plus brotli when installed) once at
+    startup; a request then costs one stat() to notice edits, which rebuild that file.
+    Mounted in place of StaticFiles, so the http middlewares still apply to every response.
+    """
+
+    def __init__(self, directory: Path = STATIC_DIR, max_age: int = STATIC_MAX_AGE) -> None:
+        self.directory = Path(directory).resolve()
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._assets: Dict[str, _Asset] = {}
+        # Bumped whenever an asset is (re)loaded, so rendered templates pick up new versions
+        self.generation = 0
+        for path in sorted(self.directory.rglob("*")):
+            if path.is_file():
+                self._load(path.relative_to(self.directory).as_posix())
+
+    def _resolve(self, rel: str) -> Optional[Path]:
+        path = (self.directory / rel).resolve()
+        if path != self.directory and self.directory not in path.parents:
+            return None
+        return path
+
+    def _load(self, rel: str) -> Optional[_Asset]:
+        path = self._resolve(rel)
+        stamp = _stamp(path) if path is not None else None
+        if stamp is None:
+            return None
+        body = path.read_bytes()
+        digest = hashlib.sha1(body).hexdigest()[:16]
+        media_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+        if media_type.startswith(COMPRESSIBLE):
+            media_type += "; charset=utf-8"
+        asset = _Asset(stamp, media_type, digest[:10], {"identity": (body, f'"{digest}"')})
+        if len(body) >= MIN_COMPRESS_BYTES and media_type.startswith(COMPRESSIBLE):
+            gz = gzip.compress(body, compresslevel=9, mtime=0)
+            if len(gz) < len(body):
+                asset.variants["gzip"] = (gz, f'"{digest}-gz"')
+            if HAS_BROTLI:
+                br = brotli.compress(body, quality=11)
+                if len(br) < len(body):
+                    asset.variants["br"] = (br, f'"{digest}-br"')
+        with self._lock:
+            self._assets[rel] = asset
+            self.generation += 1
+        return asset
+
+    def _current(self, rel: str) -> Tuple[Optional[_Asset], bool]:
+        """The cached asset and whether it is stale (edited, added or removed on disk)."""
+        asset = self._assets.get(rel)
+        path = self._resolve(rel)
+        stamp = _stamp(path) if path is not None else None
+        if stamp is None:
+            if asset is not None:
+                with self._lock:
+                    self._assets.pop(rel, None)
+                    self.generation += 1
+            return None, False
+        return asset, asset is None or asset.stamp != stamp
+
+    def version(self, rel: str) -> Optional[str]:
+        """Content hash for `?v=` (None for unknown files)."""
+        asset, stale = self._current(rel)
+        if stale:
+            asset = self._load(rel)
+        return asset.version if asset else None
+
+    def url(self, rel: str) -> str:
+        v = self.version(rel)
+        return f"/static/{rel}?v={v}" if v else f"/static/{rel}"
+
+    def versioned(self, html: str) -> str:
+        """Add ?v=<content hash> to every quoted /static/... reference in `html`."""
+        return _STATIC_REF.sub(lambda m: self.url(m.group(1)), html)
+
+    @staticmethod
+    def _encoding(request: Request, asset: _Asset) -> str:
+        accept = request.headers.get("accept-encoding", "")
+        offered = {p.split(";")[0].strip().lower() for p in accept.split(",")
+                   if not p.strip().endswith(("q=0", "q=0.0", "q=0.00", "q=0.000"))}
+        for enc in ("br", "gzip"):
+            if enc in asset.variants and enc in offered:
+                return enc
+        return "identity"
+
+    @staticmethod
+    def _route_path(scope) -> str:
+        """Path below the mount point (Mount keeps the full path and extends root_path)."""
+        path, root = scope["path"], scope.get("root_path", "")
+        return path[len(root):] if root and path.startswith(root) else path
+
+    async def __call__(self, scope, receive, send) -> None:
+        request = Request(scope, receive)
+        response = await self.respond(request)
+        await response(scope, receive, send)
+
+    async def respond(self, request: Request) -> Response:
+        if request.method not in ("GET", "HEAD"):
+            return PlainTextResponse("Method Not Allowed", status_code=405, headers={"Allow": "GET, HEAD"})
+        rel = self._route_path(request.scope).lstrip("/")
+        asset, stale = self._current(rel)
+        if stale:
+            # Edited since startup: re-hash and re-compress off the event loop
+            asset = await run_in_threadpool(self._load, rel)
+        if asset is None:
+            return PlainTextResponse("Not Found", status_code=404)
+
+        enc = self._encoding(request, asset)
+        body, etag = asset.variants[enc]
+        v = request.query_params.get("v")
+        headers = {
+            "ETag": etag,
+            "Cache-Control": IMMUTABLE if v == asset.version
+            else (f"public, max-age={self.max_age}" if self.max_age > 0 else "no-cache"),
+        }
+        if len(asset.variants) > 1:
+            headers["Vary"] = "Accept-Encoding"
+        inm = request.headers.get("if-none-match")
+        if inm and _etag_matches(inm, {e for _, e in asset.variants.values()}):
+            return Response(status_code=304, headers=headers)
+        if enc != "identity":
+            headers["Content-Encoding"] = enc
+        if request.method == "HEAD":
+            headers["Content-Length"] = str(len(body))
+            return Response(status_code=200, headers=headers, media_type=asset.media_type)
+        return Response(body, headers=headers, media_type=asset.media_type)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            assets = list(self._assets.values())
+        return {"files": len(assets), "bytes": sum(len(a.variants["identity"][0]) for a in assets),
+                "gzip": sum("gzip" in a.variants for a in assets), "br": sum("br" in a.variants for a in assets)}
+
+
+class TemplateCache:
+    """HTML templates read once and kept in memory, re-read when the file's mtime or size changes.
+    Static references are rendered with ?v= versions so browsers can cache them as immutable."""
+
+    def __init__(self, directory: Path = TEMPLATES_DIR, assets: Optional[StaticAssets] = None) -> None:
+        self.directory = Path(directory)
+        self.assets = assets
+        self._lock = threading.Lock()
+        # name -> (file stamp, asset generation, rendered html)
+        self._cache: Dict[str, Tuple[Tuple[int, int], int, str]] = {}
+
+    def get(self, name: str) -> str:
+        path = self.directory / name
+        stamp = _stamp(path)
+        if stamp is None:
+            raise FileNotFoundError(path)
+        generation = self.assets.generation if self.assets else 0
+        hit = self._cache.get(name)
+        if hit is not None and hit[0] == stamp and hit[1] == generation:
+            return hit[2]
+        html = path.read_text(encoding="utf-8")
+        if self.assets is not None:
+            html = self.assets.versioned(html)
+            # versioned() may itself reload edited assets; key on the generation it ended at
+            generation = self.assets.generation
+        with self._lock:
+            self._cache[name] = (stamp, generation, html)
+        return html
+
+
+static_assets = StaticAssets()
+templates = TemplateCache(assets=static_assets)
@@ -0,0 +1,56 @@
+from __future__ import annotations
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class AnswerCache:
+    """Thread-safe LRU cache with optional TTL for ranked /ask results.
+    max_items <= 0 disables caching; ttl <= 0 means entries only leave by eviction.
+    """
+
+    def __init__(self, max_items: Optional[int] = None, ttl: Optional[float] = None) -> None:
+        self.max_items = max_items if max_items is not None else int(os.getenv("ANSWER_CACHE_SIZE", "1024"))
+        self.ttl = ttl if ttl is not None else float(os.getenv("ANSWER_CACHE_TTL", "0"))
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        if self.max_items <= 0:
+            return None
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or (self.ttl > 0 and time.monotonic() - entry[0] > self.ttl):
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.max_items <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_items:
+                self._data.popitem(last=False)
+
+    def clear(self, match: Optional[Callable[[Hashable], bool]] = None) -> None:
+        """Drop every entry, or only those whose key satisfies `match`."""
+        with self._lock:
+            if match is None:
+                self._data.clear()
+                return
+            for key in [k for k in self._data if match(k)]:
+                del self._data[key]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"size": len(self._data), "max_items": self.max_items, "hits": self.hits, "misses": self.misses}
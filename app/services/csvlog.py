@@ -0,0 +1,270 @@
+from __future__ import annotations
+import csv
+import io
+import os
+import struct
+import sys
+import threading
+from array import array
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+try:
+    import fcntl
+    HAS_FCNTL = True
+except Exception:
+    HAS_FCNTL = False
+    fcntl = None  # type: ignore
+
+# Sidecar entries are little-endian uint64 byte offsets
+_OFF = struct.Struct("<Q")
+
+
+@contextmanager
+def flocked(lock_path: Path) -> Iterator[None]:
+    """Exclusive flock on `lock_path` (created if missing) for the block, shared with other
+    processes locking the same path; a no-op without fcntl. Not reentrant."""
+    if not HAS_FCNTL:
+        yield
+        return
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(lock_path, "ab") as lf:
+        fcntl.flock(lf.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lf.fileno(), fcntl.LOCK_UN)
+
+
+def _pack(offsets: array) -> bytes:
+    if sys.byteorder == "big":
+        offsets = array("Q", offsets)
+        offsets.byteswap()
+    return offsets.tobytes()
+
+
+class IndexedCsv:
+    """Append-only CSV log plus a sidecar of row offsets (`<name>.idx`).
+    Entry 0 is where the header ends and entry i is where data row i ends, so row i
+    occupies bytes [idx[i], idx[i + 1]) and any page is one seek and one read.
+    The sidecar is extended on every append; a missing or stale one (older files,
+    external edits) is rebuilt by a single forward scan the next time it is read.
+    Appends and rebuilds hold an flock on `<name>.lock` (where fcntl exists), so several
+    worker processes can share one log. Timestamps (first column, ISO-8601 UTC) are
+    assumed to be non-decreasing.
+    """
+
+    def __init__(self, path: Path, header: List[str]) -> None:
+        self.path = Path(path)
+        self.index_path = self.path.with_name(self.path.name + ".idx")
+        # Not the sidecar itself: a rebuild replaces that file, and a lock on the old inode would not exclude
+        self.lock_path = self.path.with_name(self.path.name + ".lock")
+        self.header = header
+        self.lock = threading.RLock()
+        self._depth = 0  # locked() nesting in the thread holding self.lock
+        # The first read in each process checks the sidecar row by row against the file
+        self._verified = False
+
+    @contextmanager
+    def locked(self) -> Iterator[None]:
+        """This process's lock plus an exclusive flock shared with other processes using the
+        same file (e.g. to rotate it). Reentrant within a thread."""
+        with self.lock:
+            if self._depth:
+                self._depth += 1
+                try:
+                    yield
+                finally:
+                    self._depth -= 1
+                return
+            with flocked(self.lock_path):
+                self._depth += 1
+                try:
+                    yield
+                finally:
+                    self._depth -= 1
+
+    # -- writing -------------------------------------------------------------
+
+    @staticmethod
+    def _encode(row: List[Any]) -> bytes:
+        buf = io.StringIO()
+        csv.writer(buf).writerow(row)
+        return buf.getvalue().encode("utf-8")
+
+    def append(self, rows: List[List[Any]]) -> None:
+        with self.locked():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            chunks = [self._encode(r) for r in rows]
+            with self.path.open("ab") as f:
+                pos = f.seek(0, os.SEEK_END)
+                ends = array("Q")
+                if pos == 0:
+                    head = self._encode(self.header)
+                    f.write(head)
+                    pos = len(head)
+                    ends.append(pos)
+                    in_sync = True
+                    self._drop_index()
+                else:
+                    in_sync = self._last_offset() == pos
+                for c in chunks:
+                    pos += len(c)
+                    ends.append(pos)
+                f.write(b"".join(chunks))
+            if in_sync:
+                with self.index_path.open("ab") as ix:
+                    ix.write(_pack(ends))
+            else:
+                # Out of step with the data: let the next reader rebuild it
+                self._drop_index()
+
+    def _drop_index(self) -> None:
+        try:
+            self.index_path.unlink()
+        except OSError:
+            pass
+
+    def _last_offset(self) -> Optional[int]:
+        try:
+            with self.index_path.open("rb") as ix:
+                size = ix.seek(0, os.SEEK_END)
+                if size < _OFF.size or size % _OFF.size:
+                    return None
+                ix.seek(size - _OFF.size)
+                return _OFF.unpack(ix.read(_OFF.size))[0]
+        except OSError:
+            return None
+
+    # -- reading -------------------------------------------------------------
+
+    def _ensure_index(self) -> int:
+        """Number of indexed data rows, rebuilding the sidecar first if it does not match the file.
+        Call with locked() held."""
+        try:
+            size = self.path.stat().st_size
+        except OSError:
+            return 0
+        if not self._verified:
+            # Full check once per process: the sidecar must list exactly the rows in the file
+            ends = self._scan()
+            try:
+                current = self.index_path.read_bytes()
+            except OSError:
+                current = None
+            if current != _pack(ends):
+                self._write_index(ends)
+            self._verified = True
+        else:
+            # Appends keep the sidecar in step under the flock; anything else (a writer without
+            # the lock, a crash between the two writes) shows up as a last offset that is not
+            # the end of the file or not the end of a row
+            last = self._last_offset()
+            if last is None or last != size or not self._ends_row(last):
+                self._rebuild()
+        try:
+            n = self.index_path.stat().st_size // _OFF.size
+        except OSError:
+            return 0
+        return max(0, n - 1)
+
+    def _ends_row(self, offset: int) -> bool:
+        if offset == 0:
+            return False
+        with self.path.open("rb") as f:
+            f.seek(offset - 1)
+            return f.read(1) == b"\n"
+
+    def _rebuild(self) -> None:
+        self._write_index(self._scan())
+
+    def _scan(self) -> array:
+        """Forward scan recording where each CSV record ends (quoted fields may span lines)."""
+        ends = array("Q")
+        pos = 0
+        in_quotes = False
+        with self.path.open("rb") as f:
+            for line in f:
+                pos += len(line)
+                if line.count(b'"') % 2:
+                    in_quotes = not in_quotes
+                if not in_quotes and line.endswith(b"\n"):
+                    ends.append(pos)
+        return ends
+
+    def _write_index(self, ends: array) -> None:
+        tmp = self.index_path.with_name(f".{self.index_path.name}.{os.getpid()}.tmp")
+        with tmp.open("wb") as ix:
+            ix.write(_pack(ends))
+        os.replace(tmp, self.index_path)
+
+    def _offsets(self, lo: int, hi: int) -> List[int]:
+        """Sidecar entries lo..hi inclusive."""
+        with self.index_path.open("rb") as ix:
+            ix.seek(lo * _OFF.size)
+            raw = ix.read((hi - lo + 1) * _OFF.size)
+        return [v for (v,) in _OFF.iter_unpack(raw)]
+
+    def rows(self, lo: int, hi: int) -> List[List[str]]:
+        """Data rows [lo, hi) in file order, read as one contiguous block."""
+        if hi <= lo:
+            return []
+        offs = self._offsets(lo, hi)
+        with self.path.open("rb") as f:
+            f.seek(offs[0])
+            block = f.read(offs[-1] - offs[0])
+        return list(csv.reader(io.StringIO(block.decode("utf-8", errors="replace"), newline="")))
+
+    def _timestamp(self, i: int) -> str:
+        row = self.rows(i, i + 1)
+        return row[0][0].rstrip("Z") if row and row[0] else ""
+
+    def _bisect(self, key: str, lo: int, hi: int) -> int:
+        """First row in [lo, hi) whose timestamp is >= key."""
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._timestamp(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def page(self, cursor: Optional[int] = None, limit: int = 100,
+             since: Optional[str] = None, until: Optional[str] = None) -> Dict[str, Any]:
+        """Latest-first page of rows with since <= timestamp < until (naive UTC ISO strings).
+        `cursor` is the row number to continue below (from `next_cursor`); None starts at the newest row.
+        """
+        with self.locked():
+            total = self._ensure_index()
+            a = self._bisect(since, 0, total) if since else 0
+            b = self._bisect(until, a, total) if until else total
+            end = b if cursor is None else max(a, min(cursor, b))
+            start = max(a, end - max(1, limit))
+            rows = self.rows(start, end)
+        rows.reverse()
+        newer = end + max(1, limit)
+        return {
+            "rows": rows,
+            "total": total,
+            "matching": b - a,
+            "skipped": b - end,  # newer matching rows above this page
+            "next_cursor": start if start > a else None,
+            "newer_cursor": None if end >= b else (None if newer >= b else newer),
+            "has_newer": end < b,
+        }
+
+    def iter_bytes(self, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+        """The file as it is now, in chunks (rows appended meanwhile are not included)."""
+        try:
+            f = self.path.open("rb")
+        except OSError:
+            return
+        with f:
+            remaining = os.fstat(f.fileno()).st_size
+            while remaining > 0:
+                chunk = f.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
@@ -1,20 +1,60 @@
 from __future__ import annotations
+import csv
+import io
 import json
+from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Tuple, Dict
+from typing import Any, BinaryIO, Iterable, Iterator, List, Tuple, Dict, Optional
 import uuid
 import unicodedata
 import re
 from datetime import datetime
 from pydantic import BaseModel
 from app.models.schemas import KBItem
+from app.services import kb_store
 
 DATA_DIR = Path("data")
 KB_PATH = DATA_DIR / "data.json"
 BACKUP_DIR = DATA_DIR / "backups"
+# Knowledge bases other than the default one live in data/kbs/<kb>/ with the same layout
+KBS_DIR = DATA_DIR / "kbs"
+DEFAULT_KB = "default"
+KB_ID_RE = re.compile(r"^[a-z0-9][a-z0-9_-]{0,63}$")
 
 BACKUP_DIR.mkdir(parents=True, exist_ok=True)
 
+
+@dataclass(frozen=True)
+class KBPaths:
+    """Files of one knowledge base: data.json, its backups, the compiled index and the
+    embedding cache all sit in `dir` (data/ itself for the default KB)."""
+    kb: str
+    dir: Path
+
+    @property
+    def data(self) -> Path:
+        return self.dir / "data.json"
+
+    @property
+    def backups(self) -> Path:
+        return self.dir / "backups"
+
+    @property
+    def index(self) -> Path:
+        return self.dir / "index.bin"
+
+
+def kb_paths(kb: str = DEFAULT_KB) -> KBPaths:
+    """Paths for a KB id; ValueError unless it is lowercase letters, digits, '-' and '_'."""
+    if kb == DEFAULT_KB:
+        return KBPaths(kb, DATA_DIR)
+    if not KB_ID_RE.match(kb or ""):
+        raise ValueError(f"Invalid knowledge base id {kb!r}")
+    return KBPaths(kb, KBS_DIR / kb)
+
+# Validation messages kept per upload; the rest are only counted
+MAX_UPLOAD_ERRORS = 1000
+
 class DataService:
     @staticmethod
     def _norm_question(text: str) -> str:
@@ -35,58 +75,121 @@ class DataService:
         u = uuid.uuid5(uuid.NAMESPACE_URL, legacy)
         return f"q_{u.hex[:16]}"  # 64-bit equivalent; short and robust
     @staticmethod
-    def load_kb() -> List[KBItem]:
-        if not KB_PATH.exists():
-            return []
-        with KB_PATH.open("r", encoding="utf-8") as f:
-            raw = json.load(f)
-        items: List[KBItem] = []
-        for it in raw:
-            # tolerate legacy without timestamps
-            updated_at = it.get("updated_at") or datetime.utcnow().isoformat()
-            items.append(KBItem(
-                id=str(it.get("id") or DataService._norm_question(it["question"])),
-                question=it["question"],
-                answer=it["answer"],
-                keywords=it.get("keywords", []),
-                tags=it.get("tags", []),
-                updated_at=datetime.fromisoformat(updated_at.replace("Z",""))
-            ))
-        return items
+    def list_kbs() -> List[str]:
+        """Ids of the stored KBs (the default one first, even before its first upload)."""
+        found = {p.parent.name for p in KBS_DIR.glob("*/data.json")}
+        return [DEFAULT_KB] + sorted(kb for kb in found if KB_ID_RE.match(kb) and kb != DEFAULT_KB)
+
+    @staticmethod
+    def kb_fingerprint(path: Path = KB_PATH) -> Optional[str]:
+        """Content hash of the stored KB (None if there is none); keys derived artifacts."""
+        return kb_store.fingerprint(path)
+
+    @staticmethod
+    def _item_from_raw(it: Dict[str, Any]) -> KBItem:
+        # tolerate legacy without timestamps
+        updated_at = it.get("updated_at") or datetime.utcnow().isoformat()
+        return KBItem(
+            id=str(it.get("id") or DataService._norm_question(it["question"])),
+            question=it["question"],
+            answer=it["answer"],
+            keywords=it.get("keywords", []),
+            tags=it.get("tags", []),
+            updated_at=datetime.fromisoformat(updated_at.replace("Z",""))
+        )
+
+    @staticmethod
+    def _item_to_raw(it: KBItem) -> Dict[str, Any]:
+        return {
+            "id": it.id,
+            "question": it.question,
+            "answer": it.answer,
+            "keywords": it.keywords,
+            "tags": it.tags,
+            "updated_at": it.updated_at.isoformat() + "Z",
+        }
 
     @staticmethod
-    def save_kb(items: List[KBItem]) -> None:
-        if KB_PATH.exists():
-            ts = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
-            KB_PATH.replace(BACKUP_DIR / f"data-{ts}.json")
-        serial = [
-            {
-                "id": it.id,
-                "question": it.question,
-                "answer": it.answer,
-                "keywords": it.keywords,
-                "tags": it.tags,
-                "updated_at": it.updated_at.isoformat() + "Z",
-            } for it in items
-        ]
-        KB_PATH.write_text(json.dumps(serial, ensure_ascii=False, indent=2), encoding="utf-8")
+    def load_kb(path: Path = KB_PATH) -> List[KBItem]:
+        """The stored KB: data.json plus any journaled changes (see kb_store)."""
+        return [DataService._item_from_raw(it) for it in kb_store.load_raw(path)]
 
     @staticmethod
-    def upsert_from_rows(rows: List[Dict[str, str]], mode: str = "replace") -> Tuple[List[KBItem], Dict[str, int], List[str]]:
+    def save_kb(items: List[KBItem], path: Path = KB_PATH) -> str:
+        """Store the KB at `path`. KB_STORE=json atomically rewrites data.json, keeping the
+        previous version in backups/; KB_STORE=journal appends only the changed and removed
+        items and compacts in the background. Returns "full", "journal" or "unchanged"."""
+        return kb_store.save(path, [DataService._item_to_raw(it) for it in items])
+
+    @staticmethod
+    def export_json(path: Path = KB_PATH) -> bytes:
+        """The stored KB in the data.json format (indented), whatever the storage mode."""
+        return kb_store.dumps(kb_store.load_raw(path))
+
+    @staticmethod
+    def iter_csv_rows(fileobj: BinaryIO) -> Iterator[Dict[str, str]]:
+        """Rows of a UTF-8 CSV upload, read line by line from the (spooled) file."""
+        text = io.TextIOWrapper(fileobj, encoding="utf-8", errors="ignore", newline="")
+        try:
+            yield from csv.DictReader(text)
+        finally:
+            # Leave the underlying upload file open for its owner to close
+            text.detach()
+
+    @staticmethod
+    def iter_xlsx_rows(fileobj: BinaryIO) -> Iterator[Dict[str, str]]:
+        """Rows of the active sheet of an XLSX upload (openpyxl read-only mode streams the sheet XML).
+        Raises ImportError when openpyxl is not installed."""
+        from openpyxl import load_workbook
+        wb = load_workbook(fileobj, read_only=True, data_only=True)
+        try:
+            data_iter = wb.active.iter_rows(values_only=True)
+            try:
+                header: Any = next(data_iter)
+            except StopIteration:
+                header = []
+            header = [str(h or '').strip().lower() for h in header]
+            for r in data_iter:
+                yield {header[i]: ('' if v is None else str(v)) for i, v in enumerate(r) if i < len(header)}
+        finally:
+            wb.close()
+
+    @staticmethod
+    def upsert_from_rows(rows: Iterable[Dict[str, str]], mode: str = "replace",
+                         path: Path = KB_PATH) -> Tuple[List[KBItem], Dict[str, int], List[str]]:
         """Validate rows and produce a KB list.
+        `rows` may be any iterable (e.g. a streaming parser); it is consumed once and
+        never materialized, so memory follows the KB size rather than the upload size.
         mode: 'replace' (default) replaces the KB with uploaded rows;
               'append' merges uploaded rows into existing KB (no removals).
         Returns: (items, stats, errors)
         """
+        items, stats, errors, _ = DataService.upsert_changes(rows, mode, path)
+        return items, stats, errors
+
+    @staticmethod
+    def upsert_changes(rows: Iterable[Dict[str, str]], mode: str = "replace", path: Path = KB_PATH
+                       ) -> Tuple[List[KBItem], Dict[str, int], List[str], Optional[List[KBItem]]]:
+        """upsert_from_rows plus, in append mode, the merged items for the uploaded ids in upload
+        order (new ids come last in `items` in that same order); None in replace mode.
+        Returns: (items, stats, errors, puts)
+        """
         mode = (mode or "replace").lower().strip()
         if mode not in {"replace", "append"}:
             mode = "replace"
 
-        current = {it.id: it for it in DataService.load_kb()}
+        current = {it.id: it for it in DataService.load_kb(path)}
         errors: List[str] = []
+        error_count = 0
         items_by_id: Dict[str, KBItem] = {}
         dedup_count = 0
 
+        def error(msg: str) -> None:
+            nonlocal error_count
+            error_count += 1
+            if error_count <= MAX_UPLOAD_ERRORS:
+                errors.append(msg)
+
         def split_multi(val: str) -> List[str]:
             raw = re.split(r"[;,]", val or "")
             return [s.strip() for s in raw if len(s.strip()) > 2]
@@ -96,7 +199,7 @@ class DataService:
             a = (r.get("answer") or "").strip()
             provided_id = (r.get("id") or "").strip()
             if not q or not a:
-                errors.append(f"Row {idx}: question/answer required")
+                error(f"Row {idx}: question/answer required")
                 continue
             _id = provided_id or DataService._gen_id_from_question(q, current)
 
@@ -106,7 +209,7 @@ class DataService:
             if _id in items_by_id:
                 # If uploader provided an explicit id, treat duplicate as error
                 if provided_id:
-                    errors.append(f"Row {idx}: duplicate id {_id}")
+                    error(f"Row {idx}: duplicate id {_id}")
                     continue
                 # Otherwise, auto-dedupe: last row wins; merge keywords/tags (unique, order preserved)
                 prev = items_by_id[_id]
@@ -131,6 +234,9 @@ class DataService:
                     updated_at=datetime.utcnow(),
                 )
 
+        if error_count > MAX_UPLOAD_ERRORS:
+            errors.append(f"... and {error_count - MAX_UPLOAD_ERRORS} more errors")
+
         if mode == "replace":
             items: List[KBItem] = list(items_by_id.values())
             stats = {
@@ -139,7 +245,7 @@ class DataService:
                 "removed": max(0, len(current) - len(items)),
                 "deduplicated": dedup_count,
             }
-            return items, stats, errors
+            return items, stats, errors, None
         else:  # append/merge
             merged: Dict[str, KBItem] = {k: v for k, v in current.items()}
             added_cnt = 0
@@ -178,4 +284,5 @@ class DataService:
                 "removed": 0,
                 "deduplicated": dedup_count,
             }
-            return items, stats, errors
+            puts = [merged[_id] for _id in items_by_id]
+            return items, stats, errors, puts
@@ -1,40 +1,297 @@
 from __future__ import annotations
+import copy
+from concurrent.futures import Future
 from pathlib import Path
-from typing import List, Tuple, Optional, Any
+from typing import Any, Callable, Dict, List, Optional, Tuple
 import hashlib
+import importlib.util
+import json
+import os
+import queue
+import threading
+import time
 
 import math
 
+from app.services import metrics
+from app.services.ranking import top_k
+from app.services.vector_index import ExactIndex, IVFIndex, HAS_SKLEARN, INDEX
+
 try:
-    from sentence_transformers import SentenceTransformer
     import numpy as np
-    HAS_ST = True
 except Exception:
-    HAS_ST = False
-    SentenceTransformer = None  # type: ignore
     np = None  # type: ignore
 
+# sentence-transformers pulls in torch; only check it is installed here and import it
+# in EmbeddingsService.warm_up, off the boot path
+try:
+    HAS_ST = np is not None and importlib.util.find_spec("sentence_transformers") is not None
+except Exception:
+    HAS_ST = False
+
+
+# Concurrent queries are coalesced into one encode call of up to BATCH_MAX items,
+# waiting at most BATCH_WAIT_MS for the batch to fill. BATCH_MAX=1 disables batching.
+BATCH_MAX = int(os.getenv("EMBED_BATCH_MAX", "16"))
+BATCH_WAIT_MS = float(os.getenv("EMBED_BATCH_WAIT_MS", "2"))
+# Cache format: "npz" (compressed, loaded into each process) or "npy" (raw matrix
+# memory-mapped read-only, so all workers share one page-cache copy)
+STORE = os.getenv("EMBED_STORE", "npz")
+# Compact in-memory matrix for the first scoring pass: "none", "float16" or "int8" (per-row scale).
+# The best RESCORE rows of that pass are re-scored exactly against memory-mapped float32 vectors:
+# the npy store's matrix, or a float32 .npy sidecar the npz store writes next to its cache.
+QUANT = os.getenv("EMBED_QUANT", "none")
+RESCORE = int(os.getenv("EMBED_RESCORE", "256"))
+
+
+class _QuantizedMatrix:
+    """float16 / int8 copy of the embedding matrix plus the exact float32 rows for re-ranking,
+    memory-mapped from the cache so only re-scored rows are paged in. Without them (`exact` is
+    None) scores come from the compact matrix alone.
+    """
+
+    BLOCK = 16384  # rows widened to float32 at a time during the first pass
+
+    def __init__(self, exact: Any, mode: str, compact: Any = None, scale: Any = None) -> None:
+        self.exact = exact
+        self.mode = mode
+        if compact is None:
+            compact, scale = self.quantize(exact, mode)
+        self.compact = compact
+        self.scale = scale
+
+    @classmethod
+    def quantize(cls, embs: Any, mode: str) -> Tuple[Any, Any]:
+        n = embs.shape[0]
+        if mode == "float16":
+            return np.asarray(embs, dtype=np.float16), None
+        compact = np.empty(embs.shape, dtype=np.int8)
+        scale = np.empty(n, dtype=np.float32)
+        for s in range(0, n, cls.BLOCK):
+            blk = np.asarray(embs[s:s + cls.BLOCK], dtype=np.float32)
+            sc = np.abs(blk).max(axis=1) / 127.0
+            sc[sc == 0] = 1.0
+            compact[s:s + cls.BLOCK] = np.rint(blk / sc[:, None]).astype(np.int8)
+            scale[s:s + cls.BLOCK] = sc
+        return compact, scale
+
+    def approx(self, Q: Any) -> Any:
+        """(N x batch) approximate similarities from the compact matrix."""
+        n = self.compact.shape[0]
+        out = np.empty((n, Q.shape[0]), dtype=np.float32)
+        Qt = np.asarray(Q, dtype=np.float32).T
+        for s in range(0, n, self.BLOCK):
+            out[s:s + self.BLOCK] = np.asarray(self.compact[s:s + self.BLOCK], dtype=np.float32) @ Qt
+        if self.scale is not None:
+            out *= np.asarray(self.scale)[:, None]
+        return out
+
+    def rows(self, idx: Any) -> Any:
+        """float32 rows: exact when kept, else widened from the compact matrix."""
+        if self.exact is not None:
+            return np.asarray(self.exact[idx], dtype=np.float32)
+        out = np.asarray(self.compact[idx], dtype=np.float32)
+        if self.scale is not None:
+            out *= np.asarray(self.scale[idx])[:, None]
+        return out
+
+    def similarities(self, Q: Any, rescore: int) -> List[Any]:
+        approx = self.approx(Q)
+        if self.exact is None:
+            return list(approx.T)
+        n = approx.shape[0]
+        r = min(max(1, rescore), n)
+        rows = []
+        for b in range(Q.shape[0]):
+            row = approx[:, b].copy()
+            if n:
+                cand = np.sort(np.argpartition(-row, r - 1)[:r]) if r < n else np.arange(n)
+                row[cand] = np.asarray(self.exact[cand], dtype=np.float32) @ np.asarray(Q[b], dtype=np.float32)
+            rows.append(row)
+        return rows
+
+
+class _MicroBatcher:
+    """Collects items from concurrent callers and runs them through `fn` as one batch.
+    `fn` maps a list of items to a list of per-item results; each caller blocks
+    on its own future.
+    """
+
+    def __init__(self, fn: Callable[[List[Any]], List[Any]], max_batch: int, max_wait_ms: float) -> None:
+        self._fn = fn
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._q: "queue.Queue[Tuple[Any, Future]]" = queue.Queue()
+        self.batches = 0
+        self.items = 0
+        self._thread = threading.Thread(target=self._loop, name="embed-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, item: Any) -> Future:
+        fut: Future = Future()
+        self._q.put((item, fut))
+        return fut
+
+    def _loop(self) -> None:
+        while True:
+            batch = [self._q.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                try:
+                    batch.append(self._q.get(timeout=timeout) if timeout > 0 else self._q.get_nowait())
+                except queue.Empty:
+                    break
+            self.batches += 1
+            self.items += len(batch)
+            try:
+                results = self._fn([q for q, _ in batch])
+            except Exception as e:
+                for _, fut in batch:
+                    fut.set_exception(e)
+                continue
+            for (_, fut), res in zip(batch, results):
+                fut.set_result(res)
+
+
+class SemanticIndex:
+    """Question vectors for one KB version: float32 rows, optional compact copy and search index.
+    `embs` is None when the compact copy replaces the float32 rows (quantized, not memory-mapped).
+    Never mutated after construction, so a request can keep scoring against the one it started with.
+    """
+
+    def __init__(self, embs: Any, hashes: List[str], qm: Optional[_QuantizedMatrix] = None,
+                 index: Any = None, rescore: int = RESCORE, model_id: str = "") -> None:
+        self.model_id = model_id
+        self.embs = embs
+        self.hashes = hashes
+        self.qm = qm
+        self.index = index if index is not None else ExactIndex()
+        self.rescore = rescore
+
+    @property
+    def n(self) -> int:
+        return (self.embs if self.embs is not None else self.qm.compact).shape[0]
+
+    def rows(self, idx: Any) -> Any:
+        if self.embs is None:
+            return self.qm.rows(idx)
+        return np.asarray(self.embs[idx], dtype=np.float32)
+
+    def similarities(self, Q: Any) -> List[Any]:
+        """Similarity row over all questions for each (normalized) query vector in Q."""
+        if isinstance(self.index, IVFIndex) and len(self.index.assign) == self.n:
+            # Exact scores for the probed lists only; unprobed questions score 0
+            rows = []
+            for q in Q:
+                row = np.zeros(self.n, dtype=np.float32)
+                cand = self.index.candidates(q)
+                row[cand] = self.rows(cand) @ np.asarray(q, dtype=np.float32)
+                rows.append(row)
+            return rows
+        if self.qm is not None:
+            return self.qm.similarities(Q, self.rescore)
+        # Cosine similarity with normalized vectors is dot product
+        return list(Q @ self.embs.T)
+
+
+class _SharedModel:
+    """The loaded model, its load state and the micro-batcher: one per service, shared by its views."""
+
+    def __init__(self, state: str) -> None:
+        self.model: Optional[Any] = None
+        self.enabled = False
+        # disabled (no deps/model) -> pending -> loading -> ready | failed
+        self.state = state
+        self.error: Optional[str] = None
+        self.warmup_ms: Optional[float] = None
+        self.batcher: Optional[_MicroBatcher] = None
+        self.lock = threading.Lock()
+
+
+def _shared(name: str) -> property:
+    return property(lambda self: getattr(self._shared, name), lambda self, v: setattr(self._shared, name, v))
+
 
 class EmbeddingsService:
     """Optional semantic embeddings using a local sentence-transformers model.
-    If dependencies or model are missing, gracefully disables itself.
+    Construction is cheap: the model is loaded by `warm_up` (run in the background at
+    startup) and the service stays disabled until then. If dependencies or model are
+    missing, gracefully disables itself. `view()` gives each knowledge base its own
+    vector cache directory on top of the same model.
     """
 
-    def __init__(self, model_dir: str | Path = "all-MiniLM-L6-v2-optimized") -> None:
-        self.enabled = False
+    model = _shared("model")
+    enabled = _shared("enabled")
+    state = _shared("state")
+    error = _shared("error")
+    warmup_ms = _shared("warmup_ms")
+    _batcher = _shared("batcher")
+
+    def __init__(self, model_dir: str | Path = "all-MiniLM-L6-v2-optimized",
+                 batch_max: Optional[int] = None, batch_wait_ms: Optional[float] = None,
+                 store: Optional[str] = None, quant: Optional[str] = None, rescore: Optional[int] = None,
+                 index: Optional[str] = None, data_dir: str | Path = "data") -> None:
         self.model_dir = Path(model_dir)
-        self.model: Optional[Any] = None
-        self.q_emb: Optional[Any] = None
-        self.data_dir = Path("data")
-        self.cache_path = self.data_dir / "embeddings.npz"
+        self._shared = _SharedModel("pending" if HAS_ST and self.model_dir.exists() else "disabled")
+        self.current: Optional[SemanticIndex] = None
+        self._set_dir(data_dir)
+        self.store = "npy" if (store or STORE).lower().strip() == "npy" else "npz"
         self.model_id = self.model_dir.name
-        if HAS_ST and self.model_dir.exists():
+        mode = (quant or QUANT).lower().strip()
+        self.quant = mode if mode in {"float16", "int8"} else "none"
+        self.rescore = RESCORE if rescore is None else rescore
+        self.index_kind = "ivf" if (index or INDEX).lower().strip() == "ivf" and HAS_SKLEARN else "exact"
+        self.last_sync = {"reused": 0, "encoded": 0, "pruned": 0}
+        self._batch_max = BATCH_MAX if batch_max is None else batch_max
+        self._batch_wait_ms = BATCH_WAIT_MS if batch_wait_ms is None else batch_wait_ms
+
+    def _set_dir(self, data_dir: str | Path) -> None:
+        self.data_dir = Path(data_dir)
+        self.cache_path = self.data_dir / "embeddings.npz"
+        self.meta_path = self.data_dir / "embeddings.meta.json"
+        self.index_path = self.data_dir / "embeddings.ivf.npz"
+
+    def view(self, data_dir: str | Path) -> "EmbeddingsService":
+        """This service's model, load state and micro-batcher with its own vector cache in
+        `data_dir` (one per knowledge base), so every KB shares a single loaded model."""
+        v = copy.copy(self)
+        v._set_dir(data_dir)
+        v.current = None
+        v.last_sync = {"reused": 0, "encoded": 0, "pruned": 0}
+        return v
+
+    def warm_up(self) -> bool:
+        """Import sentence-transformers, load the model and run one throwaway encode so the
+        first real query does not pay for lazy initialization. Blocking; returns whether
+        semantic scoring is now enabled. Safe to call more than once.
+        """
+        with self._shared.lock:
+            if self.state != "pending":
+                return self.enabled
+            self.state = "loading"
+            t0 = time.perf_counter()
             try:
+                from sentence_transformers import SentenceTransformer
                 # Load without internet
-                self.model = SentenceTransformer(str(self.model_dir))
-                self.enabled = True
-            except Exception:
-                self.enabled = False
+                model = SentenceTransformer(str(self.model_dir))
+                model.encode(["warm up"], show_progress_bar=False, batch_size=1, normalize_embeddings=True)
+            except Exception as e:
+                self.state = "failed"
+                self.error = f"{type(e).__name__}: {e}"
+                return False
+            self.model = model
+            if self._batch_max > 1:
+                self._batcher = _MicroBatcher(self._similarities, self._batch_max, self._batch_wait_ms)
+            self.enabled = True
+            self.state = "ready"
+            self.warmup_ms = round(1000.0 * (time.perf_counter() - t0), 1)
+            return True
+
+    @property
+    def q_emb(self) -> Optional[Any]:
+        sem = self.current
+        return None if sem is None else sem.embs
 
     def _hash_questions(self, questions: List[str]) -> str:
         # Stable hash for cache validation (include count)
@@ -45,51 +302,327 @@ class EmbeddingsService:
             h.update(q.encode("utf-8", errors="ignore"))
         return h.hexdigest()
 
-    def _load_cache(self, questions: List[str]) -> bool:
+    @staticmethod
+    def _hash_question(question: str) -> str:
+        # Content address of one question's vector
+        return hashlib.sha1(question.encode("utf-8", errors="ignore")).hexdigest()
+
+    def _load_cache(self, questions: List[str]) -> Optional[Dict[str, Any]]:
+        """Cached vectors for this model: {embs, hashes (per row), quant, compact}, or None.
+        `compact` holds a stored (matrix, scale) pair when the cache was written in this quant mode.
+        The float32 rows are always stored, so changing EMBED_QUANT never needs a re-encode.
+        """
         if not self.enabled or np is None:
-            return False
+            return None
+        if self.store == "npy":
+            return self._load_npy()
         try:
-            import numpy as _np
             if not self.cache_path.exists():
-                return False
-            with _np.load(self.cache_path, allow_pickle=False) as z:
-                cached_hash = str(z.get("hash", ""))
+                return None
+            with np.load(self.cache_path, allow_pickle=False) as z:
                 cached_model = str(z.get("model", ""))
-                embs = z["embs"]
-            if cached_hash != self._hash_questions(questions) or cached_model != self.model_id:
-                return False
-            self.q_emb = embs
-            return True
+                if cached_model != self.model_id:
+                    return None
+                embs = None
+                if self.quant != "none" and "exact_file" in z and "hashes" in z:
+                    # Map the float32 sidecar rather than inflating a private copy of the rows
+                    embs = self._map_exact(str(z["exact_file"]), len(z["hashes"]))
+                if embs is None:
+                    embs = z["embs"]
+                quant = str(z["quant"]) if "quant" in z else "none"
+                compact = None
+                if quant == self.quant and "compact" in z:
+                    compact = (z["compact"], z["scale"] if "scale" in z else None)
+                if "hashes" in z:
+                    return {"embs": embs, "hashes": [str(h) for h in z["hashes"]], "quant": quant, "compact": compact}
+                # Legacy single-hash cache: usable only if it covers exactly these questions
+                if str(z.get("hash", "")) == self._hash_questions(questions):
+                    return {"embs": embs, "hashes": [self._hash_question(q) for q in questions],
+                            "quant": quant, "compact": compact}
+            return None
+        except Exception:
+            return None
+
+    def _load_npy(self) -> Optional[Dict[str, Any]]:
+        try:
+            meta = json.loads(self.meta_path.read_text(encoding="utf-8"))
+            if meta.get("model") != self.model_id:
+                return None
+            embs = np.load(self.data_dir / meta["file"], mmap_mode="r", allow_pickle=False)
+            hashes = list(meta["hashes"])
+            if embs.shape[0] != len(hashes):
+                return None
+            quant = meta.get("quant", "none")
+            compact = None
+            if quant == self.quant and quant != "none":
+                mat = np.load(self.data_dir / meta["quant_file"], mmap_mode="r", allow_pickle=False)
+                scale = (np.load(self.data_dir / meta["scale_file"], mmap_mode="r", allow_pickle=False)
+                         if meta.get("scale_file") else None)
+                compact = (mat, scale)
+            return {"embs": embs, "hashes": hashes, "quant": quant, "compact": compact}
         except Exception:
-            return False
+            return None
 
-    def _save_cache(self, embs: Any, questions: List[str]) -> None:
+    def _save_cache(self, embs: Any, hashes: List[str], qm: Optional["_QuantizedMatrix"]) -> None:
         if not self.enabled or np is None:
             return
         try:
             self.data_dir.mkdir(parents=True, exist_ok=True)
-            qh = self._hash_questions(questions)
-            np.savez_compressed(self.cache_path, embs=embs, hash=qh, model=self.model_id)
+            if self.store == "npy":
+                self._save_npy(embs, hashes, qm)
+            else:
+                self._save_npz(embs, hashes, qm)
+        except Exception:
+            pass
+
+    def _digest(self, hashes: List[str]) -> str:
+        return hashlib.sha1("\n".join([self.model_id, *hashes]).encode("utf-8")).hexdigest()[:16]
+
+    def _exact_name(self, hashes: List[str]) -> str:
+        return f"embeddings-{self._digest(hashes)}.exact.npy"
+
+    def _map_exact(self, name: str, n: int) -> Optional[Any]:
+        """Read-only mapping of a float32 sidecar, or None if it is missing or not `n` rows."""
+        try:
+            embs = np.load(self.data_dir / name, mmap_mode="r", allow_pickle=False)
+        except Exception:
+            return None
+        return embs if embs.ndim == 2 and embs.shape[0] == n else None
+
+    def _save_npz(self, embs: Any, hashes: List[str], qm: Optional["_QuantizedMatrix"]) -> None:
+        """Compressed cache; when quantized, also the float32 rows as a content-named .npy
+        sidecar (recorded in the npz) that the index memory-maps to re-score its top rows."""
+        previous = None
+        try:
+            with np.load(self.cache_path, allow_pickle=False) as z:
+                previous = str(z["exact_file"]) if "exact_file" in z else None
+        except Exception:
+            pass
+        extra: Dict[str, Any] = {}
+        if qm is not None:
+            extra["compact"] = qm.compact
+            if qm.scale is not None:
+                extra["scale"] = qm.scale
+            extra["exact_file"] = self._exact_name(hashes)
+            self._write_npy(extra["exact_file"], embs)
+        np.savez_compressed(self.cache_path, embs=embs, hashes=np.array(hashes, dtype=str),
+                            model=self.model_id, quant=self.quant, **extra)
+        if previous and previous != extra.get("exact_file"):
+            try:
+                # Processes still mapping the old sidecar keep their view until they reload
+                (self.data_dir / previous).unlink()
+            except OSError:
+                pass
+
+    def _write_npy(self, name: str, arr: Any) -> None:
+        target = self.data_dir / name
+        if target.exists():
+            return
+        tmp = target.with_name(f".{name}.{os.getpid()}.tmp")
+        with tmp.open("wb") as f:
+            np.save(f, np.ascontiguousarray(arr), allow_pickle=False)
+        os.replace(tmp, target)
+
+    def _save_npy(self, embs: Any, hashes: List[str], qm: Optional["_QuantizedMatrix"]) -> None:
+        """Write matrices under content-derived names, then atomically repoint the metadata.
+        Readers see either the old file set or the new one, never a partial matrix.
+        """
+        digest = self._digest(hashes)
+        files = {"file": f"embeddings-{digest}.npy"}
+        self._write_npy(files["file"], embs)
+        if qm is not None:
+            files["quant_file"] = f"embeddings-{digest}.{qm.mode}.npy"
+            self._write_npy(files["quant_file"], qm.compact)
+            if qm.scale is not None:
+                files["scale_file"] = f"embeddings-{digest}.{qm.mode}-scale.npy"
+                self._write_npy(files["scale_file"], qm.scale)
+        previous: List[str] = []
+        try:
+            old = json.loads(self.meta_path.read_text(encoding="utf-8"))
+            previous = [old[k] for k in ("file", "quant_file", "scale_file") if old.get(k)]
         except Exception:
             pass
+        meta = {"format": 1, "model": self.model_id, "dtype": str(embs.dtype), "shape": list(embs.shape),
+                "quant": self.quant, **files, "hashes": hashes}
+        tmp = self.meta_path.with_name(f".{self.meta_path.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(meta), encoding="utf-8")
+        os.replace(tmp, self.meta_path)
+        for name in set(previous) - set(files.values()):
+            try:
+                # Processes still mapping the old file keep their view until they reload
+                (self.data_dir / name).unlink()
+            except OSError:
+                pass
 
     def set_questions(self, questions: List[str]) -> None:
+        self.current = self.build(questions, self.current)
+
+    def build(self, questions: List[str], prev: Optional[SemanticIndex] = None,
+              hashes: Optional[List[str]] = None) -> Optional[SemanticIndex]:
+        """Vectors for the KB, encoding only questions the cache has no vector for.
+        Cached rows are reordered to the new KB order; rows for removed questions are dropped.
+        `prev` (the index being replaced) lets an IVF index reuse its centroids; `hashes`
+        are precomputed `_hash_question` values.
+        """
         if not self.enabled or not self.model:
-            self.q_emb = None
-            return
-        # Try cache first
-        if self._load_cache(questions):
-            return
+            return None
+        if hashes is None:
+            hashes = [self._hash_question(q) for q in questions]
+        # The live index already holds this model's vectors; only fall back to disk without one
+        cached = self._cached_from(prev) or self._load_cache(questions)
+        row_of = {}
+        if cached is not None:
+            cached_embs = cached["embs"]
+            row_of = {h: r for r, h in enumerate(cached["hashes"])}
+        missing = [i for i, h in enumerate(hashes) if h not in row_of]
+        self.last_sync = {"reused": len(questions) - len(missing), "encoded": len(missing),
+                          "pruned": len(row_of.keys() - set(hashes))}
+        if cached is not None and not missing and hashes == cached["hashes"]:
+            embs = cached_embs
+            qm = self._quantized(embs, cached["compact"])
+            if cached["quant"] != self.quant or (qm is not None and cached["compact"] is None):
+                # Same vectors, new storage mode: record it (and persist the compact matrix)
+                self._save_cache(embs, hashes, qm)
+                embs = self._npz_exact(embs, qm, hashes)
+            return self._semantic_index(embs, qm, hashes, prev)
         # Encode in small batches to keep memory low and cache
-        embs = self.model.encode(questions, show_progress_bar=False, batch_size=64, normalize_embeddings=True)
-        self.q_emb = embs
-        self._save_cache(embs, questions)
-
-    def score_all(self, query: str) -> List[Tuple[int, float]]:
-        if not self.enabled or self.q_emb is None or not self.model:
-            return []
-        q = self.model.encode([query], show_progress_bar=False, normalize_embeddings=True)[0]
-        # Cosine similarity with normalized vectors is dot product
-        sims = (self.q_emb @ q)
-        # Convert to list of (idx, score)
-        return sorted([(i, float(sims[i])) for i in range(len(sims))], key=lambda x: -x[1])
+        fresh = None
+        if missing:
+            fresh = self.model.encode([questions[i] for i in missing], show_progress_bar=False,
+                                      batch_size=64, normalize_embeddings=True)
+        if cached is None:
+            embs = fresh
+        else:
+            dim = cached_embs.shape[1] if cached_embs.ndim == 2 else fresh.shape[1]
+            embs = np.empty((len(questions), dim), dtype=cached_embs.dtype)
+            hit = [i for i, h in enumerate(hashes) if h in row_of]
+            if hit:
+                embs[hit] = cached_embs[[row_of[hashes[i]] for i in hit]]
+            if missing:
+                embs[missing] = fresh
+        if embs is None:
+            return None
+        qm = self._quantized(embs, None)
+        self._save_cache(embs, hashes, qm)
+        if self.store == "npy":
+            # Serve from the shared mapping rather than this process's private copy
+            reloaded = self._load_npy()
+            if reloaded is not None and reloaded["hashes"] == hashes:
+                embs = reloaded["embs"]
+                qm = self._quantized(embs, reloaded["compact"] or ((qm.compact, qm.scale) if qm else None))
+        else:
+            embs = self._npz_exact(embs, qm, hashes)
+        return self._semantic_index(embs, qm, hashes, prev)
+
+    def _cached_from(self, sem: Optional[SemanticIndex]) -> Optional[Dict[str, Any]]:
+        """`_load_cache`-shaped view of an in-memory index (no disk read), or None."""
+        if (sem is None or sem.model_id != self.model_id or sem.embs is None
+                or len(sem.hashes) != sem.embs.shape[0]):
+            return None
+        qm = sem.qm
+        return {"embs": sem.embs, "hashes": list(sem.hashes), "quant": qm.mode if qm is not None else "none",
+                "compact": (qm.compact, qm.scale) if qm is not None and qm.compact is not None else None}
+
+    def _semantic_index(self, embs: Any, qm: Optional[_QuantizedMatrix], hashes: List[str],
+                        prev: Optional[SemanticIndex]) -> SemanticIndex:
+        index: Any = ExactIndex()
+        if self.index_kind == "ivf" and len(hashes):
+            old = prev.index if prev is not None and isinstance(prev.index, IVFIndex) else None
+            old = old or IVFIndex.load(self.index_path, self.model_id)
+            if old is not None and old.hashes == hashes:
+                index = old
+            else:
+                # Reuses the old centroids/assignments, so only new questions are placed
+                index = IVFIndex.build(embs, hashes, old)
+                try:
+                    index.save(self.index_path, self.model_id)
+                except Exception:
+                    pass
+        return SemanticIndex(embs, hashes, qm, index, self.rescore, self.model_id)
+
+    def _npz_exact(self, embs: Any, qm: Optional[_QuantizedMatrix], hashes: List[str]) -> Any:
+        """The npz store's float32 sidecar, mapped as the exact rows of a quantized index in place
+        of this process's copy. Without a sidecar (e.g. an unwritable cache) the copy stays."""
+        if self.store != "npz" or qm is None or isinstance(embs, np.memmap):
+            return embs
+        mapped = self._map_exact(self._exact_name(hashes), len(hashes))
+        if mapped is None:
+            return embs
+        qm.exact = mapped
+        return mapped
+
+    def _quantized(self, embs: Any, compact: Optional[Tuple[Any, Any]]) -> Optional[_QuantizedMatrix]:
+        if self.quant == "none" or embs is None:
+            return None
+        return _QuantizedMatrix(embs, self.quant, *(compact or (None, None)))
+
+    def encode(self, queries: List[str]) -> Any:
+        return self.model.encode(queries, show_progress_bar=False, batch_size=max(1, len(queries)),
+                                 normalize_embeddings=True)
+
+    def _similarities(self, items: List[Tuple[str, SemanticIndex]]) -> List[Any]:
+        """One encode for the batch, then one (batch x KB) product per distinct index."""
+        timed = metrics.ENABLED
+        t = time.perf_counter() if timed else 0.0
+        Q = self.encode([q for q, _ in items])
+        if timed:
+            t = metrics.lap("embed", t)
+        out: List[Any] = [None] * len(items)
+        groups: Dict[int, List[int]] = {}
+        for pos, (_, sem) in enumerate(items):
+            groups.setdefault(id(sem), []).append(pos)
+        for positions in groups.values():
+            rows = items[positions[0]][1].similarities(Q[positions])
+            for pos, row in zip(positions, rows):
+                out[pos] = row
+        if timed:
+            metrics.lap("semantic", t)
+        return out
+
+    def quant_recall(self, queries: List[str], k: int = 10, sem: Optional[SemanticIndex] = None) -> float:
+        """Mean recall@k of the quantized (re-ranked) path against exact float32 scoring.
+        Reads the float32 rows from the disk cache when the index does not keep them."""
+        sem = sem or self.current
+        if sem is None or sem.qm is None or not self.model or not queries:
+            return 1.0
+        embs = sem.embs
+        if embs is None:
+            cached = self._load_cache([])
+            if cached is None or cached["hashes"] != sem.hashes:
+                raise RuntimeError("no cached float32 vectors for this index")
+            embs = cached["embs"]
+        Q = self.encode(queries)
+        exact = Q @ np.asarray(embs, dtype=np.float32).T
+        approx = sem.qm.similarities(Q, sem.rescore)
+        hits = 0.0
+        for b in range(len(queries)):
+            want = {i for i, _ in top_k(exact[b], k)}
+            got = {i for i, _ in top_k(approx[b], k)}
+            hits += len(want & got) / max(1, len(want))
+        return hits / len(queries)
+
+    def score_array(self, query: str, sem: Optional[SemanticIndex] = None) -> Optional[Any]:
+        """Similarity of the query to every question of `sem` (default: current) as a numpy vector,
+        or None when disabled."""
+        sem = sem or self.current
+        if not self.enabled or sem is None or not self.model:
+            return None
+        if self._batcher is not None:
+            return self._batcher.submit((query, sem)).result()
+        return self._similarities([(query, sem)])[0]
+
+    def score_arrays(self, queries: List[str], sem: Optional[SemanticIndex] = None) -> Optional[List[Any]]:
+        """score_array for many queries at once: one encode and one matrix product
+        (bypasses the micro-batcher), or None when disabled."""
+        sem = sem or self.current
+        if not self.enabled or sem is None or not self.model or not queries:
+            return None
+        return self._similarities([(q, sem) for q in queries])
+
+    def score_topk(self, query: str, k: int, sem: Optional[SemanticIndex] = None) -> List[Tuple[int, float]]:
+        sims = self.score_array(query, sem)
+        return [] if sims is None else top_k(sims, k)
+
+    def score_all(self, query: str, sem: Optional[SemanticIndex] = None) -> List[Tuple[int, float]]:
+        sims = self.score_array(query, sem)
+        return [] if sims is None else top_k(sims, len(sims))
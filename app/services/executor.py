@@ -0,0 +1,88 @@
+from __future__ import annotations
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+from app.services import metrics
+
+
+class QueueFull(Exception):
+    """Raised when the scoring executor has no free worker or queue slot."""
+
+
+class ScoringExecutor:
+    """Bounded thread pool that keeps CPU-bound scoring off the event loop.
+    Threads (not processes) so workers share the loaded matcher and model;
+    numpy, torch and RapidFuzz release the GIL in their hot loops.
+    At most `workers + queue_size` jobs are admitted; beyond that `run`
+    raises QueueFull so the caller can shed load instead of queueing forever.
+    """
+
+    def __init__(self, workers: Optional[int] = None, queue_size: Optional[int] = None) -> None:
+        self.workers = max(1, workers or int(os.getenv("ASK_WORKERS", "0")) or (os.cpu_count() or 1))
+        self.queue_size = max(0, queue_size if queue_size is not None else int(os.getenv("ASK_QUEUE_SIZE", "64")))
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="scoring")
+        self._lock = threading.Lock()
+        self._admitted = 0  # queued + running
+        self._running = 0
+        self.started = 0
+        self.completed = 0
+        self.rejected = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        with self._lock:
+            if self._admitted >= self.workers + self.queue_size:
+                self.rejected += 1
+                raise QueueFull()
+            self._admitted += 1
+        enqueued = time.perf_counter()
+
+        def job() -> Any:
+            waited = time.perf_counter() - enqueued
+            with self._lock:
+                self._running += 1
+                self.started += 1
+                self._wait_total += waited
+                self._wait_max = max(self._wait_max, waited)
+            if metrics.ENABLED:
+                metrics.STAGE_SECONDS.observe("queue_wait", waited)
+            try:
+                return fn(*args)
+            finally:
+                with self._lock:
+                    self._running -= 1
+
+        try:
+            fut = self._pool.submit(job)
+        except Exception:
+            self._release(None)
+            raise
+        # Release the slot when the job finishes, even if the awaiting request went away
+        fut.add_done_callback(self._release)
+        return await asyncio.wrap_future(fut)
+
+    def _release(self, fut: Optional[Future]) -> None:
+        with self._lock:
+            self._admitted -= 1
+            if fut is not None and not fut.cancelled():
+                self.completed += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queue_size": self.queue_size,
+                "queue_depth": self._admitted - self._running,
+                "running": self._running,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "wait_avg_ms": round(1000.0 * self._wait_total / self.started, 3) if self.started else 0.0,
+                "wait_max_ms": round(1000.0 * self._wait_max, 3),
+            }
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=True)
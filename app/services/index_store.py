@@ -0,0 +1,67 @@
+from __future__ import annotations
+import marshal
+import os
+import sys
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from app.models.schemas import KBItem
+from app.services.matcher import Matcher
+from app.services.suggest import SuggestIndex
+
+DATA_DIR = Path("data")
+INDEX_PATH = DATA_DIR / "index.bin"
+
+# Bump when the Matcher / SuggestIndex state layout or tokenization changes
+FORMAT = 3
+MAGIC = b"HALIDX"
+
+
+def _tag() -> bytes:
+    # marshal's format is only guaranteed within one Python version
+    return MAGIC + f"{FORMAT}:{sys.version_info[0]}.{sys.version_info[1]}:{marshal.version}\n".encode("ascii")
+
+
+def load_index(fingerprint: str, path: Path = INDEX_PATH
+               ) -> Optional[Tuple[List[KBItem], Optional[Matcher], List[str], Optional[SuggestIndex]]]:
+    """(items, matcher, question hashes, suggest index) from the artifact if it was built from this KB content, else None.
+    Plain containers only (marshal), so loading never runs code or Pydantic validation.
+    """
+    try:
+        raw = path.read_bytes()
+        tag = _tag()
+        if not raw.startswith(tag):
+            return None
+        payload: Dict[str, Any] = marshal.loads(raw[len(tag):])
+        if payload.get("kb") != fingerprint:
+            return None
+        items = [
+            KBItem.model_construct(id=i, question=q, answer=a, keywords=kw, tags=tg,
+                                   updated_at=datetime.fromisoformat(ts))
+            for i, q, a, kw, tg, ts in payload["items"]
+        ]
+        state = payload["matcher"]
+        matcher = Matcher.from_state(state) if state is not None else None
+        suggest = SuggestIndex.from_state(payload["suggest"]) if payload["suggest"] is not None else None
+        return items, matcher, payload["hashes"], suggest
+    except Exception:
+        return None
+
+
+def save_index(fingerprint: str, items: List[KBItem], matcher: Optional[Matcher], hashes: List[str],
+               suggest: Optional[SuggestIndex] = None, path: Path = INDEX_PATH) -> None:
+    payload = {
+        "kb": fingerprint,
+        "items": [(it.id, it.question, it.answer, list(it.keywords), list(it.tags), it.updated_at.isoformat())
+                  for it in items],
+        "matcher": matcher.to_state() if matcher is not None else None,
+        "hashes": hashes,
+        "suggest": suggest.to_state() if suggest is not None else None,
+    }
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        tmp.write_bytes(_tag() + marshal.dumps(payload))
+        os.replace(tmp, path)
+    except Exception:
+        pass
@@ -0,0 +1,199 @@
+from __future__ import annotations
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+from app.services.cache import AnswerCache
+from app.services.data import DEFAULT_KB, DataService, KBPaths, kb_paths
+from app.services.embeddings import EmbeddingsService
+from app.services.snapshot import KBDiff, KBSnapshot, SnapshotReloader, build_snapshot
+
+try:
+    import numpy as np
+except Exception:
+    np = None  # type: ignore
+
+log = logging.getLogger("uvicorn.error")
+
+# Loaded KBs are evicted least recently used first once their estimated size exceeds
+# KB_MEMORY_MB (0 = never evict); the KB being served is never evicted for itself
+KB_MEMORY_MB = float(os.getenv("KB_MEMORY_MB", "2048"))
+# Resident bytes per character of question/answer/keyword text for the items, matcher and
+# suggest index together (measured with tracemalloc; linear in KB size)
+LEXICAL_BYTES_PER_CHAR = 24
+
+
+def snapshot_bytes(snap: KBSnapshot) -> int:
+    """Estimated memory held by a snapshot: lexical structures plus the embedding matrices
+    held in process memory (memory-mapped ones live in the shared page cache)."""
+    chars = sum(len(it.question) + len(it.answer) + sum(len(k) for k in it.keywords) for it in snap.items)
+    total = LEXICAL_BYTES_PER_CHAR * chars
+    sem = snap.semantic
+    if sem is not None:
+        qm = sem.qm
+        for arr in (sem.embs, qm.compact if qm else None, qm.scale if qm else None):
+            if arr is not None and not isinstance(arr, np.memmap):
+                total += int(arr.nbytes)
+    return total
+
+
+class KBRuntime:
+    """One loaded knowledge base: its live snapshot and the background reloader replacing it."""
+
+    def __init__(self, paths: KBPaths, embed: EmbeddingsService,
+                 on_publish: Callable[["KBRuntime"], None] = lambda rt: None,
+                 next_version: Optional[Callable[[], int]] = None) -> None:
+        self.kb = paths.kb
+        self.paths = paths
+        self.embed = embed
+        self._on_publish = on_publish
+        self._next_version = next_version or itertools.count(1).__next__
+        self.snap: KBSnapshot = build_snapshot(self._next_version(), embed, paths=paths)
+        self.nbytes = snapshot_bytes(self.snap)
+        self.reloader = SnapshotReloader(self._build_next, self._publish)
+        self.last_used = time.monotonic()
+
+    def _build_next(self, progress: Callable[[str], None] = lambda stage: None,
+                    diffs: Optional[List[KBDiff]] = None) -> KBSnapshot:
+        prev = self.snap
+        return build_snapshot(self._next_version(), self.embed, prev, progress, self.paths, diffs)
+
+    def _publish(self, snap: KBSnapshot) -> None:
+        self.snap = snap
+        self.nbytes = snapshot_bytes(snap)
+        self._on_publish(self)
+
+    def set_data(self) -> None:
+        """Rebuild synchronously and publish."""
+        self._publish(self._build_next())
+
+    def reload(self, diff: Optional[KBDiff] = None) -> Dict[str, Any]:
+        """Rebuild in the background; returns the reload status to poll. With the `diff` of an
+        append upload the rebuild patches the live snapshot instead of reading the KB."""
+        return self.reloader.request(diff)
+
+
+class KBRegistry:
+    """Knowledge bases by id, loaded on first use and evicted LRU under a memory budget.
+    Every KB gets a view of the one EmbeddingsService (shared model, own vector cache),
+    and all share one answer cache whose keys start with the KB id.
+    """
+
+    def __init__(self, embed: EmbeddingsService, budget_mb: float = KB_MEMORY_MB,
+                 cache: Optional[AnswerCache] = None) -> None:
+        self.embed = embed
+        self.budget = int(budget_mb * 1024 * 1024)
+        self.cache = cache if cache is not None else AnswerCache()
+        self._lock = threading.Lock()
+        self._loaded: "OrderedDict[str, KBRuntime]" = OrderedDict()
+        self._load_locks: Dict[str, threading.Lock] = {}
+        self.loads = 0
+        self.evictions = 0
+        # Snapshot versions are unique across all KBs and reloads, so an answer cached by a
+        # request still running on an evicted runtime can never match a later load of that KB
+        self._versions = itertools.count(1)
+
+    @staticmethod
+    def exists(kb: str) -> bool:
+        """Whether `kb` can be served: the default KB always, others once uploaded."""
+        try:
+            paths = kb_paths(kb)
+        except ValueError:
+            return False
+        return kb == DEFAULT_KB or paths.data.exists()
+
+    def peek(self, kb: str) -> Optional[KBRuntime]:
+        """The KB if it is loaded (marking it used), else None; never loads."""
+        with self._lock:
+            rt = self._loaded.get(kb)
+            if rt is not None:
+                self._loaded.move_to_end(kb)
+                rt.last_used = time.monotonic()
+            return rt
+
+    def get(self, kb: str = DEFAULT_KB) -> KBRuntime:
+        """The KB, loaded first if needed (blocking: run off the event loop). KeyError if unknown."""
+        rt = self.peek(kb)
+        if rt is not None:
+            return rt
+        if not self.exists(kb):
+            raise KeyError(kb)
+        with self._lock:
+            load_lock = self._load_locks.setdefault(kb, threading.Lock())
+        with load_lock:  # one load per KB; concurrent callers wait for it
+            rt = self.peek(kb)
+            if rt is not None:
+                return rt
+            paths = kb_paths(kb)
+            rt = KBRuntime(paths, self.embed.view(paths.dir), self._published, self._next_version)
+            with self._lock:
+                self._loaded[kb] = rt
+                self.loads += 1
+            log.info("KB %s loaded (~%.1f MB)", kb, rt.nbytes / 2 ** 20)
+            self._evict(keep=kb)
+            if self.embed.enabled and rt.snap.semantic is None and rt.snap.items:
+                rt.reload()  # the model finished loading while this KB was being built
+        return rt
+
+    def _next_version(self) -> int:
+        with self._lock:
+            return next(self._versions)
+
+    def loaded(self) -> List[KBRuntime]:
+        with self._lock:
+            return list(self._loaded.values())
+
+    def reload(self, kb: str, diff: Optional[KBDiff] = None) -> Dict[str, Any]:
+        """Rebuild a loaded KB in the background (see KBRuntime.reload). One that is not
+        loaded is left on disk and built from the new data on first use."""
+        rt = self.peek(kb)
+        if rt is not None:
+            return rt.reload(diff)
+        return self.status(kb)
+
+    def status(self, kb: str) -> Dict[str, Any]:
+        rt = self.peek(kb)
+        if rt is not None:
+            return dict(rt.reloader.status(), kb=kb, loaded=True)
+        return {"kb": kb, "loaded": False, "state": "ready", "stage": None, "job": 0, "version": None,
+                "started_at": None, "finished_at": None, "duration_ms": None, "error": None}
+
+    def _published(self, rt: KBRuntime) -> None:
+        # Entries for older versions of this KB can no longer be hit; drop them to free memory
+        self.cache.clear(lambda key: key[0] == rt.kb)
+        self._evict(keep=rt.kb)
+
+    def _evict(self, keep: str) -> None:
+        if self.budget <= 0:
+            return
+        evicted = []
+        with self._lock:
+            total = sum(rt.nbytes for rt in self._loaded.values())
+            for kb in list(self._loaded):  # least recently used first
+                if total <= self.budget:
+                    break
+                if kb == keep:
+                    continue
+                rt = self._loaded.pop(kb)
+                total -= rt.nbytes
+                self.evictions += 1
+                evicted.append(rt)
+        for rt in evicted:
+            self.cache.clear(lambda key: key[0] == rt.kb)
+            log.info("KB %s evicted (~%.1f MB) to stay under KB_MEMORY_MB", rt.kb, rt.nbytes / 2 ** 20)
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        loaded = self.loaded()
+        return {
+            "budget_bytes": self.budget,
+            "used_bytes": sum(rt.nbytes for rt in loaded),
+            "loads": self.loads,
+            "evictions": self.evictions,
+            "available": DataService.list_kbs(),
+            "loaded": {rt.kb: {"version": rt.snap.version, "items": len(rt.snap.items), "bytes": rt.nbytes,
+                               "idle_s": round(now - rt.last_used, 1)} for rt in loaded},
+        }
@@ -0,0 +1,248 @@
+from __future__ import annotations
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+log = logging.getLogger("uvicorn.error")
+
+# json: every save rewrites data.json (the original layout). journal: a save appends the
+# changed and removed items to data.journal.jsonl, and data.json is only rewritten when
+# the journal is compacted into it in the background.
+KB_STORE = "journal" if os.getenv("KB_STORE", "json").lower().strip() == "journal" else "json"
+# Previous data.json versions kept in backups/ (0 = make no backups)
+KB_BACKUPS = int(os.getenv("KB_BACKUPS", "10"))
+# Journal size that triggers a background compaction
+KB_JOURNAL_COMPACT_BYTES = int(os.getenv("KB_JOURNAL_COMPACT_BYTES", str(8 * 1024 * 1024)))
+
+# Fields that make an item "changed"; a re-uploaded identical row keeps its stored updated_at
+CONTENT_FIELDS = ("question", "answer", "keywords", "tags")
+
+_guard = threading.Lock()
+_locks: Dict[str, threading.Lock] = {}
+_compacting: Set[str] = set()
+
+
+def _key(path: Path) -> str:
+    return str(Path(path).resolve())
+
+
+def _lock(path: Path) -> threading.Lock:
+    """Serializes the file swaps of one KB (appends, full writes, the end of a compaction)."""
+    with _guard:
+        return _locks.setdefault(_key(path), threading.Lock())
+
+
+def journal_path(path: Path) -> Path:
+    return path.with_name(path.stem + ".journal.jsonl")
+
+
+def dumps(raw: List[Dict[str, Any]], pretty: bool = True) -> bytes:
+    if pretty:
+        return json.dumps(raw, ensure_ascii=False, indent=2).encode("utf-8")
+    return json.dumps(raw, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _read(path: Path) -> Tuple[Optional[bytes], bytes]:
+    """data.json and journal bytes as one consistent pair (compaction replaces both)."""
+    jp = journal_path(path)
+    with _lock(path):
+        data = path.read_bytes() if path.exists() else None
+        journal = jp.read_bytes() if jp.exists() else b""
+    return data, journal
+
+
+def fingerprint(path: Path) -> Optional[str]:
+    """sha1 of data.json plus the journal (of data.json alone when there is no journal)."""
+    data, journal = _read(path)
+    if data is None and not journal:
+        return None
+    h = hashlib.sha1(data or b"")
+    if journal:
+        h.update(b"\0journal\0")
+        h.update(journal)
+    return h.hexdigest()
+
+
+def _replay(raw: List[Dict[str, Any]], journal: bytes, source: Path) -> List[Dict[str, Any]]:
+    """Apply journal records in order: removals, then puts (updated in place, new ones appended)."""
+    if not journal:
+        return raw
+    items = {r.get("id"): r for r in raw}
+    for n, line in enumerate(journal.split(b"\n"), start=1):
+        if not line.strip():
+            continue
+        try:
+            rec = json.loads(line)
+        except ValueError:
+            # A record cut short by a crash mid-append; that save never completed
+            log.warning("%s: skipping unreadable record on line %d", source, n)
+            continue
+        for _id in rec.get("del", ()):
+            items.pop(_id, None)
+        for r in rec.get("put", ()):
+            items[r["id"]] = r
+    return list(items.values())
+
+
+def load_raw(path: Path) -> List[Dict[str, Any]]:
+    """Stored items as dicts: data.json with the journal replayed on top."""
+    data, journal = _read(path)
+    raw = json.loads(data) if data is not None else []
+    return _replay(raw, journal, journal_path(path))
+
+
+def _write_tmp(path: Path, body: bytes) -> Path:
+    """`body` written and synced to a temp file next to `path`, ready for os.replace."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(body)
+        f.flush()
+        os.fsync(f.fileno())
+    return tmp
+
+
+def _backup(path: Path, keep: int) -> None:
+    """Keep the current data.json in backups/ (a hard link, so no copy), then prune to `keep`."""
+    if keep <= 0 or not path.exists():
+        return
+    backups = path.parent / "backups"
+    backups.mkdir(exist_ok=True)
+    dest = backups / f"{path.stem}-{datetime.utcnow():%Y%m%d-%H%M%S}.json"
+    tmp = dest.with_name(dest.name + ".tmp")
+    tmp.unlink(missing_ok=True)
+    try:
+        os.link(path, tmp)
+    except OSError:
+        shutil.copyfile(path, tmp)
+    os.replace(tmp, dest)
+    prune_backups(backups, keep, path.stem)
+
+
+def prune_backups(backups: Path, keep: int, stem: str = "data") -> List[Path]:
+    """Delete all but the newest `keep` backups; returns the deleted files."""
+    old = sorted(backups.glob(f"{stem}-*.json"))[:-keep] if keep > 0 else []
+    for p in old:
+        p.unlink(missing_ok=True)
+    return old
+
+
+def write_full(path: Path, raw: List[Dict[str, Any]], pretty: bool = True, keep: Optional[int] = None) -> None:
+    """Atomically replace data.json with `raw` and drop the journal; the old file goes to backups/."""
+    tmp = _write_tmp(path, dumps(raw, pretty))
+    with _lock(path):
+        _backup(path, KB_BACKUPS if keep is None else keep)
+        os.replace(tmp, path)
+        journal_path(path).unlink(missing_ok=True)
+
+
+def _delta(current: List[Dict[str, Any]], new: List[Dict[str, Any]]) -> Optional[Tuple[List[Dict[str, Any]], List[str]]]:
+    """(puts, removed ids) turning `current` into `new` on replay, or None when replay could
+    not reproduce `new` (reordered items, items without ids) or most of the KB changed."""
+    if any(not r.get("id") for r in current):
+        return None
+    old = {r["id"]: r for r in current}
+    ids = {r["id"] for r in new}
+    removed = [r["id"] for r in current if r["id"] not in ids]
+    order = [r["id"] for r in current if r["id"] in ids] + [r["id"] for r in new if r["id"] not in old]
+    if order != [r["id"] for r in new]:
+        return None
+    puts = [r for r in new if r["id"] not in old
+            or any(r.get(f) != old[r["id"]].get(f) for f in CONTENT_FIELDS)]
+    if 2 * (len(puts) + len(removed)) > max(len(new), 1):
+        return None  # a fresh snapshot is smaller than the journal record
+    return puts, removed
+
+
+def append(path: Path, puts: List[Dict[str, Any]], removed: List[str]) -> int:
+    """Append one journal record (one line, synced); returns the journal size."""
+    line = json.dumps({"ts": datetime.utcnow().isoformat() + "Z", "put": puts, "del": removed},
+                      ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+    jp = journal_path(path)
+    with _lock(path):
+        with open(jp, "ab") as f:
+            end = f.tell()
+            if end and _last_byte(jp) != b"\n":
+                f.write(b"\n")  # isolate a torn record so it is skipped on replay
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+            return f.tell()
+
+
+def _last_byte(path: Path) -> bytes:
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1)
+
+
+def save(path: Path, raw: List[Dict[str, Any]], store: Optional[str] = None) -> str:
+    """Persist `raw` as the KB at `path`; returns how: "full", "journal" or "unchanged"."""
+    store = store or KB_STORE
+    if store == "journal" and path.exists():
+        delta = _delta(load_raw(path), raw)
+        if delta is not None:
+            puts, removed = delta
+            if not puts and not removed:
+                return "unchanged"
+            size = append(path, puts, removed)
+            if size >= KB_JOURNAL_COMPACT_BYTES:
+                compact_in_background(path)
+            return "journal"
+    write_full(path, raw, pretty=store == "json")
+    return "full"
+
+
+def compact(path: Path, keep: Optional[int] = None) -> bool:
+    """Fold the journal into data.json. The new file is written without holding the lock;
+    records appended meanwhile stay in the journal. Returns whether anything was compacted.
+    A crash between the two renames leaves the new data.json plus the old journal, whose
+    replay yields the same items (a removed-then-re-added item may end up last).
+    """
+    data, journal = _read(path)
+    if not journal:
+        return False
+    raw = _replay(json.loads(data) if data is not None else [], journal, journal_path(path))
+    tmp = _write_tmp(path, dumps(raw, pretty=False))
+    jp = journal_path(path)
+    with _lock(path):
+        current = jp.read_bytes() if jp.exists() else b""
+        if not current.startswith(journal):  # a full save replaced the KB meanwhile
+            tmp.unlink(missing_ok=True)
+            return False
+        _backup(path, KB_BACKUPS if keep is None else keep)
+        os.replace(tmp, path)
+        tail = current[len(journal):]
+        if tail:
+            os.replace(_write_tmp(jp, tail), jp)
+        else:
+            jp.unlink()
+    log.info("%s: compacted %d journal bytes (%d items)", path, len(journal), len(raw))
+    return True
+
+
+def compact_in_background(path: Path) -> bool:
+    """Start compact(path) on a daemon thread unless one is already running for this KB."""
+    key = _key(path)
+    with _guard:
+        if key in _compacting:
+            return False
+        _compacting.add(key)
+
+    def run() -> None:
+        try:
+            compact(path)
+        except Exception:
+            log.exception("%s: journal compaction failed", path)
+        finally:
+            with _guard:
+                _compacting.discard(key)
+
+    threading.Thread(target=run, name="kb-compact", daemon=True).start()
+    return True
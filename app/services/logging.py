@@ -1,9 +1,14 @@
 from __future__ import annotations
-import csv
+import atexit
+import os
+import queue
+import threading
+import time
 from datetime import datetime
 from pathlib import Path
-from typing import List
+from typing import Any, Dict, List, Optional, Tuple
 import re
+from app.services.csvlog import IndexedCsv, flocked
 
 DATA_DIR = Path("data")
 UNMATCHED_CSV = DATA_DIR / "unmatched.csv"
@@ -14,6 +19,211 @@ DATA_DIR.mkdir(parents=True, exist_ok=True)
 EMAIL_RE = re.compile(r"[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}")
 PHONE_RE = re.compile(r"\b(?:\+?\d[\s-]?){7,15}\b")
 
+# Query logs are written by a background thread in batches. LOG_QUEUE_SIZE bounds the
+# entries waiting in memory (overflow is dropped and counted); a batch is flushed after
+# LOG_FLUSH_MS or once LOG_FLUSH_BATCH entries are waiting. LOG_ASYNC=0 writes inline.
+LOG_ASYNC = os.getenv("LOG_ASYNC", "1").strip().lower() not in {"0", "false", "no"}
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_FLUSH_MS = float(os.getenv("LOG_FLUSH_MS", "500"))
+LOG_FLUSH_BATCH = int(os.getenv("LOG_FLUSH_BATCH", "256"))
+# Rotate a log once it reaches LOG_MAX_BYTES (0 = never), keeping LOG_BACKUPS old files
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUPS = int(os.getenv("LOG_BACKUPS", "5"))
+
+UNMATCHED_HEADER = ["timestamp", "query", "top_suggestions"]
+
+
+class _LogWriter:
+    """Single background thread that owns the log files.
+    Callers only enqueue (timestamp, kind, payload) tuples; sanitizing, formatting,
+    file I/O and rotation all happen here, one open/append per file per batch.
+    """
+
+    def __init__(self, unmatched_path: Path = UNMATCHED_CSV, matched_path: Path = MATCHED_LOG,
+                 queue_size: int = LOG_QUEUE_SIZE, flush_ms: float = LOG_FLUSH_MS,
+                 flush_batch: int = LOG_FLUSH_BATCH, max_bytes: int = LOG_MAX_BYTES,
+                 backups: int = LOG_BACKUPS, background: bool = LOG_ASYNC) -> None:
+        self.unmatched_path = Path(unmatched_path)
+        # Appends keep the sidecar row index the admin viewer pages through
+        self.unmatched = IndexedCsv(self.unmatched_path, UNMATCHED_HEADER)
+        self.matched_path = Path(matched_path)
+        # Workers sharing matched.log take this flock to rotate and append, like unmatched.locked()
+        self.matched_lock_path = self.matched_path.with_name(self.matched_path.name + ".lock")
+        self.flush_s = max(0.0, flush_ms) / 1000.0
+        self.flush_batch = max(1, flush_batch)
+        self.max_bytes = max_bytes
+        self.backups = max(0, backups)
+        self.background = background
+        self._q: "queue.Queue[Optional[Tuple[str, str, Any, Any]]]" = queue.Queue(maxsize=max(1, queue_size))
+        self._lock = threading.Lock()  # guards the counters and thread start
+        self._io_lock = threading.Lock()  # one batch on disk at a time
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        self.submitted = 0
+        self.written = 0
+        self.failed = 0
+        self.dropped = 0
+        self.batches = 0
+        self.rotations = 0
+        self.errors = 0
+
+    def submit(self, kind: str, a: Any, b: Any) -> bool:
+        """Queue one entry; False if it was dropped because the queue is full or the writer closed."""
+        rec = (datetime.utcnow().isoformat() + "Z", kind, a, b)
+        if not self.background:
+            self._write([rec])
+            return True
+        self._ensure_thread()
+        try:
+            if self._closed:
+                raise queue.Full
+            with self._lock:
+                self._q.put_nowait(rec)
+                self.submitted += 1
+            return True
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+
+    def _ensure_thread(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None and not self._closed:
+                self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        stop = False
+        while not stop:
+            first = self._q.get()
+            if first is None:
+                break
+            batch = [first]
+            deadline = time.monotonic() + self.flush_s
+            while len(batch) < self.flush_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    rec = self._q.get(timeout=remaining) if remaining > 0 else self._q.get_nowait()
+                except queue.Empty:
+                    break
+                if rec is None:
+                    stop = True
+                    break
+                batch.append(rec)
+            self._write(batch)
+        # Drain whatever was queued before the stop marker
+        rest = []
+        while True:
+            try:
+                rec = self._q.get_nowait()
+            except queue.Empty:
+                break
+            if rec is not None:
+                rest.append(rec)
+        if rest:
+            self._write(rest)
+
+    def _write(self, batch: List[Tuple[str, str, Any, Any]]) -> None:
+        unmatched = [r for r in batch if r[1] == "unmatched"]
+        matched = [r for r in batch if r[1] == "matched"]
+        with self._io_lock:
+            try:
+                if unmatched:
+                    self._write_unmatched(unmatched)
+                if matched:
+                    self._write_matched(matched)
+                with self._lock:
+                    self.written += len(batch)
+                    self.batches += 1
+            except Exception:
+                with self._lock:
+                    self.failed += len(batch)
+                    self.errors += 1
+
+    def _write_unmatched(self, recs: List[Tuple[str, str, Any, Any]]) -> None:
+        rows = [[ts, LogService.sanitize(query), " | ".join(suggestions[:5])] for ts, _, query, suggestions in recs]
+        with self.unmatched.locked():
+            # A rotated-away file leaves a stale sidecar; the next append starts a fresh one
+            self._maybe_rotate(self.unmatched_path)
+            self.unmatched.append(rows)
+
+    def _write_matched(self, recs: List[Tuple[str, str, Any, Any]]) -> None:
+        parts = []
+        for _, _, input_text, scored in recs:
+            parts.append(f"\nInput: {LogService.sanitize(input_text)}\n")
+            for q, s in sorted(scored, key=lambda x: -x[1]):
+                parts.append(f"  {q} — {s:.3f}\n")
+        # The size is checked under the lock, so only one process rotates a full file
+        with flocked(self.matched_lock_path):
+            self._maybe_rotate(self.matched_path)
+            with self.matched_path.open("a", encoding="utf-8") as f:
+                f.write("".join(parts))
+
+    def _maybe_rotate(self, path: Path) -> None:
+        """path -> path.1 -> path.2 ... keeping `backups` old files (0 = just truncate).
+        Callers hold the file's flock, so workers never rotate the same generation twice."""
+        if self.max_bytes <= 0:
+            return
+        try:
+            if path.stat().st_size < self.max_bytes:
+                return
+        except OSError:
+            return
+        if self.backups == 0:
+            path.unlink()
+        else:
+            oldest = path.with_name(f"{path.name}.{self.backups}")
+            if oldest.exists():
+                oldest.unlink()
+            for i in range(self.backups - 1, 0, -1):
+                src = path.with_name(f"{path.name}.{i}")
+                if src.exists():
+                    os.replace(src, path.with_name(f"{path.name}.{i + 1}"))
+            os.replace(path, path.with_name(f"{path.name}.1"))
+        with self._lock:
+            self.rotations += 1
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Wait until everything queued so far is on disk (or the timeout passes)."""
+        end = time.monotonic() + timeout
+        with self._lock:
+            target = self.submitted
+        while True:
+            with self._lock:
+                if self.written + self.failed >= target:
+                    return True
+            if time.monotonic() >= end:
+                return False
+            time.sleep(0.005)
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Stop accepting entries and drain the queue to disk."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            thread = self._thread
+        if thread is None:
+            return
+        try:
+            self._q.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        thread.join(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"async": self.background, "queue_depth": self._q.qsize(), "queue_size": self._q.maxsize,
+                    "written": self.written, "failed": self.failed, "dropped": self.dropped, "batches": self.batches,
+                    "rotations": self.rotations, "errors": self.errors}
+
+
+_writer = _LogWriter()
+atexit.register(_writer.close)
+
+
 class LogService:
     @staticmethod
     def sanitize(text: str) -> str:
@@ -23,18 +233,25 @@ class LogService:
 
     @staticmethod
     def log_unmatched(query: str, suggestions: List[str]) -> None:
-        UNMATCHED_CSV.parent.mkdir(parents=True, exist_ok=True)
-        write_header = not UNMATCHED_CSV.exists()
-        with UNMATCHED_CSV.open("a", newline="", encoding="utf-8") as f:
-            w = csv.writer(f)
-            if write_header:
-                w.writerow(["timestamp", "query", "top_suggestions"]) 
-            w.writerow([datetime.utcnow().isoformat() + "Z", LogService.sanitize(query), " | ".join(suggestions[:5])])
+        _writer.submit("unmatched", query, list(suggestions))
 
     @staticmethod
     def log_matched(input_text: str, scored: List[tuple[str, float]]):
-        MATCHED_LOG.parent.mkdir(parents=True, exist_ok=True)
-        with MATCHED_LOG.open("a", encoding="utf-8") as f:
-            f.write(f"\nInput: {LogService.sanitize(input_text)}\n")
-            for q, s in sorted(scored, key=lambda x: -x[1]):
-                f.write(f"  {q} — {s:.3f}\n")
+        _writer.submit("matched", input_text, list(scored))
+
+    @staticmethod
+    def flush(timeout: float = 5.0) -> bool:
+        return _writer.flush(timeout)
+
+    @staticmethod
+    def shutdown(timeout: float = 5.0) -> None:
+        _writer.close(timeout)
+
+    @staticmethod
+    def stats() -> Dict[str, Any]:
+        return _writer.stats()
+
+    @staticmethod
+    def unmatched_log() -> IndexedCsv:
+        """The unmatched-query CSV, for paging and export."""
+        return _writer.unmatched
@@ -1,24 +1,88 @@
 from __future__ import annotations
+import difflib
 import math
+from bisect import bisect_left, bisect_right, insort
+import os
 import re
-from typing import List, Tuple
+from time import perf_counter
+from typing import Any, Dict, List, Optional, Set, Tuple
+from app.services import metrics
+from app.services.ranking import top_k_pairs
 try:
-    from rapidfuzz import fuzz  
-    def _fuzzy_ratio(a: str, b: str) -> float:
-        return fuzz.token_sort_ratio(a, b) / 100.0
+    import numpy as np
 except Exception:
-    import difflib
-    def _normalize_for_token_sort(s: str) -> str:
-        return " ".join(sorted(s.lower().split()))
-    def _fuzzy_ratio(a: str, b: str) -> float:
-        # Approximate token_sort_ratio using difflib on sorted tokens
-        return difflib.SequenceMatcher(None, _normalize_for_token_sort(a), _normalize_for_token_sort(b)).ratio()
+    np = None  # type: ignore
+
+try:
+    from scipy import sparse
+    HAS_SPARSE = np is not None
+except Exception:
+    HAS_SPARSE = False
+    sparse = None  # type: ignore
+
+
+def _normalize_for_token_sort(s: str) -> str:
+    return " ".join(sorted(s.lower().split()))
+
+try:
+    from rapidfuzz import fuzz, process
+    HAS_RAPIDFUZZ = True
+except Exception:
+    HAS_RAPIDFUZZ = False
+
+
+def _fuzzy_ratio(a: str, b: str) -> float:
+    if HAS_RAPIDFUZZ:
+        return fuzz.ratio(_normalize_for_token_sort(a), _normalize_for_token_sort(b)) / 100.0
+    # Approximate token_sort_ratio using difflib on sorted tokens (not symmetric: query first)
+    return difflib.SequenceMatcher(None, _normalize_for_token_sort(a), _normalize_for_token_sort(b)).ratio()
 
 # Lightweight tokenizer
 WORD_RE = re.compile(r"[\w']+")
 
+# Upper bound on questions that get full (fuzzy) rescoring per query.
+# KBs at or below this size are scored exhaustively, as before.
+CANDIDATE_CAP = int(os.getenv("MATCHER_CANDIDATE_CAP", "200"))
+# "postings" (pure Python) or "sparse" (SciPy CSR matrix; falls back to postings if unavailable)
+BM25_BACKEND = os.getenv("MATCHER_BM25_BACKEND", "postings")
+# Fuzzy ratios (0..1) below the cutoff count as 0; workers > 1 (or -1 = all cores) lets RapidFuzz thread large batches
+FUZZY_CUTOFF = float(os.getenv("MATCHER_FUZZY_CUTOFF", "0"))
+FUZZY_WORKERS = int(os.getenv("MATCHER_FUZZY_WORKERS", "1"))
+
+
+class _SparseBM25:
+    """BM25 as one sparse product: idf-weighted query row x (terms x docs) CSR matrix.
+    The matrix holds the saturated, length-normalised term frequency per doc.
+    """
+
+    def __init__(self, postings: Dict[str, List[Tuple[int, int]]], idf: Dict[str, float],
+                 norm: List[float], k1: float, n_docs: int) -> None:
+        self.vocab = {t: j for j, t in enumerate(postings)}
+        self.idf = np.array([idf[t] for t in postings], dtype=np.float64)
+        rows: List[int] = []
+        cols: List[int] = []
+        vals: List[float] = []
+        for j, plist in enumerate(postings.values()):
+            for i, tf in plist:
+                rows.append(j)
+                cols.append(i)
+                vals.append(tf * (k1 + 1) / (tf + norm[i]))
+        self.mat = sparse.csr_matrix((vals, (rows, cols)), shape=(len(self.vocab), n_docs), dtype=np.float64)
+
+    def scores(self, terms: Set[str]) -> Dict[int, float]:
+        ids = [self.vocab[t] for t in terms if t in self.vocab]
+        if not ids:
+            return {}
+        q = sparse.csr_matrix((self.idf[ids], ([0] * len(ids), ids)), shape=(1, len(self.vocab)))
+        row = (q @ self.mat).tocsr()
+        return dict(zip(row.indices.tolist(), row.data.tolist()))
+
 class Matcher:
-    def __init__(self, questions: List[str], keywords: List[List[str]]):
+    # Built index fields, enough to restore a Matcher without re-tokenizing (see to_state)
+    STATE_FIELDS = ("questions", "keywords", "docs", "df", "postings", "exact_map", "keyword_map", "_sorted_q")
+
+    def __init__(self, questions: List[str], keywords: List[List[str]], candidate_cap: int | None = None,
+                 bm25_backend: str | None = None):
         self.questions = questions
         self.keywords = [set(kw) for kw in keywords]
         # Precompute bag-of-words for BM25-like scoring without external deps
@@ -27,9 +91,216 @@ class Matcher:
         for doc in self.docs:
             for t in set(doc):
                 self.df[t] = self.df.get(t, 0) + 1
-        self.N = len(self.docs)
-        self.avgdl = sum(len(d) for d in self.docs) / max(1, self.N)
+        self._build_index()
+        self._finish(candidate_cap, bm25_backend)
+        self._owned: Optional[Set[Tuple[int, str]]] = None
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any], candidate_cap: int | None = None,
+                   bm25_backend: str | None = None) -> "Matcher":
+        """Restore a Matcher from `to_state()` output; only cheap derived tables are recomputed."""
+        self = cls.__new__(cls)
+        for f in cls.STATE_FIELDS:
+            setattr(self, f, state[f])
+        self._finish(candidate_cap, bm25_backend)
+        self._owned = None
+        return self
+
+    def to_state(self) -> Dict[str, Any]:
+        return {f: getattr(self, f) for f in self.STATE_FIELDS}
+
+    def _build_index(self) -> None:
+        # Posting lists: term -> [(doc idx, term frequency)]
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        for i, doc in enumerate(self.docs):
+            tf: Dict[str, int] = {}
+            for t in doc:
+                tf[t] = tf.get(t, 0) + 1
+            for t, c in tf.items():
+                self.postings.setdefault(t, []).append((i, c))
+        # Token-sorted, lowercased questions for batched fuzzy scoring
+        self._sorted_q = [_normalize_for_token_sort(q) for q in self.questions]
+        # Exact-match lookup on the same normalization score_all compares with
+        self.exact_map: Dict[str, List[int]] = {}
+        for i, q in enumerate(self.questions):
+            self.exact_map.setdefault(q.strip().lower(), []).append(i)
+        # Keyword -> docs
+        self.keyword_map: Dict[str, List[int]] = {}
+        for i, kws in enumerate(self.keywords):
+            for k in kws:
+                self.keyword_map.setdefault(k, []).append(i)
+
+    def _finish(self, candidate_cap: int | None, bm25_backend: str | None) -> None:
+        """Tables derived from the built index; cheap compared to tokenizing."""
+        self.candidate_cap = max(1, candidate_cap if candidate_cap is not None else CANDIDATE_CAP)
         self.k1, self.b = 1.5, 0.75
+        # Doc lengths (empty docs count as 1 in the BM25 norm) and their running total;
+        # idf and the per-doc norm are derived from these and df at query time
+        self._dl = [len(d) or 1 for d in self.docs]
+        self._total_len = sum(len(d) for d in self.docs)
+        self._kw_dirty = True
+        backend = (bm25_backend or BM25_BACKEND).lower().strip()
+        self.bm25_backend = "sparse" if backend == "sparse" and HAS_SPARSE else "postings"
+        self.refresh()
+
+    def _kw_tables(self) -> None:
+        # Keyword lengths bound the query substrings worth probing
+        self._kw_lengths = sorted({len(k) for k in self.keyword_map})
+        self._kw_keys = list(self.keyword_map)
+        self._kw_blob = "\x00".join(self._kw_keys)
+        self._kw_offsets: List[int] = []
+        pos = 0
+        for k in self._kw_keys:
+            self._kw_offsets.append(pos)
+            pos += len(k) + 1
+        self._kw_dirty = False
+
+    def _idf(self, df: int) -> float:
+        return math.log(1 + (self.N - df + 0.5) / (df + 0.5))
+
+    # -- incremental updates -------------------------------------------------
+    # A live Matcher is shared by in-flight requests, so edits go to a copy():
+    #   m = snapshot.matcher.copy(); m.add_documents(...); m.update_document(...)
+    # Only the edited documents are tokenized; df, doc lengths, postings, the exact-match
+    # map and the keyword map are patched in place. Pass refresh=False to batch several
+    # edits, then call refresh() once to update the corpus-wide statistics.
+
+    # Per-document sequences, kept aligned by the edits below
+    _SEQS = ("questions", "keywords", "docs", "_sorted_q", "_dl")
+
+    def copy(self) -> "Matcher":
+        """Editable Matcher sharing all of this one's tables. Each table is copied (shallowly)
+        on its first write and each posting list on its first edit, so copying is O(1)."""
+        new = self.__class__.__new__(self.__class__)
+        new.__dict__.update(self.__dict__)
+        new._owned = set()
+        return new
+
+    def _table(self, name: str) -> Any:
+        """The named list or dict, copied first if it is still shared with the original."""
+        value = getattr(self, name)
+        if self._owned is not None and name not in self._owned:
+            value = list(value) if isinstance(value, list) else dict(value)
+            setattr(self, name, value)
+            self._owned.add(name)
+        return value
+
+    def _own(self, name: str, key: str) -> list:
+        """Entry `key` of the named dict-of-lists as a list this Matcher may mutate."""
+        table = self._table(name)
+        lst = table.get(key)
+        if self._owned is None:
+            return lst if lst is not None else table.setdefault(key, [])
+        tag = (name, key)
+        if tag not in self._owned:
+            lst = list(lst) if lst is not None else []
+            table[key] = lst
+            self._owned.add(tag)
+        elif lst is None:
+            lst = table[key] = []
+        return lst
+
+    def _drop_from(self, name: str, key: str, item: Any) -> None:
+        lst = self._own(name, key)
+        pos = bisect_left(lst, item)
+        if pos < len(lst) and lst[pos] == item:
+            del lst[pos]
+        if not lst:
+            del self._table(name)[key]
+
+    def _index_doc(self, i: int, add: bool) -> None:
+        """Add (or remove) document i's postings, df counts, length and lookup entries."""
+        tf: Dict[str, int] = {}
+        for t in self.docs[i]:
+            tf[t] = tf.get(t, 0) + 1
+        exact_key = self.questions[i].strip().lower()
+        df = self._table("df")
+        keyword_map = self._table("keyword_map") if self.keywords[i] else self.keyword_map
+        if add:
+            self._total_len += len(self.docs[i])
+            for t, c in tf.items():
+                df[t] = df.get(t, 0) + 1
+                insort(self._own("postings", t), (i, c))
+            insort(self._own("exact_map", exact_key), i)
+            for k in self.keywords[i]:
+                self._kw_dirty |= k not in keyword_map
+                insort(self._own("keyword_map", k), i)
+            return
+        self._total_len -= len(self.docs[i])
+        for t, c in tf.items():
+            if df.get(t, 0) <= 1:
+                df.pop(t, None)
+            else:
+                df[t] -= 1
+            self._drop_from("postings", t, (i, c))
+        self._drop_from("exact_map", exact_key, i)
+        for k in self.keywords[i]:
+            self._drop_from("keyword_map", k, i)
+            self._kw_dirty |= k not in keyword_map
+
+    def _set_doc(self, i: int, question: str, keywords: Any, doc: List[str], sorted_q: str) -> None:
+        values = (question, set(keywords), doc, sorted_q, len(doc) or 1)
+        for name, value in zip(self._SEQS, values):
+            seq = self._table(name)
+            if i == len(seq):
+                seq.append(value)
+            else:
+                seq[i] = value
+
+    def add_documents(self, questions: List[str], keywords: List[List[str]], refresh: bool = True) -> List[int]:
+        """Append documents; returns their indices."""
+        start = len(self.questions)
+        for q, kws in zip(questions, keywords):
+            i = len(self.questions)
+            self._set_doc(i, q, kws, self._tokenize(q), _normalize_for_token_sort(q))
+            self._index_doc(i, add=True)
+        if refresh:
+            self.refresh()
+        return list(range(start, len(self.questions)))
+
+    def update_document(self, idx: int, question: str, keywords: List[str], refresh: bool = True) -> None:
+        """Replace document idx's question and keywords in place (indices are unchanged)."""
+        self._index_doc(idx, add=False)
+        self._set_doc(idx, question, keywords, self._tokenize(question), _normalize_for_token_sort(question))
+        self._index_doc(idx, add=True)
+        if refresh:
+            self.refresh()
+
+    def remove_document(self, idx: int, refresh: bool = True) -> Optional[int]:
+        """Delete document idx by moving the last document into its place, so only those two
+        documents are re-indexed. Returns the moved document's old index (None if idx was
+        the last one); lists kept aligned with the matcher must move the same entry.
+        """
+        last = len(self.questions) - 1
+        self._index_doc(idx, add=False)
+        moved = None
+        if idx != last:
+            self._index_doc(last, add=False)
+            self._set_doc(idx, *(getattr(self, name)[last] for name in self._SEQS[:4]))
+            moved = last
+        for name in self._SEQS:
+            del self._table(name)[last]
+        if moved is not None:
+            self._index_doc(idx, add=True)
+        if refresh:
+            self.refresh()
+        return moved
+
+    def refresh(self) -> None:
+        """Update the corpus-wide statistics after add/update/remove_document(refresh=False).
+        N and avgdl come from running totals, idf and the length norms are derived per query,
+        and the keyword tables are rebuilt only if a keyword appeared or disappeared. The
+        sparse backend's matrix bakes all of these in and is rebuilt.
+        """
+        self.N = len(self.docs)
+        self.avgdl = self._total_len / max(1, self.N)
+        if self._kw_dirty:
+            self._kw_tables()
+        self._sparse = None
+        if self.bm25_backend == "sparse":
+            idf = {t: self._idf(len(p)) for t, p in self.postings.items()}
+            norm = [self.k1 * (1 - self.b + self.b * dl / self.avgdl) for dl in self._dl]
+            self._sparse = _SparseBM25(self.postings, idf, norm, self.k1, self.N)
 
     def _tokenize(self, text: str) -> List[str]:
         return [t.lower() for t in WORD_RE.findall(text.lower())]
@@ -48,14 +319,148 @@ class Matcher:
             score += idf * (tf * (self.k1 + 1)) / (tf + self.k1 * (1 - self.b + self.b * dl / self.avgdl))
         return score
 
-    def score_all(self, query: str) -> List[Tuple[int, float]]:
+    def bm25_scores(self, query: str) -> Dict[int, float]:
+        """BM25 for every doc sharing a term with the query (docs scoring 0 are absent)."""
+        return self._bm25_terms(set(self._tokenize(query)))
+
+    def _bm25_terms(self, terms: Set[str]) -> Dict[int, float]:
+        if self._sparse is not None:
+            return self._sparse.scores(terms)
+        scores: Dict[int, float] = {}
+        k1p = self.k1 + 1
+        # BM25 length norm k1 * (1 - b + b * dl / avgdl) split into a constant and a per-doc part
+        c0, c1 = self.k1 * (1 - self.b), self.k1 * self.b / (self.avgdl or 1.0)
+        dl = self._dl
+        for term in terms:
+            plist = self.postings.get(term)
+            if not plist:
+                continue
+            idf = self._idf(len(plist))
+            for i, tf in plist:
+                scores[i] = scores.get(i, 0.0) + idf * (tf * k1p) / (tf + c0 + c1 * dl[i])
+        return scores
+
+    def fuzzy_scores(self, query: str, ids: List[int]) -> List[float]:
+        """Token-sort fuzzy ratio (0..1) of the query against each question in ids, in one batch."""
+        if not ids:
+            return []
+        qkey = _normalize_for_token_sort(query)
+        cutoff = FUZZY_CUTOFF * 100.0
+        if HAS_RAPIDFUZZ:
+            choices = self._sorted_q if len(ids) == self.N else [self._sorted_q[i] for i in ids]
+            if np is not None:
+                workers = FUZZY_WORKERS if len(choices) >= 1000 else 1
+                row = process.cdist([qkey], choices, scorer=fuzz.ratio, score_cutoff=cutoff,
+                                    workers=workers, dtype=np.float64)[0]
+                return (row / 100.0).tolist()
+            out = [0.0] * len(choices)
+            for _, s, j in process.extract(qkey, choices, scorer=fuzz.ratio, score_cutoff=cutoff, limit=None):
+                out[j] = s / 100.0
+            return out
+        # difflib: ratio(query, question) as _fuzzy_ratio computes it (ratio is not symmetric),
+        # from one matcher per call since scoring threads run concurrently
+        out = []
+        sm = difflib.SequenceMatcher(None, qkey, "")
+        for i in ids:
+            sm.set_seq2(self._sorted_q[i])
+            r = sm.ratio()
+            out.append(r if r * 100.0 >= cutoff else 0.0)
+        return out
+
+    def keyword_hits(self, query: str) -> Set[int]:
+        """Docs with a keyword k such that k in query or query in k (case as stored)."""
+        ql = query.lower()
+        found: Set[str] = set()
+        if not self.keyword_map:
+            return set()
+        # k in query: probe the query substrings whose length matches some keyword
+        n = len(ql)
+        if (n + 1) * len(self._kw_lengths) <= len(self.keyword_map):
+            for L in self._kw_lengths:
+                if L > n:
+                    break
+                for s in range(n - L + 1):
+                    sub = ql[s:s + L]
+                    if sub in self.keyword_map:
+                        found.add(sub)
+        else:
+            found.update(k for k in self.keyword_map if k in ql)
+        # query in k: substring search over all keywords joined into one string
+        if self._kw_lengths and n <= self._kw_lengths[-1]:
+            start = self._kw_blob.find(ql)
+            while start != -1:
+                j = bisect_right(self._kw_offsets, start) - 1
+                k = self._kw_keys[j]
+                if start + n <= self._kw_offsets[j] + len(k):
+                    found.add(k)
+                start = self._kw_blob.find(ql, start + 1)
+        hits: Set[int] = set()
+        for k in found:
+            hits.update(self.keyword_map[k])
+        return hits
+
+    def candidates(self, query: str) -> Tuple[List[int], Dict[int, float], Set[int]]:
+        """Bounded candidate set for full rescoring.
+        Returns (candidate ids, bm25 by doc, keyword-hit docs). Exact matches are
+        always kept; the rest are ranked by their non-fuzzy score and capped.
+        """
+        timed = metrics.ENABLED
+        t = perf_counter() if timed else 0.0
+        terms = set(self._tokenize(query))
+        if timed:
+            t = metrics.lap("tokenize", t)
+        bm25 = self._bm25_terms(terms)
+        if timed:
+            t = metrics.lap("bm25", t)
+        kw = self.keyword_hits(query)
+        if timed:
+            t = metrics.lap("keywords", t)
+        if self.N <= self.candidate_cap:
+            return list(range(self.N)), bm25, kw
+        exact = self.exact_map.get(query.strip().lower(), [])
+        pool = set(bm25) | kw
+        pool.difference_update(exact)
+        ranked = sorted(pool, key=lambda i: -(0.35 * (bm25.get(i, 0.0) / 5.0) + (0.10 * 0.5 if i in kw else 0.0)))
+        room = max(0, self.candidate_cap - len(exact))
+        if timed:
+            metrics.lap("candidates", t)
+        return list(exact) + ranked[:room], bm25, kw
+
+    def _score_candidates(self, query: str) -> Tuple[List[int], List[float]]:
+        ids, bm25, kw = self.candidates(query)
+        timed = metrics.ENABLED
+        t = perf_counter() if timed else 0.0
+        ql = query.strip().lower()
+        fuzzies = self.fuzzy_scores(query, ids)
+        if timed:
+            t = metrics.lap("fuzzy", t)
         scores = []
-        for i, q in enumerate(self.questions):
-            exact = 1.0 if query.strip().lower() == q.strip().lower() else 0.0
-            kw_hit = 0.5 if any(k in query.lower() or query.lower() in k for k in self.keywords[i]) else 0.0
-            fuzzy = _fuzzy_ratio(query, q)
-            bm25 = self.bm25_score(query, i)
+        for i, fuzzy in zip(ids, fuzzies):
+            q = self.questions[i]
+            exact = 1.0 if ql == q.strip().lower() else 0.0
+            kw_hit = 0.5 if i in kw else 0.0
             # Weighted blend (tunable)
-            blended = max(exact, 0.55 * fuzzy + 0.35 * (bm25 / 5.0) + 0.10 * kw_hit)
-            scores.append((i, blended))
-        return sorted(scores, key=lambda x: -x[1])
+            scores.append(max(exact, 0.55 * fuzzy + 0.35 * (bm25.get(i, 0.0) / 5.0) + 0.10 * kw_hit))
+        if timed:
+            metrics.lap("lexical", t)
+        return ids, scores
+
+    def score_all(self, query: str) -> List[Tuple[int, float]]:
+        """Score the candidate set and return (idx, score) pairs, best first.
+        Questions outside the candidate set share no term or keyword with the
+        query and are omitted once the KB exceeds the candidate cap.
+        """
+        ids, scores = self._score_candidates(query)
+        return sorted(zip(ids, scores), key=lambda x: -x[1])
+
+    def score_topk(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """Best k (idx, score) pairs without sorting the whole candidate set."""
+        ids, scores = self._score_candidates(query)
+        return top_k_pairs(zip(ids, scores), k)
+
+    def score_array(self, query: str) -> Any:
+        """Dense numpy score vector aligned with the questions (0 outside the candidate set)."""
+        ids, scores = self._score_candidates(query)
+        out = np.zeros(self.N, dtype=np.float64)
+        out[ids] = scores
+        return out
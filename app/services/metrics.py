@@ -0,0 +1,148 @@
+from __future__ import annotations
+import math
+import os
+import threading
+from bisect import bisect_left
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+# METRICS=0 turns instrumentation off: call sites check ENABLED before reading the clock,
+# so a disabled build pays one global lookup per stage and /metrics answers 404.
+ENABLED = os.getenv("METRICS", "1").strip().lower() not in {"0", "false", "no"}
+
+# Seconds; dense below 10 ms where most stages live
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                   2.5, 5.0, 10.0)
+
+
+def _fmt(v: float) -> str:
+    if v == math.inf:
+        return "+Inf"
+    if float(v).is_integer():
+        return str(int(v))
+    return repr(float(v))
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(v: Any) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram keyed by one label value; observe() is a bisect and three adds."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, label: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.name, self.help, self.label = name, help, label
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series: Dict[str, List[Any]] = {}  # value -> [bucket counts..., sum, count]
+
+    def observe(self, value: str, seconds: float) -> None:
+        i = bisect_left(self.buckets, seconds)
+        with self._lock:
+            s = self._series.get(value)
+            if s is None:
+                s = self._series[value] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            s[i] += 1
+            s[-2] += seconds
+            s[-1] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = {k: list(v) for k, v in self._series.items()}
+        lines = []
+        for value, s in sorted(series.items()):
+            cum = 0
+            for bound, c in zip(self.buckets + (math.inf,), s):
+                cum += c
+                le = 'le="' + _fmt(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels((self.label,), (value,), le)} {cum}")
+            lines.append(f"{self.name}_sum{_labels((self.label,), (value,))} {_fmt(s[-2])}")
+            lines.append(f"{self.name}_count{_labels((self.label,), (value,))} {s[-1]}")
+        return lines
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, label: str) -> None:
+        self.name, self.help, self.label = name, help, label
+        self._lock = threading.Lock()
+        self._values: Dict[str, float] = {}
+
+    def inc(self, value: str, n: float = 1) -> None:
+        with self._lock:
+            self._values[value] = self._values.get(value, 0) + n
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+        return [f"{self.name}{_labels((self.label,), (k,))} {_fmt(v)}" for k, v in sorted(values.items())]
+
+
+class Gauge:
+    """Read at scrape time from a callback returning a number or {label value: number}.
+    With a tuple of labels the dict keys are tuples of values, e.g. {("default", "total"): 12.5}.
+    kind="counter" exposes a running total kept elsewhere (e.g. executor.stats())."""
+
+    def __init__(self, name: str, help: str, fn: Callable[[], Any],
+                 label: Optional[Union[str, Tuple[str, ...]]] = None, kind: str = "gauge") -> None:
+        self.name, self.help, self.fn, self.label, self.kind = name, help, fn, label, kind
+
+    def render(self) -> List[str]:
+        try:
+            v = self.fn()
+        except Exception:
+            return []
+        if v is None:
+            return []
+        if isinstance(v, dict):
+            if isinstance(self.label, tuple):
+                return [f"{self.name}{_labels(self.label, k)} {_fmt(float(x))}"
+                        for k, x in sorted(v.items()) if x is not None]
+            return [f"{self.name}{_labels((self.label or 'key',), (k,))} {_fmt(float(x))}"
+                    for k, x in sorted(v.items()) if x is not None]
+        return [f"{self.name} {_fmt(float(v))}"]
+
+
+_registry: List[Any] = []
+
+
+def register(metric: Any) -> Any:
+    _registry.append(metric)
+    return metric
+
+
+def render() -> str:
+    """All registered metrics in the Prometheus text exposition format (0.0.4)."""
+    out = []
+    for m in _registry:
+        out.append(f"# HELP {m.name} {m.help}")
+        out.append(f"# TYPE {m.name} {m.kind}")
+        out.extend(m.render())
+    return "\n".join(out) + "\n"
+
+
+def lap(stage: str, since: float) -> float:
+    """Record the time since `since` under `stage` and return now, for timing consecutive stages:
+        t = perf_counter() if metrics.ENABLED else 0.0
+        ...; if metrics.ENABLED: t = metrics.lap("bm25", t)
+    """
+    now = perf_counter()
+    STAGE_SECONDS.observe(stage, now - since)
+    return now
+
+
+# Hot-path metrics shared by the services; gauges are registered by their owners
+STAGE_SECONDS = register(Histogram(
+    "hal_ask_stage_seconds",
+    "Time per /ask pipeline stage (embed/semantic are per micro-batch)", "stage"))
+ASK_REQUESTS = register(Counter("hal_ask_requests_total", "/ask requests by outcome", "outcome"))
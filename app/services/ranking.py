@@ -0,0 +1,29 @@
+from __future__ import annotations
+import heapq
+from typing import Any, Iterable, List, Tuple
+
+try:
+    import numpy as np
+except Exception:
+    np = None  # type: ignore
+
+
+def top_k(scores: Any, k: int) -> List[Tuple[int, float]]:
+    """Best k (idx, score) pairs of a score vector, best first; ties break on lower idx.
+    O(N) partition plus O(k log k) sort instead of sorting every score.
+    """
+    n = len(scores)
+    k = min(k, n)
+    if k <= 0:
+        return []
+    if np is None:
+        return top_k_pairs(enumerate(scores), k)
+    scores = np.asarray(scores)
+    idx = np.argpartition(-scores, k - 1)[:k] if k < n else np.arange(n)
+    idx = idx[np.lexsort((idx, -scores[idx]))]
+    return list(zip(idx.tolist(), scores[idx].tolist()))
+
+
+def top_k_pairs(pairs: Iterable[Tuple[int, float]], k: int) -> List[Tuple[int, float]]:
+    """Heap-based top-k over (idx, score) pairs, same ordering as top_k."""
+    return heapq.nsmallest(k, pairs, key=lambda p: (-p[1], p[0]))
@@ -0,0 +1,222 @@
+from __future__ import annotations
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from app.models.schemas import KBItem
+from app.services.data import DataService, KBPaths, kb_paths
+from app.services.embeddings import EmbeddingsService, SemanticIndex
+from app.services.index_store import load_index, save_index
+from app.services.kb_store import CONTENT_FIELDS
+from app.services.matcher import Matcher
+from app.services.suggest import PATCH_MAX, SuggestIndex
+
+# Shows up alongside uvicorn's own startup lines
+log = logging.getLogger("uvicorn.error")
+
+
+@dataclass(frozen=True)
+class KBSnapshot:
+    """Everything a request needs for one KB version. Built off to the side and
+    published with a single reference swap, so items, matcher and vectors always agree.
+    """
+    version: int
+    items: List[KBItem]
+    questions: List[str]
+    matcher: Optional[Matcher]
+    semantic: Optional[SemanticIndex]
+    # Build timings (ms) and where the lexical index came from
+    stats: Dict[str, Any] = field(default_factory=dict)
+    # Typeahead completions (/suggest)
+    suggest: Optional[SuggestIndex] = None
+    # Content hash of the stored KB this was built from (None if it was missing)
+    fingerprint: Optional[str] = None
+    # EmbeddingsService._hash_question per item
+    hashes: List[str] = field(default_factory=list)
+
+
+@dataclass(frozen=True)
+class KBDiff:
+    """What one append upload stored: the uploaded ids' merged items (new ids in the order
+    they were appended), kb_store.save's result and the KB fingerprint right after the save."""
+    puts: List[KBItem]
+    storage: str
+    fingerprint: Optional[str]
+
+
+def _apply_diffs(prev: KBSnapshot, diffs: List[KBDiff]) -> Tuple[List[KBItem], List[int]]:
+    """prev.items with each diff's items put by id as the store replays them (in place, new
+    ids appended), and the positions whose question or keywords changed, ascending."""
+    items = list(prev.items)
+    pos = {it.id: i for i, it in enumerate(items)}
+    touched = set()
+    for d in diffs:
+        for it in d.puts:
+            i = pos.get(it.id)
+            if i is None:
+                pos[it.id] = i = len(items)
+                items.append(it)
+            elif d.storage != "full" and all(getattr(items[i], f) == getattr(it, f) for f in CONTENT_FIELDS):
+                continue  # the journal keeps an unchanged row as stored, updated_at included
+            else:
+                items[i] = it
+            touched.add(i)
+    n = len(prev.items)
+    edited = [i for i in sorted(touched) if i >= n or (items[i].question, items[i].keywords)
+              != (prev.items[i].question, prev.items[i].keywords)]
+    return items, edited
+
+
+def _patch_lexical(prev: KBSnapshot, items: List[KBItem], edited: List[int]
+                   ) -> Optional[Tuple[Matcher, SuggestIndex, List[str]]]:
+    """prev's matcher, suggest index and question hashes updated for the `edited` positions
+    of `items`, or None when a fresh build is as cheap. Only edited questions are tokenized."""
+    if prev.matcher is None or prev.suggest is None or len(prev.hashes) != len(prev.items):
+        return None
+    if 2 * len(edited) > len(items):
+        return None  # most of the KB changed
+    if not edited:
+        return prev.matcher, prev.suggest, prev.hashes
+    n = len(prev.items)
+    matcher = prev.matcher.copy()
+    hashes = list(prev.hashes)
+    for i in edited:
+        it = items[i]
+        if i < n:
+            matcher.update_document(i, it.question, it.keywords, refresh=False)
+            hashes[i] = EmbeddingsService._hash_question(it.question)
+    added = [items[i] for i in edited if i >= n]
+    matcher.add_documents([it.question for it in added], [it.keywords for it in added], refresh=False)
+    matcher.refresh()
+    hashes.extend(EmbeddingsService._hash_question(it.question) for it in added)
+    if len(edited) <= PATCH_MAX:
+        suggest = prev.suggest.patched([(i, prev.items[i].keywords if i < n else (), items[i].question,
+                                         items[i].keywords) for i in edited])
+    else:
+        suggest = SuggestIndex([it.question for it in items], [it.keywords for it in items])
+    return matcher, suggest, hashes
+
+
+def build_snapshot(version: int, embed: EmbeddingsService, prev: Optional[KBSnapshot] = None,
+                   progress: Callable[[str], None] = lambda stage: None,
+                   paths: Optional[KBPaths] = None, diffs: Optional[List[KBDiff]] = None) -> KBSnapshot:
+    """Load one KB (`paths`, default: the default KB) into a snapshot; `embed` should keep
+    its vector cache in the same directory (see EmbeddingsService.view). With `diffs` (the
+    append uploads saved since `prev` was built, in order) the KB is not read: the diffs are
+    applied to prev, so the lexical work follows the size of the uploads.
+    """
+    paths = paths or kb_paths()
+    t0 = time.perf_counter()
+    progress("loading")
+    incremental = diffs is not None and prev is not None
+    if incremental:
+        fingerprint = diffs[-1].fingerprint if diffs else prev.fingerprint
+        items, edited = _apply_diffs(prev, diffs)
+        loaded = None
+    else:
+        fingerprint = DataService.kb_fingerprint(paths.data)
+        loaded = load_index(fingerprint, paths.index) if fingerprint else None
+    if loaded is not None:
+        items, matcher, hashes, suggest = loaded
+        source = "artifact"
+        t_lex = time.perf_counter()
+    else:
+        if not incremental:
+            items = DataService.load_kb(paths.data)
+        progress("lexical")
+        patched = _patch_lexical(prev, items, edited) if incremental else None
+        if patched is not None:
+            matcher, suggest, hashes = patched
+            source = "incremental"
+        else:
+            matcher = Matcher([it.question for it in items], [it.keywords for it in items]) if items else None
+            suggest = SuggestIndex([it.question for it in items], [it.keywords for it in items]) if items else None
+            hashes = [EmbeddingsService._hash_question(it.question) for it in items]
+            source = "built"
+        t_lex = time.perf_counter()
+        # Only persist if the KB did not change underneath us while building
+        if fingerprint and DataService.kb_fingerprint(paths.data) == fingerprint:
+            save_index(fingerprint, items, matcher, hashes, suggest, path=paths.index)
+    questions = [it.question for it in items]
+    semantic = None
+    if embed.enabled:
+        progress("embeddings")
+        semantic = embed.build(questions, prev.semantic if prev else None, hashes=hashes)
+    t_end = time.perf_counter()
+    stats = {"items": len(items), "lexical_source": source,
+             "lexical_ms": round(1000.0 * (t_lex - t0), 1), "semantic_ms": round(1000.0 * (t_end - t_lex), 1),
+             "total_ms": round(1000.0 * (t_end - t0), 1), "embeddings": dict(embed.last_sync) if embed.enabled else None}
+    log.info("KB %s v%d ready in %.1f ms: %d items, lexical index %s in %.1f ms, semantic %.1f ms",
+             paths.kb, version, stats["total_ms"], len(items), source, stats["lexical_ms"], stats["semantic_ms"])
+    return KBSnapshot(version, items, questions, matcher, semantic, stats, suggest, fingerprint, hashes)
+
+
+class SnapshotReloader:
+    """Rebuilds snapshots on one background thread and hands each to `publish`.
+    Requests arriving mid-build are coalesced into one follow-up build, so the
+    last upload always wins and builds never overlap. `build(progress, changes)` gets
+    the changes passed to request() since the previous build, in order, or None when
+    one of those requests (or a failed build) did not describe its change.
+    """
+
+    def __init__(self, build: Callable[[Callable[[str], None], Optional[List[Any]]], KBSnapshot],
+                 publish: Callable[[KBSnapshot], None]) -> None:
+        self._build = build
+        self._publish = publish
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._requested = 0
+        self._done = 0
+        self._changes: Optional[List[Any]] = []
+        self._status: Dict[str, Any] = {"state": "idle", "stage": None, "job": 0, "version": None,
+                                        "started_at": None, "finished_at": None, "duration_ms": None, "error": None}
+
+    def request(self, change: Any = None) -> Dict[str, Any]:
+        with self._lock:
+            if change is None:
+                self._changes = None
+            elif self._changes is not None:
+                self._changes.append(change)
+            self._requested += 1
+            self._status.update(job=self._requested, state="building")
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="kb-reload", daemon=True)
+                self._thread.start()
+            return dict(self._status)
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._status)
+
+    def _stage(self, stage: str) -> None:
+        with self._lock:
+            self._status["stage"] = stage
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                if self._done >= self._requested:
+                    self._thread = None
+                    return
+                target = self._requested
+                changes, self._changes = self._changes, []
+                self._status.update(state="building", stage="queued", error=None,
+                                    started_at=datetime.utcnow().isoformat() + "Z", finished_at=None, duration_ms=None)
+            t0 = time.perf_counter()
+            try:
+                snap = self._build(self._stage, changes)
+                self._stage("publishing")
+                self._publish(snap)
+                outcome = {"state": "ready", "version": snap.version, "error": None}
+            except Exception as e:
+                outcome = {"state": "failed", "error": f"{type(e).__name__}: {e}"}
+                with self._lock:
+                    self._changes = None  # those changes never reached a snapshot
+            with self._lock:
+                self._done = target
+                self._status.update(outcome, stage=None, finished_at=datetime.utcnow().isoformat() + "Z",
+                                    duration_ms=round(1000.0 * (time.perf_counter() - t0), 1))
+                if self._done < self._requested:
+                    self._status["state"] = "building"
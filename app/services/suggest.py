@@ -0,0 +1,220 @@
+from __future__ import annotations
+import copy
+import heapq
+from bisect import bisect_left, bisect_right
+from operator import itemgetter
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from app.services.matcher import WORD_RE
+
+try:
+    import numpy as np
+except Exception:
+    np = None  # type: ignore
+
+# Keys are stored truncated; longer typed prefixes are checked against the full question
+KEY_CHARS = 48
+# Prefixes matching more entries than this get their completions precomputed at build
+# time, so a lookup never ranks more than SCAN_MAX entries
+SCAN_MAX = 256
+# Completions kept per precomputed prefix (the most /suggest returns)
+HEAD_K = 20
+# Edited questions above which patched() rebuilds instead (each edit shifts the flat arrays)
+PATCH_MAX = 256
+
+# Not worth completing from the middle of a question ("how to ..." is matched from the start)
+STOPWORDS = frozenset("a an and are can do does for from how i in is it my of on or the to what when where which "
+                      "who why with you your".split())
+
+# Entry kinds, best first: the question starts with the prefix, a keyword does, a later word does
+START, KEYWORD, WORD = 0, 1, 2
+_END = "\uffff"  # sorts after every character a key can contain
+# Priority: kind, then question length, then KB order (so up to 2**24 questions)
+_QI_BITS = 24
+
+
+def normalize(text: str) -> str:
+    """Lowercased words joined by single spaces, the same tokens the matcher uses."""
+    return " ".join(WORD_RE.findall(text.lower()))
+
+
+class SuggestIndex:
+    """Prefix index over normalized KB questions and keywords for as-you-type completion.
+    A sorted array of keys searched with bisect (a flattened trie): each key is a question
+    from its start, from a later word (not stopwords or numbers), or one of its keywords.
+    Completions are ranked by entry kind, then shorter questions, then KB order; no fuzzy
+    or semantic scoring. Built once per KB snapshot and read-only afterwards.
+    """
+
+    # Built fields, enough to restore an index without re-normalizing (see to_state)
+    STATE_FIELDS = ("questions", "_norm", "_keys", "_prio", "_qid", "_off", "_head")
+
+    def __init__(self, questions: Sequence[str], keywords: Sequence[Sequence[str]] = ()) -> None:
+        self.questions = list(questions)
+        self._norm = [normalize(q) for q in self.questions]
+        keys: List[str] = []
+        prio: List[int] = []
+        qid: List[int] = []
+        off: List[int] = []  # where the key starts in the normalized question; -1 for keywords
+        kw_norm: Dict[str, str] = {}  # keywords repeat across many questions
+        for qi, norm in enumerate(self._norm):
+            for key, p, o in self._entries(qi, norm, keywords[qi] if qi < len(keywords) else (), kw_norm):
+                keys.append(key); prio.append(p); qid.append(qi); off.append(o)
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        take = itemgetter(*order) if len(order) > 1 else (lambda seq: tuple(seq[i] for i in order))
+        self._keys = list(take(keys))
+        self._qid = list(take(qid))
+        self._off = list(take(off))
+        self._prio = list(take(prio))
+        self._finish()
+        self._head: Dict[str, List[int]] = {}
+        self._precompute("", 0, len(self._keys))
+
+    @staticmethod
+    def _entries(qi: int, norm: str, keywords: Optional[Sequence[str]],
+                 kw_norm: Dict[str, str]) -> List[Tuple[str, int, int]]:
+        """(key, priority, offset) of every entry question qi contributes."""
+        if not norm:
+            return []
+        base = (len(norm) << _QI_BITS) + qi  # shorter questions, then KB order
+        out = []
+        pos = 0
+        for word in norm.split(" "):
+            if pos == 0:
+                out.append((norm[:KEY_CHARS], base, 0))
+            elif word not in STOPWORDS and not word.isdigit():
+                out.append((norm[pos:pos + KEY_CHARS], (WORD << 48) + base, pos))
+            pos += len(word) + 1
+        for kw in keywords or ():
+            k = kw_norm.get(kw)
+            if k is None:
+                k = kw_norm[kw] = normalize(kw)
+            if k:
+                out.append((k[:KEY_CHARS], (KEYWORD << 48) + base, -1))
+        return out
+
+    def patched(self, edits: Sequence[Tuple[int, Sequence[str], str, Sequence[str]]]) -> "SuggestIndex":
+        """A new index with question qi set to (question, keywords) for each
+        (qi, old keywords, question, keywords) in `edits`; qi == len(questions) appends.
+        Only the edited questions' entries move and only the precomputed prefixes they
+        touch are re-ranked. Past PATCH_MAX edits a rebuild is cheaper; callers decide.
+        """
+        new = copy.copy(self)
+        new.questions = list(self.questions)
+        new._norm = list(self._norm)
+        keys, prio, qid, off = new._keys, new._prio, new._qid, new._off = (
+            list(self._keys), list(self._prio), list(self._qid), list(self._off))
+        new._head = dict(self._head)
+        kw_norm: Dict[str, str] = {}
+        touched = set()
+        for qi, old_keywords, question, keywords in edits:
+            if qi < len(new.questions):
+                for key, p, o in self._entries(qi, new._norm[qi], old_keywords, kw_norm):
+                    for j in range(bisect_left(keys, key), bisect_right(keys, key)):
+                        if qid[j] == qi and prio[j] == p and off[j] == o:
+                            del keys[j], prio[j], qid[j], off[j]
+                            break
+                    touched.add(key)
+                new.questions[qi] = question
+                new._norm[qi] = normalize(question)
+            else:
+                new.questions.append(question)
+                new._norm.append(normalize(question))
+            for key, p, o in self._entries(qi, new._norm[qi], keywords, kw_norm):
+                j = bisect_right(keys, key)
+                keys.insert(j, key); prio.insert(j, p); qid.insert(j, qi); off.insert(j, o)
+                touched.add(key)
+        new._finish()
+        # The precomputed prefixes are exactly those matching more than SCAN_MAX entries
+        for prefix in {key[:n] for key in touched for n in range(1, len(key) + 1)}:
+            lo, hi = new._range(prefix)
+            if hi - lo > SCAN_MAX:
+                new._head[prefix] = new._rank(lo, hi, prefix, HEAD_K)
+            else:
+                new._head.pop(prefix, None)
+        return new
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "SuggestIndex":
+        self = cls.__new__(cls)
+        for f in cls.STATE_FIELDS:
+            setattr(self, f, state[f])
+        self._finish()
+        return self
+
+    def to_state(self) -> Dict[str, Any]:
+        return {f: getattr(self, f) for f in self.STATE_FIELDS}
+
+    def _finish(self) -> None:
+        self._prio_np = np.asarray(self._prio, dtype=np.int64) if np is not None else None
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def _range(self, prefix: str, lo: int = 0, hi: int = None) -> Tuple[int, int]:
+        hi = len(self._keys) if hi is None else hi
+        lo = bisect_left(self._keys, prefix, lo, hi)
+        return lo, bisect_left(self._keys, prefix + _END, lo, hi)
+
+    def _precompute(self, prefix: str, lo: int, hi: int) -> None:
+        """Walk the trie nodes holding more than SCAN_MAX entries, storing each one's completions."""
+        stack = [(prefix, lo, hi)]
+        while stack:
+            prefix, lo, hi = stack.pop()
+            if prefix:
+                self._head[prefix] = self._rank(lo, hi, prefix, HEAD_K)
+            depth = len(prefix)
+            if depth >= KEY_CHARS:
+                continue
+            i = lo
+            while i < hi:
+                key = self._keys[i]
+                if len(key) <= depth:  # the prefix itself sorts first
+                    i += 1
+                    continue
+                child = prefix + key[depth]
+                _, j = self._range(child, i, hi)
+                if j - i > SCAN_MAX:
+                    stack.append((child, i, j))
+                i = j
+
+    def _top(self, lo: int, hi: int, m: int) -> List[int]:
+        """Entry positions in [lo, hi) with the m smallest priorities, best first."""
+        if hi - lo <= m:
+            return sorted(range(lo, hi), key=self._prio.__getitem__)
+        if self._prio_np is None:
+            return heapq.nsmallest(m, range(lo, hi), key=self._prio.__getitem__)
+        part = self._prio_np[lo:hi]
+        idx = np.argpartition(part, m)[:m]
+        return (idx[np.argsort(part[idx], kind="stable")] + lo).tolist()
+
+    def _rank(self, lo: int, hi: int, prefix: str, k: int) -> List[int]:
+        """Best k distinct questions among entries [lo, hi) that really start with `prefix`."""
+        m = 4 * k
+        while True:
+            out: List[int] = []
+            seen = set()
+            for i in self._top(lo, hi, m):
+                qi = self._qid[i]
+                if qi in seen:
+                    continue
+                if len(prefix) > KEY_CHARS and (self._off[i] < 0 or
+                                                not self._norm[qi].startswith(prefix, self._off[i])):
+                    continue
+                seen.add(qi)
+                out.append(qi)
+                if len(out) >= k:
+                    return out
+            if m >= hi - lo:
+                return out
+            m *= 4  # duplicates or long-prefix misses used up the candidates
+
+    def complete(self, text: str, k: int = 8) -> List[str]:
+        """Up to k KB questions completing `text`."""
+        prefix = normalize(text)
+        if not prefix or k <= 0:
+            return []
+        head = self._head.get(prefix) if k <= HEAD_K else None
+        if head is not None:
+            return [self.questions[qi] for qi in head[:k]]
+        lo, hi = self._range(prefix[:KEY_CHARS])
+        return [self.questions[qi] for qi in self._rank(lo, hi, prefix, k)]
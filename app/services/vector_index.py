@@ -0,0 +1,133 @@
+from __future__ import annotations
+import math
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+try:
+    import numpy as np
+except Exception:
+    np = None  # type: ignore
+
+try:
+    from sklearn.cluster import MiniBatchKMeans
+    HAS_SKLEARN = True
+except Exception:
+    HAS_SKLEARN = False
+    MiniBatchKMeans = None  # type: ignore
+
+# "exact" scores every question; "ivf" only the questions in the NPROBE closest clusters
+INDEX = os.getenv("EMBED_INDEX", "exact")
+IVF_NLIST = int(os.getenv("EMBED_IVF_NLIST", "0"))  # 0 = about 4 * sqrt(N)
+IVF_NPROBE = int(os.getenv("EMBED_IVF_NPROBE", "8"))
+
+
+class ExactIndex:
+    """Brute force: every row is a candidate."""
+
+    kind = "exact"
+
+    def candidates(self, q: Any) -> Optional[Any]:
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        return {"kind": self.kind}
+
+
+class IVFIndex:
+    """Inverted-file index over unit vectors: k-means centroids, one row list per centroid.
+    A query is compared to the centroids and only rows in its `nprobe` best lists are scored.
+    Rebuilds reuse the previous centroids and row assignments (matched by question hash),
+    so an upload only assigns new or edited questions; centroids are retrained when the KB
+    size drifts far from what they were trained for.
+    """
+
+    kind = "ivf"
+
+    def __init__(self, centroids: Any, assign: Any, hashes: List[str], nprobe: int) -> None:
+        self.centroids = centroids
+        self.assign = assign
+        self.hashes = hashes
+        self.nprobe = max(1, nprobe)
+        order = np.argsort(assign, kind="stable")
+        bounds = np.searchsorted(assign[order], np.arange(len(centroids) + 1))
+        self._lists = [order[bounds[c]:bounds[c + 1]] for c in range(len(centroids))]
+
+    @staticmethod
+    def target_nlist(n: int) -> int:
+        return max(1, min(n, IVF_NLIST or int(4 * math.sqrt(n))))
+
+    @classmethod
+    def build(cls, embs: Any, hashes: List[str], prev: Optional["IVFIndex"] = None,
+              nprobe: Optional[int] = None) -> "IVFIndex":
+        nprobe = IVF_NPROBE if nprobe is None else nprobe
+        n = embs.shape[0]
+        nlist = cls.target_nlist(n)
+        reuse = (prev is not None and prev.centroids.shape[1] == embs.shape[1]
+                 and nlist / 2 <= len(prev.centroids) <= nlist * 2)
+        if not reuse:
+            centroids = cls._train(embs, nlist)
+            return cls(centroids, cls._assign(embs, centroids), hashes, nprobe)
+        centroids = prev.centroids
+        known = {h: int(c) for h, c in zip(prev.hashes, prev.assign)}
+        assign = np.empty(n, dtype=np.int32)
+        fresh = []
+        for i, h in enumerate(hashes):
+            c = known.get(h)
+            if c is None:
+                fresh.append(i)
+            else:
+                assign[i] = c
+        if fresh:
+            assign[fresh] = cls._assign(embs[fresh], centroids)
+        return cls(centroids, assign, hashes, nprobe)
+
+    @staticmethod
+    def _train(embs: Any, nlist: int) -> Any:
+        # A sample of ~40 rows per centroid is plenty to place the centroids
+        n = embs.shape[0]
+        sample = min(n, 40 * nlist)
+        rows = np.sort(np.random.default_rng(0).choice(n, sample, replace=False)) if sample < n else slice(None)
+        data = np.asarray(embs[rows], dtype=np.float32)
+        km = MiniBatchKMeans(n_clusters=nlist, random_state=0, n_init=1, batch_size=max(1024, 4 * nlist))
+        km.fit(data)
+        c = km.cluster_centers_.astype(np.float32)
+        norms = np.linalg.norm(c, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return c / norms
+
+    @staticmethod
+    def _assign(embs: Any, centroids: Any, block: int = 16384) -> Any:
+        out = np.empty(embs.shape[0], dtype=np.int32)
+        for s in range(0, embs.shape[0], block):
+            out[s:s + block] = np.argmax(np.asarray(embs[s:s + block], dtype=np.float32) @ centroids.T, axis=1)
+        return out
+
+    def candidates(self, q: Any) -> Any:
+        sims = self.centroids @ np.asarray(q, dtype=np.float32)
+        p = min(self.nprobe, len(self.centroids))
+        probe = np.argpartition(-sims, p - 1)[:p] if p < len(sims) else np.arange(len(sims))
+        return np.sort(np.concatenate([self._lists[c] for c in probe]))
+
+    def save(self, path: Path, model_id: str) -> None:
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        with tmp.open("wb") as f:
+            np.savez(f, centroids=self.centroids, assign=self.assign,
+                     hashes=np.array(self.hashes, dtype=str), model=model_id)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Path, model_id: str, nprobe: Optional[int] = None) -> Optional["IVFIndex"]:
+        try:
+            with np.load(path, allow_pickle=False) as z:
+                if str(z["model"]) != model_id:
+                    return None
+                return cls(z["centroids"], z["assign"], [str(h) for h in z["hashes"]],
+                           IVF_NPROBE if nprobe is None else nprobe)
+        except Exception:
+            return None
+
+    def stats(self) -> Dict[str, Any]:
+        sizes = [len(x) for x in self._lists]
+        return {"kind": self.kind, "nlist": len(self.centroids), "nprobe": self.nprobe,
+                "max_list": max(sizes) if sizes else 0}
@@ -10,9 +10,47 @@
       result.innerHTML = `<div class="alert alert-danger"><strong>Validation errors</strong><ul class="mb-0">${items}</ul></div>`;
       return;
     }
+    if (payload.error) {
+      result.innerHTML = '<div class="alert alert-danger"></div>';
+      result.firstChild.textContent = payload.error;
+      return;
+    }
     const s = payload.stats || {};
     const mode = payload.mode || (document.getElementById('mode')?.value || 'replace');
-    result.innerHTML = `<div class="alert alert-success">${mode.toUpperCase()} applied. Added: <strong>${s.added||0}</strong>, Updated: <strong>${s.updated||0}</strong>, Removed: <strong>${s.removed||0}</strong>, Deduped: <strong>${s.deduplicated||0}</strong>.</div>`;
+    result.innerHTML = `<div class="alert alert-success">${mode.toUpperCase()} applied. Added: <strong>${s.added||0}</strong>, Updated: <strong>${s.updated||0}</strong>, Removed: <strong>${s.removed||0}</strong>, Deduped: <strong>${s.deduplicated||0}</strong>.</div><div id="reload" class="small text-muted"></div>`;
+    if (payload.reload) pollReload(payload.kb || 'default', payload.reload.job);
+  }
+
+  // The index rebuild runs in the background after an upload; poll until it lands
+  async function pollReload(kb, job) {
+    const el = document.getElementById('reload');
+    for (;;) {
+      let st;
+      try {
+        st = await (await fetch('/admin/upload/status?kb=' + encodeURIComponent(kb))).json();
+      } catch {
+        if (el) el.textContent = 'Could not read rebuild status.';
+        return;
+      }
+      if (!el) return;
+      if (st.loaded === false) {
+        el.textContent = `Saved. The search index for "${kb}" is built when it is next used.`;
+        return;
+      }
+      if (st.job >= job && st.state === 'ready') {
+        el.textContent = `Search index updated (version ${st.version}, ${st.duration_ms} ms).`;
+        return;
+      }
+      if (st.job >= job && st.state === 'failed') {
+        const err = document.createElement('span');
+        err.className = 'text-danger';
+        err.textContent = `Search index rebuild failed: ${st.error || 'unknown error'}`;
+        el.replaceChildren(err);
+        return;
+      }
+      el.textContent = `Rebuilding search index${st.stage ? ' (' + st.stage + ')' : ''}…`;
+      await new Promise(r => setTimeout(r, 500));
+    }
   }
 
   form?.addEventListener('submit', async (e) => {
@@ -101,6 +101,28 @@
   }
   loadSamples();
 
+  // As-you-type completions (prefix index; responses are HTTP-cacheable)
+  const suggestList = document.getElementById('suggest-list');
+  let suggestTimer = null, suggestCtl = null;
+  input.addEventListener('input', ()=>{
+    clearTimeout(suggestTimer);
+    const q = input.value.trim();
+    if (q.length < 2) { suggestList.replaceChildren(); return; }
+    suggestTimer = setTimeout(async ()=>{
+      if (suggestCtl) suggestCtl.abort();
+      suggestCtl = new AbortController();
+      try{
+        const res = await fetch('/suggest?q=' + encodeURIComponent(q), { signal: suggestCtl.signal });
+        const data = await res.json();
+        suggestList.replaceChildren(...(data.suggestions || []).map(s => {
+          const o = document.createElement('option');
+          o.value = s;
+          return o;
+        }));
+      }catch{}
+    }, 120);
+  });
+
   // Handle user submitting message
   form.addEventListener('submit', async (e) => {
     e.preventDefault();
@@ -1,6 +1,7 @@
 /**
  * HAL Sarathi Chatbot Widget
- * Usage: <hal-chatbot endpoint="http://localhost:8000"></hal-chatbot>
+ * Usage: <hal-chatbot endpoint="http://localhost:8000" kb="default"></hal-chatbot>
+ * kb (optional) selects which knowledge base answers; omitted means "default".
  */
 (function(){
   const CSS = `
@@ -63,15 +64,18 @@
       super();
       this.attachShadow({mode:'open'});
       this._ep = '';
+      this._kb = '';
       this._open = false;
     }
-    static get observedAttributes() { return ['endpoint']; }
-    attributeChangedCallback(n,o,v) { if(n==='endpoint') this._ep = v; }
+    static get observedAttributes() { return ['endpoint','kb']; }
+    attributeChangedCallback(n,o,v) { if(n==='endpoint') this._ep = v; else if(n==='kb') this._kb = v || ''; }
     connectedCallback() {
       this._ep = this.getAttribute('endpoint') || '';
+      this._kb = this.getAttribute('kb') || '';
       this._render();
       this._events();
     }
+    _kbq(sep) { return this._kb ? sep + 'kb=' + encodeURIComponent(this._kb) : ''; }
     _logo() { return this._ep + '/static/img/chat-logo.png'; }
     _user() { return this._ep + '/static/img/user.svg'; }
     _render() {
@@ -86,7 +90,7 @@
     <button class="cl"><svg width="20" height="20" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2.5"><line x1="18" y1="6" x2="6" y2="18"/><line x1="6" y1="6" x2="18" y2="18"/></svg></button>
   </div>
   <div class="ms"><div class="m bot"><div class="av"><img src="${l}" alt=""/></div><div class="bb">Hi! How can I help you today?</div></div></div>
-  <form class="ia"><input type="text" placeholder="Type your message..." required/><button type="submit">Send</button></form>
+  <form class="ia" autocomplete="off"><input type="text" placeholder="Type your message..." list="hs-sg" required/><datalist id="hs-sg"></datalist><button type="submit">Send</button></form>
 </div>`;
     }
     _events() {
@@ -102,6 +106,11 @@
       tr.onclick=()=>{hideG();this._openChat();};
       cl.onclick=()=>this._closeChat();
       fm.onsubmit=async e=>{e.preventDefault();const t=ip.value.trim();if(!t)return;ip.value='';this._addMsg('u',t);await this._send(t);};
+      const dl=$('#hs-sg'); let st=null, sc=null;
+      ip.oninput=()=>{clearTimeout(st);const q=ip.value.trim();if(q.length<2){dl.replaceChildren();return;}
+        st=setTimeout(async()=>{if(sc)sc.abort();sc=new AbortController();
+          try{const r=await fetch(this._ep+'/suggest?q='+encodeURIComponent(q)+this._kbq('&'),{signal:sc.signal});const d=await r.json();
+            dl.replaceChildren(...(d.suggestions||[]).map(x=>{const o=document.createElement('option');o.value=x;return o;}));}catch(e){}},120);};
       ms.onclick=async e=>{if(e.target.classList.contains('sg')&&e.target.tagName==='BUTTON'){const t=e.target.textContent;this._addMsg('u',t);await this._send(t);}};
     }
     _openChat() {
@@ -153,7 +162,7 @@
       btn.disabled=true; ip.disabled=true;
       const tp=this._addTyping();
       try {
-        const r=await fetch(this._ep+'/ask',{method:'POST',headers:{'Content-Type':'application/json'},body:JSON.stringify({message:t})});
+        const r=await fetch(this._ep+'/ask'+this._kbq('?'),{method:'POST',headers:{'Content-Type':'application/json'},body:JSON.stringify({message:t})});
         const d=await r.json(); tp.remove();
         await this._typeMsg(d.reply||'Sorry, something went wrong.',d.suggestions||[]);
       } catch(e) { tp.remove(); await this._typeMsg('Unable to connect.',[]); }
@@ -0,0 +1,108 @@
+"""Recall/latency of the IVF semantic index against exact search.
+
+    python -m benchmarks.bench_ann --n 100000 --nprobe 4 8 16
+    python -m benchmarks.bench_ann --quant-recall default --quant int8 --rescore 256
+
+Vectors are synthetic (clustered, unit length, MiniLM-sized) unless --embeddings
+points at an .npy matrix, e.g. one written by EMBED_STORE=npy.
+
+--quant-recall KB instead reports EmbeddingsService.quant_recall for a stored knowledge
+base: recall@k of the EMBED_QUANT first pass plus EMBED_RESCORE exact re-scoring against
+plain float32 search, queried with --queries questions sampled from the KB. It needs the
+embedding model and reuses (and, for a new --quant mode, updates) the KB's vector cache.
+"""
+from __future__ import annotations
+import argparse
+import json
+import random
+import time
+
+import numpy as np
+
+from app.services.ranking import top_k
+from app.services.vector_index import IVFIndex
+
+
+def synthetic(n: int, dim: int, clusters: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    x = centers[rng.integers(0, clusters, n)] + 0.6 * rng.standard_normal((n, dim)).astype(np.float32)
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+def percentile_ms(samples: list, p: float) -> float:
+    return round(1000.0 * float(np.percentile(samples, p)), 3)
+
+
+def stored_quant_recall(args: argparse.Namespace) -> dict:
+    from app.services.data import DataService, kb_paths
+    from app.services.embeddings import EmbeddingsService
+
+    paths = kb_paths(args.quant_recall)
+    questions = [it.question for it in DataService.load_kb(paths.data)]
+    svc = EmbeddingsService(model_dir=args.model, quant=args.quant, rescore=args.rescore, data_dir=paths.dir)
+    if svc.quant == "none":
+        raise SystemExit("set --quant (or EMBED_QUANT) to float16 or int8")
+    if not svc.warm_up():
+        raise SystemExit(f"embedding model unavailable: {svc.error or args.model}")
+    svc.set_questions(questions)
+    queries = random.Random(0).sample(questions, min(args.queries, len(questions)))
+    t0 = time.perf_counter()
+    recall = svc.quant_recall(queries, args.k)
+    return {"kb": paths.kb, "n": len(questions), "quant": svc.quant, "rescore": svc.rescore, "k": args.k,
+            "queries": len(queries), "recall_at_k": round(recall, 4), "sync": svc.last_sync,
+            "elapsed_s": round(time.perf_counter() - t0, 3)}
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--n", type=int, default=100_000)
+    ap.add_argument("--dim", type=int, default=384)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    ap.add_argument("--embeddings", help="optional .npy matrix to use instead of synthetic vectors")
+    ap.add_argument("--quant-recall", metavar="KB", help="report quantized recall@k for a stored KB instead")
+    ap.add_argument("--quant", help="compact matrix for --quant-recall (default: EMBED_QUANT)")
+    ap.add_argument("--rescore", type=int, help="rows re-scored exactly for --quant-recall (default: EMBED_RESCORE)")
+    ap.add_argument("--model", default="all-MiniLM-L6-v2-optimized", help="model directory for --quant-recall")
+    args = ap.parse_args()
+    if args.quant_recall:
+        print(json.dumps(stored_quant_recall(args), indent=2))
+        return
+
+    embs = np.load(args.embeddings, mmap_mode="r") if args.embeddings else synthetic(args.n, args.dim, 256)
+    embs = np.asarray(embs, dtype=np.float32)
+    queries = synthetic(args.queries, embs.shape[1], 256, seed=1)
+    hashes = [str(i) for i in range(embs.shape[0])]
+
+    t0 = time.perf_counter()
+    index = IVFIndex.build(embs, hashes)
+    build_s = time.perf_counter() - t0
+
+    exact_lat, truth = [], []
+    for q in queries:
+        t = time.perf_counter()
+        truth.append({i for i, _ in top_k(embs @ q, args.k)})
+        exact_lat.append(time.perf_counter() - t)
+    results = {"n": embs.shape[0], "dim": embs.shape[1], "nlist": len(index.centroids),
+               "build_s": round(build_s, 3),
+               "exact": {"p50_ms": percentile_ms(exact_lat, 50), "p95_ms": percentile_ms(exact_lat, 95)},
+               "ivf": []}
+    for nprobe in args.nprobe:
+        index.nprobe = nprobe
+        lat, recall = [], 0.0
+        for q, want in zip(queries, truth):
+            t = time.perf_counter()
+            cand = index.candidates(q)
+            scores = embs[cand] @ q
+            got = {int(cand[i]) for i, _ in top_k(scores, args.k)}
+            lat.append(time.perf_counter() - t)
+            recall += len(got & want) / args.k
+        results["ivf"].append({"nprobe": nprobe, "recall_at_k": round(recall / len(queries), 4),
+                               "p50_ms": percentile_ms(lat, 50), "p95_ms": percentile_ms(lat, 95)})
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+"""Latency/throughput of the ranking pipeline on synthetic KBs.
+
+    python -m benchmarks.bench_pipeline --sizes 1000 10000 100000 --out bench.json
+    python -m benchmarks.bench_pipeline --compare before.json after.json
+
+KBs are shaped like data/data.json (question, answer, keywords, tags). Each run works in
+a temporary directory (app/ and the model are symlinked in), so data/ is never touched.
+Timed per KB size:
+
+  - DataService.save_kb / load_kb
+  - Matcher.__init__ and Matcher.score_all (p50/p95/p99 per query)
+  - EmbeddingsService.set_questions (cold cache) and score_all; a small hashing encoder
+    stands in when sentence-transformers or the model directory is missing
+  - POST /ask end to end through the ASGI app at each --concurrency level
+    (answer cache off unless --answer-cache)
+
+Results are JSON; --compare prints the relative change of every metric between two
+result files and exits non-zero when one regressed by more than --threshold.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import zlib
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from benchmarks.bench_ann import percentile_ms
+
+REPO = Path(__file__).resolve().parent.parent
+MODEL_DIR = "all-MiniLM-L6-v2-optimized"
+
+PRODUCTS = ["Tomcat", "Java", "Nginx", "Apache", "MySQL", "PostgreSQL", "Redis", "Docker", "Kubernetes",
+            "Jenkins", "Git", "Maven", "Gradle", "Linux", "Windows", "VPN", "Outlook", "SAP", "Oracle", "Python"]
+ACTIONS = ["install", "configure", "restart", "upgrade", "reset", "enable", "disable", "backup", "restore",
+           "monitor", "secure", "migrate", "debug", "tune", "uninstall"]
+THINGS = ["password", "port", "certificate", "service", "cache", "logs", "memory", "cluster", "proxy", "user",
+          "database", "connection pool", "heap size", "firewall rule", "license", "plugin", "session timeout"]
+TEMPLATES = ["How to {a} {t} on {p}?", "{p} {t} fails after {a}", "Unable to {a} {p} {t}",
+             "What is the default {t} for {p}?", "{p} shows error when I {a} the {t}", "Steps to {a} {t} in {p}"]
+SYLLABLES = ["ka", "to", "ri", "mex", "lo", "van", "dre", "sul", "pi", "nor", "qua", "zen", "tor", "bel", "fi"]
+
+
+class StandInModel:
+    """Hashing bag-of-words encoder with the MiniLM output size; no downloads, no torch."""
+
+    dim = 384
+
+    def encode(self, texts: List[str], **kwargs: Any) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for r, text in enumerate(texts):
+            for tok in text.lower().split():
+                h = zlib.crc32(tok.encode("utf-8"))
+                out[r, h % self.dim] += 1.0 if h & 0x10000 else -1.0
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return out / norms
+
+
+def synthetic_kb(n: int, seed: int = 0) -> List[Dict[str, Any]]:
+    rng = random.Random(seed)
+    rare = ["".join(rng.choice(SYLLABLES) for _ in range(3)) for _ in range(max(50, n // 4))]
+    rows = []
+    for i in range(n):
+        p, a, t = rng.choice(PRODUCTS), rng.choice(ACTIONS), rng.choice(THINGS)
+        q = rng.choice(TEMPLATES).format(p=p, a=a, t=t)
+        q = f"{q} ({rng.choice(rare)} {i})"
+        answer = " ".join(f"Step {s + 1}: {rng.choice(ACTIONS)} the {rng.choice(THINGS)} in {p}." for s in range(3))
+        rows.append({"id": f"q_{i:016x}", "question": q, "answer": answer,
+                     "keywords": rng.sample([p, a, t, f"{p} {t}"], rng.randint(2, 4)),
+                     "tags": [p.lower()], "updated_at": "2025-08-20T09:14:26.511171Z"})
+    return rows
+
+
+def synthetic_queries(kb: List[Dict[str, Any]], n: int, seed: int = 1) -> List[str]:
+    """Mostly paraphrased KB questions (dropped/shuffled words), some out-of-KB noise."""
+    rng = random.Random(seed)
+    out = []
+    for _ in range(n):
+        if rng.random() < 0.7:
+            words = rng.choice(kb)["question"].split()
+            if len(words) > 3:
+                del words[rng.randrange(len(words))]
+            if rng.random() < 0.3:
+                rng.shuffle(words)
+            out.append(" ".join(words).lower())
+        else:
+            out.append(" ".join(rng.choice(PRODUCTS + ACTIONS + THINGS + SYLLABLES) for _ in range(rng.randint(2, 6))))
+    return out
+
+
+def latency(samples: List[float], wall: Optional[float] = None) -> Dict[str, float]:
+    wall = sum(samples) if wall is None else wall
+    return {"p50_ms": percentile_ms(samples, 50), "p95_ms": percentile_ms(samples, 95),
+            "p99_ms": percentile_ms(samples, 99), "qps": round(len(samples) / wall, 1) if wall > 0 else 0.0}
+
+
+def timed(fn, *args: Any) -> float:
+    t = time.perf_counter()
+    fn(*args)
+    return round(time.perf_counter() - t, 4)
+
+
+def per_query(fn, queries: List[str]) -> Dict[str, float]:
+    samples = []
+    for q in queries:
+        t = time.perf_counter()
+        fn(q)
+        samples.append(time.perf_counter() - t)
+    return latency(samples)
+
+
+async def ask_load(app: Any, queries: List[str], concurrency: int) -> Dict[str, Any]:
+    import httpx
+    sem = asyncio.Semaphore(concurrency)
+    samples: List[float] = []
+    errors = 0
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        async def one(q: str) -> None:
+            nonlocal errors
+            async with sem:
+                t = time.perf_counter()
+                r = await client.post("/ask", json={"message": q})
+                samples.append(time.perf_counter() - t)
+                errors += r.status_code != 200
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(one(q) for q in queries))
+        wall = time.perf_counter() - t0
+    return dict(latency(samples, wall), errors=errors)
+
+
+def embeddings_service(model: str) -> Any:
+    from app.services.embeddings import EmbeddingsService
+    if model != "stand-in":
+        svc = EmbeddingsService()
+        if svc.warm_up():
+            return svc
+    svc = EmbeddingsService(model_dir="stand-in")
+    svc.model, svc.enabled, svc.state = StandInModel(), True, "ready"
+    return svc
+
+
+def run_size(n: int, args: argparse.Namespace) -> Dict[str, Any]:
+    from app.models.schemas import KBItem
+    from app.services.data import DEFAULT_KB, DataService
+    from app.services.kb_registry import KBRegistry
+    from app.services.matcher import Matcher
+    from app.services.cache import AnswerCache
+    from app.routers import public
+    import main
+
+    rows = synthetic_kb(n)
+    items = [KBItem(**{**r, "updated_at": datetime(2025, 8, 20, 9, 14, 26)}) for r in rows]
+    queries = synthetic_queries(rows, args.queries)
+    res: Dict[str, Any] = {"n": n, "queries": len(queries)}
+
+    res["save_kb_s"] = timed(DataService.save_kb, items)
+    res["load_kb_s"] = timed(DataService.load_kb)
+
+    questions = [it.question for it in items]
+    keywords = [it.keywords for it in items]
+    t = time.perf_counter()
+    matcher = Matcher(questions, keywords)
+    res["matcher_init_s"] = round(time.perf_counter() - t, 4)
+    res["matcher_score_all"] = per_query(matcher.score_all, queries)
+
+    svc = embeddings_service(args.model)
+    for f in Path("data").glob("embeddings*"):
+        f.unlink()
+    res["embed_model"] = svc.model_id
+    res["embed_set_questions_s"] = timed(svc.set_questions, questions)
+    res["embed_score_all"] = per_query(svc.score_all, queries)
+
+    # Serve this KB through the real app: same snapshot build and /ask path as production
+    public._embed = svc
+    public._registry = KBRegistry(svc, cache=None if args.answer_cache else AnswerCache(max_items=0))
+    res["snapshot_build_s"] = timed(public._registry.get, DEFAULT_KB)
+    res["ask"] = {}
+    for c in args.concurrency:
+        load = queries * max(1, (c * 20) // max(1, len(queries)))
+        res["ask"][f"c{c}"] = asyncio.run(ask_load(main.app, load, c))
+    return res
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory(prefix="bench-pipeline-") as tmp:
+        os.symlink(REPO / "app", Path(tmp) / "app")
+        if (REPO / MODEL_DIR).exists():
+            os.symlink(REPO / MODEL_DIR, Path(tmp) / MODEL_DIR)
+        (Path(tmp) / "data").mkdir()
+        cwd = os.getcwd()
+        os.chdir(tmp)  # the app resolves data/ relative to the working directory
+        try:
+            results = {
+                "meta": {"created": datetime.utcnow().isoformat() + "Z", "python": platform.python_version(),
+                         "platform": platform.platform(), "cpus": os.cpu_count(),
+                         "args": {k: v for k, v in vars(args).items() if k not in ("compare", "out", "threshold")}},
+                "sizes": [],
+            }
+            for n in args.sizes:
+                print(f"benchmarking {n} rows ...", file=sys.stderr)
+                results["sizes"].append(run_size(n, args))
+            from app.services.logging import LogService
+            LogService.shutdown()
+            return results
+        finally:
+            os.chdir(cwd)
+
+
+def flatten(results: Dict[str, Any]) -> Dict[str, float]:
+    out: Dict[str, float] = {}
+
+    def walk(prefix: str, node: Any) -> None:
+        if isinstance(node, dict):
+            for k, v in node.items():
+                walk(f"{prefix}.{k}" if prefix else k, v)
+        elif isinstance(node, (int, float)) and not isinstance(node, bool):
+            out[prefix] = float(node)
+
+    for size in results["sizes"]:
+        walk(str(size["n"]), {k: v for k, v in size.items() if k not in ("n", "queries", "embed_model")})
+    return out
+
+
+def compare(before_path: str, after_path: str, threshold: float) -> int:
+    before = flatten(json.loads(Path(before_path).read_text(encoding="utf-8")))
+    after = flatten(json.loads(Path(after_path).read_text(encoding="utf-8")))
+    regressions = 0
+    print(f"{'metric':<40} {'before':>12} {'after':>12} {'change':>9}")
+    for key in sorted(before.keys() & after.keys()):
+        a, b = before[key], after[key]
+        if key.endswith(".errors"):
+            change = b - a
+            worse = b > a
+        else:
+            change = (b - a) / a if a else 0.0
+            # throughput: higher is better; times and latencies: lower is better
+            worse = (-change if key.endswith(".qps") else change) > threshold
+        regressions += worse
+        shown = f"{change:+.0f}" if key.endswith(".errors") else f"{change:+.1%}"
+        print(f"{key:<40} {a:>12.4g} {b:>12.4g} {shown:>9}{'  REGRESSION' if worse else ''}")
+    print(f"{regressions} regression(s) beyond {threshold:.0%}")
+    return 1 if regressions else 0
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sizes", type=int, nargs="+", default=[1000, 10_000, 100_000])
+    ap.add_argument("--queries", type=int, default=200, help="queries timed per stage")
+    ap.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    ap.add_argument("--model", choices=["auto", "stand-in"], default="auto",
+                    help="auto uses the local model when it loads, else the stand-in encoder")
+    ap.add_argument("--answer-cache", action="store_true", help="leave the /ask answer cache on")
+    ap.add_argument("--out", help="write results JSON here (default: stdout)")
+    ap.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="compare two result files")
+    ap.add_argument("--threshold", type=float, default=0.10, help="relative slowdown counted as a regression")
+    args = ap.parse_args()
+
+    if args.compare:
+        sys.exit(compare(*args.compare, args.threshold))
+    results = run(args)
+    text = json.dumps(results, indent=2)
+    if args.out:
+        Path(args.out).write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
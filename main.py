@@ -1,13 +1,27 @@
+from contextlib import asynccontextmanager
+import threading
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import PlainTextResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 import uvicorn
 
-from app.routers.public import router as public_router
+from app.routers.public import router as public_router, readiness, warm_up
 from app.routers.admin import router as admin_router
+from app.services import metrics
+from app.services.assets import static_assets
+from app.services.logging import LogService
 
-app = FastAPI(title="Offline Chatbot", version="2.0")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the embedding model without holding up startup; /ask is lexical-only until it is ready
+    threading.Thread(target=warm_up, name="embed-warmup", daemon=True).start()
+    yield
+    # Write out query logs still buffered in memory
+    LogService.shutdown()
+
+
+app = FastAPI(title="Offline Chatbot", version="2.0", lifespan=lifespan)
 
 # CORS: Allow all origins for widget embedding (widget.js calls /ask from external sites)
 app.add_middleware(
@@ -37,7 +51,8 @@ async def security_headers(request, call_next):
     )
     return resp
 
-app.mount("/static", StaticFiles(directory="app/static"), name="static")
+# In-memory, precompressed static files with ETags (see app/services/assets.py)
+app.mount("/static", static_assets, name="static")
 
 app.include_router(public_router)
 app.include_router(admin_router)
@@ -46,5 +61,18 @@ app.include_router(admin_router)
 async def health():
     return "ok"
 
+@app.get("/ready")
+async def ready():
+    """Readiness (unlike /health): 503 while the embedding model is still warming up."""
+    status = readiness()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Prometheus scrape endpoint: per-stage /ask latency histograms plus KB, cache and queue gauges."""
+    if not metrics.ENABLED:
+        return PlainTextResponse("metrics disabled (METRICS=0)\n", status_code=404)
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=True)
@@ -0,0 +1,73 @@
+import json
+import unittest
+from unittest import mock
+from fastapi.testclient import TestClient
+import main
+from app.routers import public
+from app.services.executor import QueueFull
+from app.services.logging import LogService
+
+AUTH = ("admin", "admin123")
+
+
+class TestAskBatch(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient(main.app)
+        self.messages = ["tomcat address already in use", "vpn password reset", "zzz qqq"]
+
+    def post(self, body, **params):
+        return self.client.post("/ask/batch", params=params, json=body, auth=AUTH)
+
+    def test_requires_admin(self):
+        r = self.client.post("/ask/batch", json={"messages": ["hi"]})
+        self.assertEqual(r.status_code, 401)
+        r = self.client.post("/ask/batch", json={"messages": ["hi"]}, auth=("admin", "wrong"))
+        self.assertEqual(r.status_code, 401)
+
+    def test_json_and_ndjson_agree_and_nothing_is_logged(self):
+        with mock.patch.object(public, "ASK_BATCH_CHUNK", 2), \
+                mock.patch.object(LogService, "log_matched") as matched, \
+                mock.patch.object(LogService, "log_unmatched") as unmatched:
+            r = self.post({"messages": self.messages})
+            s = self.post({"messages": self.messages}, stream="true")
+        self.assertEqual(r.status_code, 200)
+        body = r.json()
+        self.assertEqual([it["index"] for it in body["results"]], [0, 1, 2])
+        self.assertEqual([it["status"] for it in body["results"]], [200, 200, 200])
+        self.assertEqual(s.headers["content-type"], "application/x-ndjson")
+        self.assertEqual(s.headers["x-kb-version"], str(body["kb_version"]))
+        lines = [json.loads(line) for line in s.text.splitlines()]
+        self.assertEqual(lines, body["results"])
+        matched.assert_not_called()
+        unmatched.assert_not_called()
+
+    def test_too_many_messages(self):
+        with mock.patch.object(public, "ASK_BATCH_MAX", 2):
+            r = self.post({"messages": self.messages})
+        self.assertEqual(r.status_code, 413)
+
+    def test_pool_that_stays_full_sheds_the_rest_of_the_batch(self):
+        real_run = public._executor.run
+        calls = []
+
+        async def run(fn, *args):
+            calls.append(fn)
+            if len(calls) > 1:
+                raise QueueFull()
+            return await real_run(fn, *args)
+
+        with mock.patch.object(public, "ASK_BATCH_CHUNK", 1), mock.patch.object(public, "ASK_BATCH_BUSY_WAIT", 0.1), \
+                mock.patch.object(public._executor, "run", run):
+            r = self.post({"messages": self.messages})
+        self.assertEqual([it["status"] for it in r.json()["results"]], [200, 503, 503])
+        self.assertEqual(r.json()["results"][2]["reply"], public.BUSY_REPLY)
+        self.assertLess(len(calls), 10)  # the third chunk is not retried after the second gave up
+
+        with mock.patch.object(public._executor, "run", side_effect=QueueFull()):
+            r = self.post({"messages": self.messages})
+        self.assertEqual(r.status_code, 503)
+        self.assertIn("Retry-After", r.headers)
+
+
+if __name__ == "__main__":
+    unittest.main()
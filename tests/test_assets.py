@@ -0,0 +1,65 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from starlette.applications import Starlette
+from starlette.routing import Mount
+from starlette.testclient import TestClient
+from app.services.assets import IMMUTABLE, StaticAssets, TemplateCache
+
+
+class TestAssets(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self._tmp.name)
+        (self.root / "static" / "js").mkdir(parents=True)
+        (self.root / "templates").mkdir()
+        (self.root / "static" / "js" / "w.js").write_text("console.log('widget');\n" * 200, encoding="utf-8")
+        (self.root / "secret.txt").write_text("no", encoding="utf-8")
+        self.assets = StaticAssets(self.root / "static", max_age=0)
+        self.client = TestClient(Starlette(routes=[Mount("/static", self.assets)]))
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_etag_304_and_precompressed_variant(self):
+        r = self.client.get("/static/js/w.js")
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.headers["content-encoding"], "gzip")
+        self.assertEqual(r.text, "console.log('widget');\n" * 200)
+        self.assertEqual(r.headers["cache-control"], "no-cache")
+        again = self.client.get("/static/js/w.js", headers={"If-None-Match": r.headers["etag"]})
+        self.assertEqual((again.status_code, again.content), (304, b""))
+        plain = self.client.get("/static/js/w.js", headers={"Accept-Encoding": "identity"})
+        self.assertNotIn("content-encoding", plain.headers)
+        self.assertNotEqual(plain.headers["etag"], r.headers["etag"])
+
+    def test_versioned_urls_are_immutable_and_follow_edits(self):
+        url = self.assets.url("js/w.js")
+        self.assertEqual(self.client.get(url).headers["cache-control"], IMMUTABLE)
+        path = self.root / "static" / "js" / "w.js"
+        path.write_text("changed()\n", encoding="utf-8")
+        os.utime(path, ns=(1, 1))
+        r = self.client.get(url)
+        self.assertEqual((r.text, r.headers["cache-control"]), ("changed()\n", "no-cache"))
+        self.assertNotEqual(self.assets.url("js/w.js"), url)
+
+    def test_stays_inside_directory(self):
+        self.assertEqual(self.client.get("/static/../secret.txt").status_code, 404)
+        self.assertEqual(self.client.get("/static/%2e%2e/secret.txt").status_code, 404)
+        self.assertEqual(self.client.post("/static/js/w.js").status_code, 405)
+
+    def test_templates_cached_until_file_changes(self):
+        page = self.root / "templates" / "page.html"
+        page.write_text('<script src="/static/js/w.js"></script>', encoding="utf-8")
+        cache = TemplateCache(self.root / "templates", self.assets)
+        first = cache.get("page.html")
+        self.assertIn(f'"{self.assets.url("js/w.js")}"', first)
+        self.assertIs(cache.get("page.html"), first)
+        page.write_text("<p>v2</p>", encoding="utf-8")
+        os.utime(page, ns=(1, 1))
+        self.assertEqual(cache.get("page.html"), "<p>v2</p>")
+
+
+if __name__ == "__main__":
+    unittest.main()
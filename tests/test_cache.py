@@ -0,0 +1,21 @@
+import unittest
+from app.services.cache import AnswerCache
+
+class TestAnswerCache(unittest.TestCase):
+    def test_lru_eviction_and_counters(self):
+        c = AnswerCache(max_items=2, ttl=0)
+        c.put("a", 1)
+        c.put("b", 2)
+        self.assertEqual(c.get("a"), 1)  # "b" is now least recently used
+        c.put("c", 3)
+        self.assertIsNone(c.get("b"))
+        self.assertEqual(c.get("c"), 3)
+        self.assertEqual(c.stats(), {"size": 2, "max_items": 2, "hits": 2, "misses": 1})
+
+    def test_disabled(self):
+        c = AnswerCache(max_items=0)
+        c.put("a", 1)
+        self.assertIsNone(c.get("a"))
+
+if __name__ == '__main__':
+    unittest.main()
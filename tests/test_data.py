@@ -0,0 +1,31 @@
+import io
+import unittest
+from unittest import mock
+from app.services import data as data_mod
+from app.services.data import DataService
+
+
+class TestStreamingUpload(unittest.TestCase):
+    def test_csv_rows_stream_into_upsert(self):
+        raw = io.BytesIO(b'question,answer,keywords\nHow to foo?,Do foo,foo;fooing\n"Multi\nline?",yes,\n')
+        rows = DataService.iter_csv_rows(raw)
+        self.assertFalse(isinstance(rows, list))
+        with mock.patch.object(DataService, "load_kb", return_value=[]):
+            items, stats, errors = DataService.upsert_from_rows(rows, mode="replace")
+        self.assertEqual(errors, [])
+        self.assertEqual([it.question for it in items], ["How to foo?", "Multi\nline?"])
+        self.assertEqual(items[0].keywords, ["foo", "fooing"])
+        self.assertEqual(stats["added"], 2)
+        self.assertFalse(raw.closed)
+
+    def test_error_messages_are_capped(self):
+        rows = ({"question": "", "answer": ""} for _ in range(12))
+        with mock.patch.object(DataService, "load_kb", return_value=[]), \
+                mock.patch.object(data_mod, "MAX_UPLOAD_ERRORS", 5):
+            _, _, errors = DataService.upsert_from_rows(rows)
+        self.assertEqual(len(errors), 6)
+        self.assertEqual(errors[-1], "... and 7 more errors")
+
+
+if __name__ == "__main__":
+    unittest.main()
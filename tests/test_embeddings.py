@@ -0,0 +1,184 @@
+import sys
+import tempfile
+import threading
+import types
+import unittest
+from pathlib import Path
+from unittest import mock
+from app.services.embeddings import EmbeddingsService, SemanticIndex, _MicroBatcher
+
+try:
+    import numpy as np
+except Exception:
+    np = None
+
+
+class FakeModel:
+    """Stand-in encoder: one-hot over the first letter of the text."""
+
+    def __init__(self):
+        self.encoded = 0
+
+    def encode(self, texts, **kwargs):
+        self.encoded += len(texts)
+        out = np.zeros((len(texts), 26), dtype=np.float32)
+        for r, t in enumerate(texts):
+            out[r, (ord(t.lower()[0]) - 97) % 26] = 1.0
+        return out
+
+
+class HashModel:
+    """Stand-in encoder: deterministic pseudo-random unit vectors per text."""
+
+    def encode(self, texts, **kwargs):
+        rows = []
+        for t in texts:
+            v = np.random.default_rng(abs(hash(t)) % (2 ** 32)).standard_normal(64).astype(np.float32)
+            rows.append(v / np.linalg.norm(v))
+        return np.array(rows, dtype=np.float32).reshape(len(texts), 64)
+
+
+def fake_service(questions):
+    svc = EmbeddingsService(model_dir="/nonexistent-model", batch_max=1)
+    svc.enabled = True
+    svc.model = FakeModel()
+    svc.current = SemanticIndex(svc.model.encode(questions), list(questions))
+    return svc
+
+
+class TestMicroBatcher(unittest.TestCase):
+    def test_coalesces_concurrent_queries(self):
+        sizes = []
+        gate = threading.Event()
+
+        def fn(queries):
+            gate.wait()
+            sizes.append(len(queries))
+            return [q.upper() for q in queries]
+
+        b = _MicroBatcher(fn, max_batch=8, max_wait_ms=50)
+        first = b.submit("warm")  # occupies the worker until the gate opens
+        futs = [b.submit(f"q{i}") for i in range(5)]
+        gate.set()
+        self.assertEqual(first.result(timeout=5), "WARM")
+        self.assertEqual([f.result(timeout=5) for f in futs], [f"Q{i}" for i in range(5)])
+        self.assertLess(len(sizes), 6)
+        self.assertEqual(sum(sizes), 6)
+
+@unittest.skipIf(np is None, "numpy not installed")
+class TestSemanticTopK(unittest.TestCase):
+    def test_topk_matches_full_sort(self):
+        svc = fake_service(["apple", "banana", "avocado", "cherry"])
+        full = svc.score_all("almond")
+        self.assertEqual([i for i, _ in svc.score_topk("almond", 2)], [0, 2])
+        self.assertEqual(svc.score_topk("almond", 2), full[:2])
+
+    def test_score_arrays_encodes_once(self):
+        svc = fake_service(["apple", "banana", "avocado", "cherry"])
+        queries = ["almond", "cashew", "blueberry"]
+        rows = svc.score_arrays(queries)
+        self.assertEqual(svc.model.encoded, 4 + 3)
+        for q, row in zip(queries, rows):
+            self.assertTrue(np.array_equal(row, svc.score_array(q)))
+
+@unittest.skipIf(np is None, "numpy not installed")
+class TestIncrementalCache(unittest.TestCase):
+    def test_reencodes_only_changed_questions(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            svc = fake_service([])
+            svc.data_dir = Path(tmp)
+            svc.cache_path = svc.data_dir / "embeddings.npz"
+            svc.set_questions(["apple", "banana", "cherry"])
+            self.assertEqual(svc.model.encoded, 3)
+            svc.set_questions(["cherry", "date", "apple"])
+            self.assertEqual(svc.last_sync, {"reused": 2, "encoded": 1, "pruned": 1})
+            self.assertEqual(svc.model.encoded, 4)
+            self.assertTrue(np.array_equal(svc.q_emb, svc.model.encode(["cherry", "date", "apple"])))
+            svc.model_id = "other-model"
+            svc.set_questions(["cherry", "date", "apple"])
+            self.assertEqual(svc.last_sync["encoded"], 3)
+
+    def test_npy_store_is_memory_mapped(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            svc = fake_service([])
+            svc.store = "npy"
+            svc.data_dir = Path(tmp)
+            svc.meta_path = svc.data_dir / "embeddings.meta.json"
+            svc.set_questions(["apple", "banana"])
+            self.assertIsInstance(svc.q_emb, np.memmap)
+            svc.set_questions(["banana", "cherry"])
+            self.assertEqual(svc.last_sync, {"reused": 1, "encoded": 1, "pruned": 1})
+            self.assertIsInstance(svc.q_emb, np.memmap)
+            self.assertEqual(len(list(Path(tmp).glob("*.npy"))), 1)
+            self.assertTrue(np.array_equal(svc.score_array("carrot"), [0.0, 1.0]))
+
+@unittest.skipIf(np is None, "numpy not installed")
+class TestQuantized(unittest.TestCase):
+    def test_int8_rescoring_keeps_recall(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for store in ("npz", "npy"):
+                svc = EmbeddingsService(model_dir="/nonexistent-model", batch_max=1, store=store, quant="int8", rescore=50)
+                svc.enabled, svc.model = True, HashModel()
+                svc.data_dir = Path(tmp) / store
+                svc.cache_path = svc.data_dir / "embeddings.npz"
+                svc.meta_path = svc.data_dir / "embeddings.meta.json"
+                questions = [f"question {i}" for i in range(500)]
+                svc.set_questions(questions)
+                self.assertEqual(svc.current.qm.compact.dtype, np.int8)
+                self.assertGreaterEqual(svc.quant_recall([f"query {i}" for i in range(20)], k=10), 0.95)
+                top = svc.score_topk("question 7", 1)
+                self.assertEqual(top[0][0], 7)
+                # Top hits carry exact float32 scores re-ranked from the memory-mapped rows
+                self.assertIsInstance(svc.current.qm.exact, np.memmap)
+                self.assertAlmostEqual(top[0][1], 1.0, places=5)
+                if store == "npz":
+                    with np.load(svc.cache_path) as z:
+                        self.assertEqual(z["compact"].dtype, np.int8)
+                        self.assertTrue((svc.data_dir / str(z["exact_file"])).exists())
+                svc.set_questions(questions)  # reload from cache in the same mode
+                self.assertEqual(svc.last_sync["encoded"], 0)
+                self.assertEqual(svc.current.qm.compact.dtype, np.int8)
+                self.assertEqual(svc.current.n, 500)
+                svc.set_questions(questions + ["question 500"])  # incremental, from the disk cache
+                self.assertEqual(svc.last_sync, {"reused": 500, "encoded": 1, "pruned": 0})
+                self.assertEqual(svc.score_topk("question 500", 1)[0][0], 500)
+                self.assertIsInstance(svc.current.qm.exact, np.memmap)
+                if store == "npz":
+                    # The previous sidecar is replaced, not accumulated
+                    self.assertEqual(len(list(svc.data_dir.glob("*.exact.npy"))), 1)
+
+@unittest.skipIf(np is None, "numpy not installed")
+class TestWarmUp(unittest.TestCase):
+    def test_model_loads_lazily_on_warm_up(self):
+        loaded = []
+
+        def load(path):
+            model = FakeModel()
+            loaded.append(model)
+            return model
+
+        fake_st = types.SimpleNamespace(SentenceTransformer=load)
+        svc = EmbeddingsService(model_dir="/nonexistent-model", batch_max=1)
+        self.assertFalse(svc.enabled)
+        self.assertEqual(loaded, [])
+        svc.state = "pending"  # as if the model directory existed
+        with mock.patch.dict(sys.modules, {"sentence_transformers": fake_st}):
+            self.assertTrue(svc.warm_up())
+            self.assertTrue(svc.warm_up())  # idempotent
+        self.assertEqual((svc.state, len(loaded), loaded[0].encoded), ("ready", 1, 1))
+        svc.current = SemanticIndex(svc.model.encode(["apple", "banana"]), ["a", "b"])
+        self.assertEqual(svc.score_topk("berry", 1)[0][0], 1)
+
+    def test_failed_load_stays_disabled(self):
+        def load(path):
+            raise OSError("no model")
+
+        svc = EmbeddingsService(model_dir="/nonexistent-model", batch_max=1)
+        svc.state = "pending"
+        with mock.patch.dict(sys.modules, {"sentence_transformers": types.SimpleNamespace(SentenceTransformer=load)}):
+            self.assertFalse(svc.warm_up())
+        self.assertEqual(svc.state, "failed")
+        self.assertIsNone(svc.score_array("apple", SemanticIndex(np.eye(2, dtype=np.float32), ["a", "b"])))
+
+if __name__ == '__main__':
+    unittest.main()
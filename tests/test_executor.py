@@ -0,0 +1,27 @@
+import asyncio
+import threading
+import unittest
+from app.services.executor import ScoringExecutor, QueueFull
+
+class TestScoringExecutor(unittest.TestCase):
+    def test_sheds_load_when_full(self):
+        ex = ScoringExecutor(workers=1, queue_size=1)
+        gate = threading.Event()
+
+        async def scenario():
+            first = asyncio.ensure_future(ex.run(gate.wait))
+            second = asyncio.ensure_future(ex.run(lambda: 42))
+            await asyncio.sleep(0.05)
+            with self.assertRaises(QueueFull):
+                await ex.run(lambda: 0)
+            self.assertEqual(ex.stats()["queue_depth"], 1)
+            gate.set()
+            return await first, await second
+
+        self.assertEqual(asyncio.run(scenario()), (True, 42))
+        s = ex.stats()
+        self.assertEqual((s["rejected"], s["completed"], s["queue_depth"]), (1, 2, 0))
+        ex.shutdown()
+
+if __name__ == '__main__':
+    unittest.main()
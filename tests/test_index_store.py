@@ -0,0 +1,43 @@
+import tempfile
+import unittest
+from datetime import datetime
+from pathlib import Path
+from app.models.schemas import KBItem
+from app.services.index_store import load_index, save_index
+from app.services.matcher import Matcher
+from app.services.suggest import SuggestIndex
+
+
+class TestIndexStore(unittest.TestCase):
+    def test_round_trip_and_fingerprint_check(self):
+        items = [
+            KBItem(id="1", question="How to reset password?", answer="Use the link.",
+                   keywords=["reset password"], tags=["auth"], updated_at=datetime(2025, 1, 2, 3, 4, 5)),
+            KBItem(id="2", question="What is refund policy?", answer="30 days.", keywords=["refund"],
+                   updated_at=datetime(2025, 1, 3)),
+        ]
+        m = Matcher([it.question for it in items], [it.keywords for it in items])
+        sug = SuggestIndex([it.question for it in items], [it.keywords for it in items])
+        with tempfile.TemporaryDirectory() as d:
+            path = Path(d) / "index.bin"
+            save_index("abc", items, m, ["h1", "h2"], sug, path=path)
+            self.assertIsNone(load_index("other", path=path))
+            loaded_items, loaded, hashes, loaded_sug = load_index("abc", path=path)
+        self.assertEqual([it.model_dump() for it in loaded_items], [it.model_dump() for it in items])
+        self.assertEqual(hashes, ["h1", "h2"])
+        for q in ["I forgot my password", "refund", "nothing here"]:
+            self.assertEqual(loaded.score_topk(q, 5), m.score_topk(q, 5))
+            self.assertEqual(loaded.keyword_hits(q), m.keyword_hits(q))
+        for prefix in ["how", "pass", "refund", "x"]:
+            self.assertEqual(loaded_sug.complete(prefix), sug.complete(prefix))
+
+    def test_missing_or_corrupt_file(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = Path(d) / "index.bin"
+            self.assertIsNone(load_index("abc", path=path))
+            path.write_bytes(b"garbage")
+            self.assertIsNone(load_index("abc", path=path))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime
+from pathlib import Path
+from app.models.schemas import KBItem
+from app.services import metrics
+from app.services.data import DEFAULT_KB, DataService, kb_paths
+from app.services.embeddings import EmbeddingsService
+from app.services.kb_registry import KBRegistry
+
+
+def item(i, question):
+    return KBItem(id=f"q_{i:016x}", question=question, answer=f"Answer {i}", keywords=["tomcat"], tags=[],
+                  updated_at=datetime(2025, 8, 20))
+
+
+class TestKBRegistry(unittest.TestCase):
+    def setUp(self):
+        # KB paths are relative to the working directory, as in the app
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+        for kb in ("hr", "it"):
+            DataService.save_kb([item(i, f"How to reset {kb} password {i}?") for i in range(20)], kb_paths(kb).data)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_paths_and_ids(self):
+        self.assertEqual(kb_paths().data, Path("data/data.json"))
+        self.assertEqual(kb_paths("hr").index, Path("data/kbs/hr/index.bin"))
+        for bad in ("", "HR", "../x", "a b", "-x"):
+            with self.assertRaises(ValueError):
+                kb_paths(bad)
+        self.assertEqual(DataService.list_kbs(), [DEFAULT_KB, "hr", "it"])
+
+    def test_lazy_load_and_lru_eviction_under_budget(self):
+        reg = KBRegistry(EmbeddingsService(model_dir="missing"), budget_mb=0)
+        self.assertIsNone(reg.peek("hr"))
+        hr = reg.get("hr")
+        self.assertEqual(hr.snap.questions[0], "How to reset hr password 0?")
+        self.assertTrue(Path("data/kbs/hr/index.bin").exists())
+        with self.assertRaises(KeyError):
+            reg.get("missing")
+        self.assertFalse(reg.exists("../hr"))
+
+        # Room for exactly one of the two KBs: loading "it" evicts "hr", never itself
+        reg.budget = hr.nbytes + hr.nbytes // 2
+        reg.cache.put(("hr", 1, "reset"), {"reply": "x"})
+        it = reg.get("it")
+        self.assertIs(reg.peek("it"), it)
+        self.assertIsNone(reg.peek("hr"))
+        self.assertEqual((reg.loads, reg.evictions), (2, 1))
+        self.assertIsNone(reg.cache.get(("hr", 1, "reset")))
+        self.assertEqual(reg.status("hr")["loaded"], False)
+
+        # A single KB larger than the budget is still served
+        reg.budget = 1
+        self.assertIs(reg.get("it"), it)
+        self.assertEqual(reg.evictions, 1)
+        self.assertEqual(set(reg.stats()["loaded"]), {"it"})
+
+        # Reloading an evicted KB never reuses a version an in-flight request may still cache under
+        self.assertNotIn(reg.get("hr").snap.version, {hr.snap.version, it.snap.version})
+
+    def test_models_are_shared_across_kbs(self):
+        embed = EmbeddingsService(model_dir="missing")
+        reg = KBRegistry(embed, budget_mb=0)
+        hr, it = reg.get("hr"), reg.get("it")
+        embed.model, embed.enabled = object(), True
+        self.assertIs(hr.embed.model, embed.model)
+        self.assertIs(it.embed.model, embed.model)
+        self.assertNotEqual(hr.embed.cache_path, it.embed.cache_path)
+
+    def test_multi_label_gauge(self):
+        g = metrics.Gauge("t_kb_seconds", "test", lambda: {("hr", "total"): 0.5}, label=("kb", "part"))
+        self.assertEqual(g.render(), ['t_kb_seconds{kb="hr",part="total"} 0.5'])
+
+
+if __name__ == "__main__":
+    unittest.main()
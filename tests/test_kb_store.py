@@ -0,0 +1,89 @@
+import json
+import os
+import tempfile
+import unittest
+from datetime import datetime
+from pathlib import Path
+from unittest import mock
+from app.models.schemas import KBItem
+from app.services import kb_store
+from app.services.data import DataService
+
+
+def item(i, answer="Answer", ts=datetime(2025, 8, 20)):
+    return KBItem(id=f"q_{i:016x}", question=f"Question {i}?", answer=f"{answer} {i}", keywords=[], tags=[],
+                  updated_at=ts)
+
+
+class TestKBStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp.name) / "data.json"
+        self.journal = kb_store.journal_path(self.path)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def save(self, items, store="journal"):
+        with mock.patch.object(kb_store, "KB_STORE", store):
+            return DataService.save_kb(items, self.path)
+
+    def test_journal_records_only_changes_and_replays(self):
+        items = [item(i) for i in range(10)]
+        self.assertEqual(self.save(items), "full")
+        snapshot = self.path.read_bytes()
+        fp = DataService.kb_fingerprint(self.path)
+
+        later = datetime(2025, 9, 1)
+        edited = [item(i, ts=later) for i in range(10) if i != 3]  # re-uploaded, only timestamps differ
+        edited[0] = item(0, "Changed", later)
+        edited.append(item(10, ts=later))
+        self.assertEqual(self.save(edited), "journal")
+        self.assertEqual(self.path.read_bytes(), snapshot)  # data.json untouched
+        record = json.loads(self.journal.read_text(encoding="utf-8"))
+        self.assertEqual([r["id"] for r in record["put"]], [items[0].id, item(10).id])
+        self.assertEqual(record["del"], [items[3].id])
+        self.assertNotEqual(DataService.kb_fingerprint(self.path), fp)
+
+        loaded = DataService.load_kb(self.path)
+        self.assertEqual([it.id for it in loaded], [it.id for it in edited])
+        self.assertEqual(loaded[0].answer, "Changed 0")
+        self.assertEqual(loaded[1].updated_at, datetime(2025, 8, 20))  # unchanged content keeps its timestamp
+        self.assertEqual(self.save(edited), "unchanged")
+
+        # A torn last record (crash mid-append) is skipped, and the next append starts a new line
+        with open(self.journal, "ab") as f:
+            f.write(b'{"put":[{"id":"q_x"')
+        self.assertEqual(len(DataService.load_kb(self.path)), 10)
+        self.assertEqual(self.save(edited[:-1]), "journal")
+        self.assertEqual([it.id for it in DataService.load_kb(self.path)], [it.id for it in edited[:-1]])
+
+    def test_compaction_folds_journal_and_prunes_backups(self):
+        self.save([item(i) for i in range(10)])
+        for n in range(3):
+            self.save([item(i, f"v{n}") if i == 0 else item(i) for i in range(10)])
+        expected = DataService.export_json(self.path)
+        self.assertTrue(kb_store.compact(self.path, keep=1))
+        self.assertFalse(self.journal.exists())
+        self.assertEqual(DataService.export_json(self.path), expected)
+        self.assertEqual(json.loads(expected)[0]["answer"], "v2 0")
+        self.assertEqual(len(list((self.path.parent / "backups").glob("data-*.json"))), 1)
+        self.assertFalse(kb_store.compact(self.path))
+
+    def test_full_saves_are_atomic_and_keep_limited_backups(self):
+        backups = self.path.parent / "backups"
+        backups.mkdir()
+        for n in range(5):
+            (backups / f"data-2025010{n}-000000.json").write_text("[]", encoding="utf-8")
+        self.save([item(1)], store="json")
+        with mock.patch.object(kb_store, "KB_BACKUPS", 3):
+            self.assertEqual(self.save([item(2)], store="json"), "full")
+        self.assertEqual(sorted(os.listdir(self.tmp.name)), ["backups", "data.json"])  # no temp files left
+        kept = sorted(p.name for p in backups.iterdir())
+        self.assertEqual(len(kept), 3)
+        self.assertEqual(kept[:2], ["data-20250103-000000.json", "data-20250104-000000.json"])
+        self.assertEqual([it.id for it in DataService.load_kb(self.path)], [item(2).id])
+        self.assertIn('\n  {\n    "id"', self.path.read_text(encoding="utf-8"))  # the original indented layout
+
+if __name__ == "__main__":
+    unittest.main()
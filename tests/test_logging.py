@@ -0,0 +1,77 @@
+import csv
+import multiprocessing
+import tempfile
+import unittest
+from pathlib import Path
+from app.services.csvlog import HAS_FCNTL
+from app.services.logging import _LogWriter
+
+
+def _log_many(tmp, tag, n):
+    w = _LogWriter(Path(tmp) / "unmatched.csv", Path(tmp) / "matched.log", background=False,
+                   max_bytes=600, backups=100)
+    for i in range(n):
+        w.submit("matched", f"{tag} query {i}", [("q", 1.0)])
+
+
+class TestLogWriter(unittest.TestCase):
+    def writer(self, tmp, **kw):
+        return _LogWriter(Path(tmp) / "unmatched.csv", Path(tmp) / "matched.log", **kw)
+
+    def test_batches_sanitizes_and_drains_on_close(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            w = self.writer(tmp, flush_ms=10000, flush_batch=1000)
+            for i in range(20):
+                w.submit("unmatched", f"mail me at user{i}@example.com", ["a", "b"])
+                w.submit("matched", f"query {i}", [("a", 0.5), ("b", 0.9)])
+            w.close()
+            with (Path(tmp) / "unmatched.csv").open(newline="", encoding="utf-8") as f:
+                rows = list(csv.reader(f))
+            self.assertEqual(rows[0], ["timestamp", "query", "top_suggestions"])
+            self.assertEqual(len(rows), 21)
+            self.assertEqual(rows[1][1:], ["mail me at [email]", "a | b"])
+            log = (Path(tmp) / "matched.log").read_text(encoding="utf-8")
+            self.assertEqual(log.count("Input: query"), 20)
+            self.assertLess(log.index("  b — 0.900"), log.index("  a — 0.500"))
+            st = w.stats()
+            self.assertEqual((st["written"], st["dropped"]), (40, 0))
+            self.assertFalse(w.submit("matched", "late", []))
+
+    def test_overflow_is_dropped_and_counted(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            w = self.writer(tmp, queue_size=5)
+            w._ensure_thread = lambda: None  # no consumer: the queue fills up
+            results = [w.submit("matched", f"q{i}", []) for i in range(8)]
+            self.assertEqual(results.count(False), 3)
+            self.assertEqual(w.stats()["dropped"], 3)
+
+    def test_size_rotation_keeps_backups(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            w = self.writer(tmp, background=False, max_bytes=100, backups=2)
+            for i in range(30):
+                w.submit("matched", f"query number {i}", [("q", 1.0)])
+            names = sorted(p.name for p in Path(tmp).iterdir())
+            self.assertEqual(names, ["matched.log", "matched.log.1", "matched.log.2", "matched.log.lock"])
+            self.assertIn("query number 29", (Path(tmp) / "matched.log").read_text(encoding="utf-8"))
+            self.assertGreater(w.stats()["rotations"], 2)
+
+    @unittest.skipUnless(HAS_FCNTL, "needs fcntl")
+    def test_processes_rotating_concurrently_lose_no_generation(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            ctx = multiprocessing.get_context("fork")
+            procs = [ctx.Process(target=_log_many, args=(tmp, tag, 200)) for tag in "abcd"]
+            for p in procs:
+                p.start()
+            for p in procs:
+                p.join(30)
+                self.assertEqual(p.exitcode, 0)
+            text = "".join(p.read_text(encoding="utf-8") for p in Path(tmp).glob("matched.log*")
+                           if not p.name.endswith(".lock"))
+            for tag in "abcd":
+                self.assertEqual(text.count(f"Input: {tag} query"), 200, tag)
+            for p in Path(tmp).glob("matched.log.*[0-9]"):
+                self.assertLess(p.stat().st_size, 600 + 100)  # each generation rotated once
+
+
+if __name__ == "__main__":
+    unittest.main()
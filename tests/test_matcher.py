@@ -1,5 +1,8 @@
+import threading
 import unittest
-from app.services.matcher import Matcher
+from unittest import mock
+from app.services import matcher as matcher_mod
+from app.services.matcher import Matcher, _fuzzy_ratio
 
 class TestMatcher(unittest.TestCase):
     def test_basic(self):
@@ -9,5 +12,92 @@ class TestMatcher(unittest.TestCase):
         ranked = m.score_all("I forgot my password")
         self.assertEqual(ranked[0][0], 0)
 
+    def test_candidate_cap(self):
+        q = [f"How to configure service {i}?" for i in range(50)] + ["Where is my order?"]
+        kw = [[f"service {i}"] for i in range(50)] + [["order tracking"]]
+        m = Matcher(q, kw, candidate_cap=10)
+        ranked = m.score_all("where is my order?")
+        self.assertLessEqual(len(ranked), 10)
+        self.assertEqual(ranked[0][0], 50)
+        # Keyword hits survive candidate retrieval even without a shared token
+        self.assertIn(50, m.keyword_hits("order tracking status"))
+
+    def test_sparse_bm25_matches_reference(self):
+        q = ["How to reset password?", "What is refund policy?", "Where is my order?", "Reset the order password"]
+        kw = [[], [], [], []]
+        m = Matcher(q, kw, bm25_backend="sparse")
+        if m.bm25_backend != "sparse":
+            self.skipTest("scipy not installed")
+        for query in ["reset password", "order order refund", "nothing here"]:
+            fast = m.bm25_scores(query)
+            for i in range(len(q)):
+                self.assertAlmostEqual(fast.get(i, 0.0), m.bm25_score(query, i), places=9)
+
+    def test_batched_fuzzy_matches_pairwise(self):
+        q = ["How to reset password?", "What is refund policy?", "Where is my ORDER?"]
+        m = Matcher(q, [[], [], []])
+        query = "my order where"
+        batch = m.fuzzy_scores(query, [2, 0])
+        self.assertAlmostEqual(batch[0], _fuzzy_ratio(query, q[2]), places=6)
+        self.assertAlmostEqual(batch[1], _fuzzy_ratio(query, q[0]), places=6)
+
+    def test_difflib_fallback_is_thread_safe(self):
+        q = ["How to reset password?", "What is refund policy?", "Where is my order?", "Reset order",
+             "How to restart Tomcat?", "VPN token expired", "Cancel my subscription"] * 6
+        m = Matcher(q, [[] for _ in q])
+        # difflib's ratio is not symmetric for these pairs, so the argument order is checked too
+        queries = ["reset my order", "where order", "password expired token", "my policy order"]
+        errors = []
+
+        def work(query):
+            try:
+                for _ in range(30):
+                    if m.fuzzy_scores(query, list(range(len(q)))) != expected[query]:
+                        errors.append(query)
+            except Exception as e:  # surfaced below; thread exceptions would not fail the test
+                errors.append(repr(e))
+
+        with mock.patch.object(matcher_mod, "HAS_RAPIDFUZZ", False):
+            expected = {query: [_fuzzy_ratio(query, x) for x in q] for query in queries}
+            threads = [threading.Thread(target=work, args=(query,)) for query in queries]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        self.assertEqual(errors, [])
+        self.assertFalse(hasattr(m, "_seq_cache"))
+
+    def test_topk_matches_score_all(self):
+        q = ["How to reset password?", "What is refund policy?", "Where is my order?", "Reset order"]
+        m = Matcher(q, [[], ["refund"], [], []])
+        for query in ["reset my order", "refund"]:
+            self.assertEqual(m.score_topk(query, 2), m.score_all(query)[:2])
+
+    def test_incremental_updates_match_fresh_build(self):
+        q = ["How to reset password?", "What is refund policy?", "Where is my order?", "Reset order"]
+        kw = [["reset password"], ["refund"], [], ["order"]]
+        base = Matcher(q, kw)
+        before = base.to_state()
+        m = base.copy()
+        m.update_document(1, "What is the return policy?", ["return", "refund"], refresh=False)
+        m.add_documents(["Cancel my order", "How to reset password?"], [["cancel"], []], refresh=False)
+        m.refresh()
+        q2 = [q[0], "What is the return policy?", q[2], q[3], "Cancel my order", "How to reset password?"]
+        kw2 = [kw[0], ["return", "refund"], kw[2], kw[3], ["cancel"], []]
+        fresh = Matcher(q2, kw2)
+        for name, value in fresh.to_state().items():
+            self.assertEqual(m.to_state()[name], value, name)
+        self.assertEqual(base.to_state(), before)  # the shared original is untouched
+        for query in ["reset password", "return refund", "order", "How to reset password?"]:
+            self.assertEqual(m.score_all(query), fresh.score_all(query))
+        # Removal moves the last document into the freed slot
+        self.assertEqual(m.remove_document(0), 5)
+        removed = Matcher(q2[-1:] + q2[1:-1], kw2[-1:] + kw2[1:-1])
+        self.assertEqual(m.to_state(), removed.to_state())
+        self.assertEqual((m.N, m.avgdl), (removed.N, removed.avgdl))
+        self.assertEqual(m.score_all("order policy"), removed.score_all("order policy"))
+        self.assertIsNone(m.remove_document(m.N - 1))
+        self.assertEqual(m.to_state(), Matcher(q2[-1:] + q2[1:-2], kw2[-1:] + kw2[1:-2]).to_state())
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,37 @@
+import unittest
+from app.services import metrics
+from app.services.matcher import Matcher
+
+
+class TestMetrics(unittest.TestCase):
+    def test_histogram_buckets_are_cumulative(self):
+        h = metrics.Histogram("t_seconds", "test", "stage", buckets=(0.001, 0.01))
+        for s in (0.0005, 0.001, 0.005, 2.0):
+            h.observe("bm25", s)
+        lines = h.render()
+        self.assertEqual(lines[:3], ['t_seconds_bucket{stage="bm25",le="0.001"} 2',
+                                     't_seconds_bucket{stage="bm25",le="0.01"} 3',
+                                     't_seconds_bucket{stage="bm25",le="+Inf"} 4'])
+        self.assertEqual(lines[-1], 't_seconds_count{stage="bm25"} 4')
+        self.assertAlmostEqual(float(lines[-2].split()[-1]), 2.0065)
+
+    def test_gauges_render_and_skip_failing_callbacks(self):
+        g = metrics.Gauge("t_rows", "test", lambda: {"reused": 3, "encoded": 1}, label="result", kind="counter")
+        self.assertEqual(g.render(), ['t_rows{result="encoded"} 1', 't_rows{result="reused"} 3'])
+        self.assertEqual(metrics.Gauge("t_bad", "test", lambda: 1 / 0).render(), [])
+        c = metrics.Counter("t_total", "test", "outcome")
+        c.inc('say "hi"')
+        self.assertEqual(c.render(), ['t_total{outcome="say \\"hi\\""} 1'])
+
+    def test_matcher_stages_recorded(self):
+        if not metrics.ENABLED:
+            self.skipTest("METRICS=0")
+        Matcher(["How to restart tomcat?", "Reset VPN password"], [["tomcat"], ["vpn"]]).score_all("restart tomcat")
+        text = metrics.render()
+        self.assertIn("# TYPE hal_ask_stage_seconds histogram", text)
+        for stage in ("tokenize", "bm25", "keywords", "fuzzy", "lexical"):
+            self.assertIn(f'hal_ask_stage_seconds_count{{stage="{stage}"}}', text)
+
+
+if __name__ == "__main__":
+    unittest.main()
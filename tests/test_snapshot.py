@@ -0,0 +1,112 @@
+import threading
+import time
+import unittest
+from datetime import datetime
+from unittest import mock
+from app.models.schemas import KBItem
+from app.services.data import DataService
+from app.services.embeddings import EmbeddingsService
+from app.services.matcher import Matcher
+from app.services.snapshot import KBDiff, KBSnapshot, SnapshotReloader, build_snapshot
+from app.services.suggest import SuggestIndex
+
+
+def wait_for(reloader, job, timeout=5.0):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        st = reloader.status()
+        if st["job"] >= job and st["state"] in ("ready", "failed"):
+            return st
+        time.sleep(0.01)
+    raise AssertionError("reload did not finish")
+
+
+class TestSnapshotReloader(unittest.TestCase):
+    def test_coalesces_requests_and_publishes_in_background(self):
+        gate, started = threading.Event(), threading.Event()
+        built, published = [], []
+
+        def build(progress, changes):
+            progress("lexical")
+            started.set()
+            gate.wait()
+            built.append(changes)
+            return KBSnapshot(len(built), [], [], None, None)
+
+        r = SnapshotReloader(build, published.append)
+        first = r.request("a")
+        self.assertEqual(first["state"], "building")
+        started.wait(5)
+        self.assertEqual(r.status()["stage"], "lexical")
+        r.request("b")
+        r.request("c")  # both arrive mid-build and collapse into one follow-up build
+        gate.set()
+        st = wait_for(r, 3)
+        self.assertEqual(st["state"], "ready")
+        self.assertEqual([s.version for s in published], [1, 2])
+        self.assertEqual(built, [["a"], ["b", "c"]])
+        gate.clear()
+        started.clear()
+        r.request("d")
+        started.wait(5)
+        r.request("e")
+        r.request()  # a request without a change makes the coalesced build a full one
+        gate.set()
+        wait_for(r, 6)
+        self.assertEqual(built[2:], [["d"], None])
+
+    def test_failure_is_reported(self):
+        seen = []
+
+        def build(progress, changes):
+            seen.append(changes)
+            raise ValueError("bad kb")
+
+        r = SnapshotReloader(build, lambda snap: None)
+        st = wait_for(r, r.request("a")["job"])
+        self.assertEqual((st["state"], st["error"]), ("failed", "ValueError: bad kb"))
+        wait_for(r, r.request("b")["job"])
+        self.assertEqual(seen, [["a"], None])  # the failed change is not lost: the next build is full
+
+
+def item(i, question, keywords=()):
+    return KBItem(id=str(i), question=question, answer="a", keywords=list(keywords), updated_at=datetime(2025, 1, 1))
+
+
+class TestIncrementalSnapshot(unittest.TestCase):
+    def build(self, items, prev=None, diffs=None):
+        embed = EmbeddingsService(model_dir="/nonexistent-model")
+        load = mock.Mock(return_value=items)
+        with mock.patch.object(DataService, "kb_fingerprint", return_value=None), \
+                mock.patch.object(DataService, "load_kb", load):
+            snap = build_snapshot(prev.version + 1 if prev else 1, embed, prev, diffs=diffs)
+        self.assertEqual(load.called, diffs is None or prev is None)
+        return snap
+
+    def test_append_upload_patches_previous_snapshot(self):
+        base = [item(i, f"question number {i}", ["kw%d" % i]) for i in range(10)]
+        v1 = self.build(base)
+        self.assertEqual(v1.stats["lexical_source"], "built")
+        puts = [item(3, "edited question three", ["new"]), item(10, "brand new one"),
+                base[5].model_copy(update={"answer": "new answer"})]
+        appended = base[:3] + [puts[0]] + base[4:5] + [puts[2]] + base[6:] + [puts[1]]
+        v2 = self.build(None, v1, [KBDiff(puts[:2], "full", None), KBDiff(puts[2:], "full", None)])
+        self.assertEqual(v2.stats["lexical_source"], "incremental")
+        self.assertEqual(v2.items, appended)
+        questions, keywords = [it.question for it in appended], [it.keywords for it in appended]
+        self.assertEqual(v2.matcher.to_state(), Matcher(questions, keywords).to_state())
+        self.assertEqual(v2.hashes, [EmbeddingsService._hash_question(q) for q in questions])
+        self.assertEqual(v2.suggest._keys, SuggestIndex(questions, keywords)._keys)
+        self.assertEqual(v1.matcher.questions[3], "question number 3")
+        # An answer-only change keeps the lexical structures; a journal no-op keeps the stored item
+        v3 = self.build(None, v2, [KBDiff([appended[5].model_copy(update={"answer": "other"})], "full", None),
+                                   KBDiff([appended[0].model_copy(update={"updated_at": datetime(2026, 1, 1)})],
+                                          "journal", None)])
+        self.assertIs(v3.matcher, v2.matcher)
+        self.assertIs(v3.suggest, v2.suggest)
+        self.assertEqual((v3.items[5].answer, v3.items[0].updated_at), ("other", appended[0].updated_at))
+        # Without a diff (replace uploads, other reloads) the KB is loaded and rebuilt
+        self.assertEqual(self.build(list(reversed(appended)), v2).stats["lexical_source"], "built")
+
+if __name__ == '__main__':
+    unittest.main()
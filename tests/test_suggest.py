@@ -0,0 +1,69 @@
+import unittest
+from app.services import suggest
+from app.services.suggest import SuggestIndex
+
+
+class TestSuggestIndex(unittest.TestCase):
+    QUESTIONS = [
+        "How to restart Tomcat?",
+        "Tomcat startup fails with 'Address already in use'",
+        "How to reset VPN password?",
+        "What is the refund policy?",
+    ]
+    KEYWORDS = [["tomcat"], ["tomcat", "port"], ["vpn", "password reset"], ["refund"]]
+
+    def setUp(self):
+        self.index = SuggestIndex(self.QUESTIONS, self.KEYWORDS)
+
+    def test_ranks_question_starts_before_keywords_and_inner_words(self):
+        self.assertEqual(self.index.complete("tom"), [self.QUESTIONS[1], self.QUESTIONS[0]])
+        self.assertEqual(self.index.complete("How to RE"), [self.QUESTIONS[0], self.QUESTIONS[2]])
+        self.assertEqual(self.index.complete("passw"), [self.QUESTIONS[2]])
+        self.assertEqual(self.index.complete("refund pol"), [self.QUESTIONS[3]])
+
+    def test_no_completion_for_stopwords_unknown_or_empty(self):
+        self.assertEqual(self.index.complete("the refund"), [])
+        self.assertEqual(self.index.complete("zzz"), [])
+        self.assertEqual(self.index.complete("  ?! "), [])
+
+    def test_precomputed_heads_match_a_full_scan(self):
+        questions = [f"Service {i % 7} fails on host {i}" for i in range(2000)]
+        index = SuggestIndex(questions, [[f"svc{i % 3}"] for i in range(2000)])
+        self.assertIn("s", index._head)
+        old = suggest.SCAN_MAX
+        suggest.SCAN_MAX = 10 ** 9
+        try:
+            scanned = SuggestIndex(questions, [[f"svc{i % 3}"] for i in range(2000)])
+        finally:
+            suggest.SCAN_MAX = old
+        self.assertEqual(scanned._head, {})
+        for prefix in ["s", "se", "service 3", "svc", "host 1", "fails on host 19"]:
+            self.assertEqual(index.complete(prefix, 10), scanned.complete(prefix, 10))
+        long_prefix = "service 3 fails on host 1003 and some more words past the key"
+        self.assertEqual(index.complete(long_prefix), [])
+        self.assertEqual(index.complete(questions[1003][:60]), [questions[1003]])
+
+    def test_patched_index_matches_a_rebuild(self):
+        questions = [f"Service {i % 7} fails on host {i}" for i in range(2000)]
+        keywords = [[f"svc{i % 3}"] for i in range(2000)]
+        index = SuggestIndex(questions, keywords)
+        edits = [(5, keywords[5], "Shared drive is full", ["storage"]),
+                 (6, keywords[6], "Service 6 fails on host 6", []),
+                 (2000, (), "Service desk hours", ["svc9"])]
+        patched = index.patched(edits)
+        for qi, _, q, kws in edits:
+            if qi < len(questions):
+                questions[qi], keywords[qi] = q, kws
+            else:
+                questions.append(q)
+                keywords.append(kws)
+        fresh = SuggestIndex(questions, keywords)
+        self.assertEqual(patched._keys, fresh._keys)
+        self.assertEqual(sorted(patched._head), sorted(fresh._head))
+        for prefix in ["s", "se", "service", "service 6", "sh", "storage", "svc", "svc9", "desk", "host 5"]:
+            self.assertEqual(patched.complete(prefix, 10), fresh.complete(prefix, 10), prefix)
+        self.assertEqual(index.complete("shared"), [])  # the original is untouched
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,35 @@
+import unittest
+from app.services.vector_index import IVFIndex, HAS_SKLEARN
+
+try:
+    import numpy as np
+except Exception:
+    np = None
+
+
+def unit_rows(n, dim=16, seed=0):
+    x = np.random.default_rng(seed).standard_normal((n, dim)).astype(np.float32)
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+@unittest.skipIf(np is None or not HAS_SKLEARN, "numpy/scikit-learn not installed")
+class TestIVFIndex(unittest.TestCase):
+    def test_full_probe_covers_every_row(self):
+        embs = unit_rows(200)
+        index = IVFIndex.build(embs, [str(i) for i in range(200)], nprobe=10 ** 6)
+        self.assertEqual(len(index.candidates(embs[3])), 200)
+
+    def test_rebuild_keeps_centroids_and_assignments(self):
+        embs = unit_rows(200)
+        hashes = [str(i) for i in range(200)]
+        first = IVFIndex.build(embs, hashes, nprobe=2)
+        # Drop row 0, append two new rows: old rows keep their list, centroids are reused
+        embs2 = np.vstack([embs[1:], unit_rows(2, seed=1)])
+        hashes2 = hashes[1:] + ["new-a", "new-b"]
+        second = IVFIndex.build(embs2, hashes2, prev=first, nprobe=2)
+        self.assertIs(second.centroids, first.centroids)
+        self.assertTrue(np.array_equal(second.assign[:199], first.assign[1:]))
+        self.assertIn(200, second.candidates(embs2[200]))
+
+if __name__ == '__main__':
+    unittest.main()